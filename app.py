@@ -2,12 +2,30 @@ import streamlit as st
 import pandas as pd
 import gspread
 from oauth2client.service_account import ServiceAccountCredentials
-import msoffcrypto
-import io
 from datetime import datetime, timedelta, timezone
 import time
 import plotly.express as px
 import plotly.graph_objects as go
+import os
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import multiprocessing
+from storage import (
+    create_storage, sync_storage, SheetsStorage, ScheduledStorage,
+    DATASET_COST, DATASET_ORDERS, DATASET_MEMORY, DATASET_AD_COST, DATASET_LEGACY, DATASET_ORDER_SHARDS
+)
+from stores import MemoryRuleStore, MasterCostIndex, AdCostStore
+from order_db import OrderDB, merge_upload, TYPED_SUFFIX
+from sales_report import read_report, read_reports, merge_reports
+from catalog import iter_mass_update
+from ids import clean_id, clean_ids
+from mirror import OrderMirror
+from cache import DatasetCache
+from quota import RequestScheduler
+from jobs import JobQueue, ACTIVE_STATUSES, STATUS_DONE
+from ledger import IngestLedger, file_digest
+from special import SpecialMatcher, pending_special, plan_reclassification, PENDING_NOTE
+from matching import smart_match
+from sku_index import SkuIndex
 
 # ==========================================
 # 1. 核心參數設定
@@ -17,6 +35,60 @@ LEGACY_SHEET_NAME = "蝦皮成本比對表2026" # (舊表)
 DB_SHEET_NAME = "蝦皮訂單總表"       # 銷售紀錄
 MEMORY_SHEET_NAME = "歸戶記憶庫"
 AD_COST_SHEET_NAME = "廣告費用紀錄"
+ORDER_SHARDS_SHEET_NAME = "分片索引"
+
+# 儲存後端: "sheets" (Google Sheets) / "local" (本機 SQLite) / "memory" (離線測試)
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "sheets")
+LOCAL_STORE_PATH = os.environ.get("LOCAL_STORE_PATH", "local_store.sqlite")
+# 歸戶記憶庫延後寫入：累積筆數 / 秒數達門檻即寫回
+MEMORY_FLUSH_SIZE = 50
+MEMORY_FLUSH_SECONDS = 30
+# 各資料集快取秒數 (None = 只在本程式寫入時才重新載入)
+CACHE_TTLS = {
+    DATASET_COST: 60,
+    DATASET_ORDERS: None,
+    DATASET_MEMORY: 300,
+    DATASET_AD_COST: 300,
+}
+# Google Sheets API 配額 (每位使用者每分鐘讀/寫次數) 與 429/5xx 重試次數
+SHEETS_READS_PER_MINUTE = 60
+SHEETS_WRITES_PER_MINUTE = 60
+SHEETS_MAX_RETRIES = 5
+# 上傳寫入後讀回抽查的區塊數 (None = 全部讀回)
+VERIFY_SAMPLE_RANGES = 5
+# 上傳比對時，除了報表本身的日期範圍外，前後再多讀取幾天的訂單分片 (訂單日期可能被蝦皮更正)
+ORDER_MATCH_MARGIN_DAYS = 31
+# 前台與待歸戶頁面預設顯示最近幾個月 (只下載這些月分片)
+ORDER_DEFAULT_MONTHS = 3
+# 頁面載入時平行預載資料集的執行緒數
+PREFETCH_WORKERS = 4
+# 訂單上傳背景工作：狀態存放目錄、畫面更新間隔 (秒)、顯示最近幾筆
+INGEST_JOBS_DIR = os.environ.get("INGEST_JOBS_DIR", "ingest_jobs")
+INGEST_POLL_SECONDS = 2
+INGEST_JOBS_SHOWN = 5
+# 一次上傳多份報表時，平行解密/解析的程序數
+REPORT_PARSE_WORKERS = max(1, min(4, os.cpu_count() or 1))
+# 上傳報表帳本 (同內容檔案不重複匯入) 與保留的解析結果份數
+INGEST_LEDGER_DIR = os.environ.get("INGEST_LEDGER_DIR", "ingest_ledger")
+INGEST_FRAME_CACHE = 20
+# mass_update.xlsx 每批處理的列數，與新增商品時每次 append_rows 的列數上限
+MASS_UPDATE_CHUNK_ROWS = 5000
+COST_APPEND_BATCH_ROWS = 1000
+# 訂單本機鏡像 (Parquet)：存放目錄、整份重新下載的間隔 (秒)。僅 Google Sheets 後端使用
+ORDER_MIRROR_DIR = os.environ.get("ORDER_MIRROR_DIR", "order_mirror")
+ORDER_MIRROR_FULL_RESYNC_SECONDS = 86400
+# 待歸戶/零成本訂單的真實商品建議：候選數、自動帶入第一名的最低分數 (0~1)
+SKU_SUGGEST_TOP_K = 5
+SKU_SUGGEST_MIN_SCORE = 0.35
+SHEET_LOCATIONS = {
+    DATASET_COST: (COST_SHEET_NAME, None),
+    DATASET_ORDERS: (DB_SHEET_NAME, None),
+    DATASET_MEMORY: (COST_SHEET_NAME, MEMORY_SHEET_NAME),
+    DATASET_AD_COST: (COST_SHEET_NAME, AD_COST_SHEET_NAME),
+    DATASET_LEGACY: (LEGACY_SHEET_NAME, None),
+    # 訂單月分片索引；各月分片 (YYYY-MM 分頁) 也放在訂單總表試算表中
+    DATASET_ORDER_SHARDS: (DB_SHEET_NAME, ORDER_SHARDS_SHEET_NAME),
+}
 
 SPECIAL_PRODUCTS = ["7777下單信用卡專區", "chatgpt續約區", "ChatGPT", "美圖秀秀", "補運費", "補差價", "專屬賣場", "客製化", "1元賣場"] 
 
@@ -121,14 +193,6 @@ inject_custom_css()
 def get_taiwan_time():
     return datetime.now(timezone.utc) + timedelta(hours=8)
 
-def clean_id(val):
-    if pd.isna(val) or val == "": return ""
-    s = str(val).strip()
-    if "e" in s.lower():
-        try: s = "{:.0f}".format(float(s))
-        except: pass
-    return s.replace(".0", "")
-
 @st.cache_resource
 def get_gspread_client():
     scope = ['https://spreadsheets.google.com/feeds', 'https://www.googleapis.com/auth/drive']
@@ -159,162 +223,138 @@ def get_gspread_client():
         st.code(str(e))
         raise e
 
-# === 廣告費用庫 ===
-def get_ad_costs_df(client):
+@st.cache_resource
+def get_cache():
+    return DatasetCache(ttls=CACHE_TTLS)
+
+@st.cache_resource
+def get_scheduler():
+    # 整個程序共用一個排程器，所有使用者的 Sheets 讀寫一起排隊計算配額
+    return RequestScheduler(read_per_minute=SHEETS_READS_PER_MINUTE, write_per_minute=SHEETS_WRITES_PER_MINUTE,
+                            max_retries=SHEETS_MAX_RETRIES)
+
+@st.cache_resource
+def get_storage():
+    return create_storage(STORAGE_BACKEND, client_factory=get_gspread_client, locations=SHEET_LOCATIONS,
+                          path=LOCAL_STORE_PATH, scheduler=get_scheduler())
+
+def get_sheets_storage():
+    """Google Sheets 後端 (經過配額排程)，本機模式同步時使用"""
+    return ScheduledStorage(SheetsStorage(get_gspread_client(), SHEET_LOCATIONS), get_scheduler())
+
+@st.cache_resource
+def get_order_mirror():
+    """前台統計用的本機訂單鏡像；本機儲存後端或未安裝 pyarrow 時不使用"""
+    if STORAGE_BACKEND != "sheets": return None
     try:
-        try: sheet = client.open(COST_SHEET_NAME).worksheet(AD_COST_SHEET_NAME)
-        except: 
-            sh = client.open(COST_SHEET_NAME)
-            sheet = sh.add_worksheet(title=AD_COST_SHEET_NAME, rows=500, cols=3)
-            sheet.append_row(["日期", "廣告費用", "登錄時間"])
-            return pd.DataFrame(columns=["日期", "廣告費用", "登錄時間"])
-        
-        data = sheet.get_all_values()
-        if len(data) <= 1: return pd.DataFrame(columns=["日期", "廣告費用", "登錄時間"])
-        df = pd.DataFrame(data[1:], columns=data[0])
-        # Clean up
-        df['廣告費用'] = pd.to_numeric(df['廣告費用'].astype(str).str.replace(',', ''), errors='coerce').fillna(0)
-        df['日期'] = pd.to_datetime(df['日期'], format='%Y-%m-%d', errors='coerce').dt.date
-        return df
-    except: return pd.DataFrame(columns=["日期", "廣告費用", "登錄時間"])
+        import pyarrow  # noqa: F401
+    except ImportError:
+        print("pyarrow not installed, order mirror disabled")
+        return None
+    return OrderMirror(get_storage(), ORDER_MIRROR_DIR, full_resync_seconds=ORDER_MIRROR_FULL_RESYNC_SECONDS)
 
-def save_ad_cost(client, target_date, cost_value):
+@st.cache_resource
+def get_order_db():
+    matcher = get_special_matcher()
+    return OrderDB(get_storage(), get_cache(), clock=get_taiwan_time, mirror=get_order_mirror(),
+                   classify=lambda df: pending_special(df, matcher))
+
+def set_date_range(prefix, start, end):
+    """快速選擇按鈕：同時改寫記憶的日期範圍與日期元件 (有 key 的 date_input 不會因 value 改變而重設)"""
+    for part, value in (('start', start), ('end', end)):
+        st.session_state[f'{prefix}_{part}'] = st.session_state[f'{prefix}_{part}_in'] = value
+
+def default_order_range(first_day, last_day):
+    """(最早日期, 最晚日期, 預設起始日)；預設起始為最近 ORDER_DEFAULT_MONTHS 個月的第一天"""
+    today = get_taiwan_time().date()
+    min_date = datetime.strptime(first_day, "%Y-%m-%d").date() if first_day else today
+    max_date = datetime.strptime(last_day, "%Y-%m-%d").date() if last_day else today
+    start = max_date.replace(day=1)
+    for _ in range(ORDER_DEFAULT_MONTHS - 1): start = (start - timedelta(days=1)).replace(day=1)
+    return min_date, max_date, max(min_date, start)
+
+# === 廣告費用庫 ===
+@st.cache_resource
+def get_ad_store():
+    return AdCostStore(get_storage(), get_cache(), clock=get_taiwan_time)
+
+def get_ad_costs_df():
+    try: return get_ad_store().frame()
+    except Exception as e:
+        print(f"Error loading ad costs: {e}")
+        st.warning(f"⚠️ 廣告費用讀取失敗：{e}")
+        return pd.DataFrame(columns=["日期", "廣告費用", "登錄時間"])
+
+def get_period_ad_cost(start_date, end_date):
+    try: return get_ad_store().range_sum(start_date, end_date)
+    except Exception as e:
+        print(f"Error loading ad cost: {e}")
+        st.warning(f"⚠️ 廣告費用讀取失敗，本期間以 0 計算：{e}")
+        return 0
+
+def save_ad_cost(target_date, cost_value):
     try:
-        try: sheet = client.open(COST_SHEET_NAME).worksheet(AD_COST_SHEET_NAME)
-        except: 
-            sheet = client.open(COST_SHEET_NAME).add_worksheet(title=AD_COST_SHEET_NAME, rows=500, cols=3)
-            sheet.append_row(["日期", "廣告費用", "登錄時間"])
-        
-        data = sheet.get_all_values()
-        target_date_str = target_date.strftime("%Y-%m-%d")
-        now_str = get_taiwan_time().strftime("%Y-%m-%d %H:%M:%S")
-        
-        # 尋找是否已有該日期的紀錄
-        row_idx = None
-        for i, row in enumerate(data):
-            if i > 0 and len(row) > 0 and row[0] == target_date_str:
-                row_idx = i + 1
-                break
-                
-        if row_idx:
-            sheet.update_cell(row_idx, 2, cost_value)
-            sheet.update_cell(row_idx, 3, now_str)
-        else:
-            sheet.append_row([target_date_str, cost_value, now_str])
+        get_ad_store().upsert(target_date, cost_value)
         return True
     except Exception as e:
         print(f"Error saving ad cost: {e}")
         return False
 
 # === 記憶庫 ===
-def get_memory_rules(client):
-    try:
-        try: sheet = client.open(COST_SHEET_NAME).worksheet(MEMORY_SHEET_NAME)
-        except: 
-            sh = client.open(COST_SHEET_NAME)
-            sheet = sh.add_worksheet(title=MEMORY_SHEET_NAME, rows=100, cols=4)
-            sheet.append_row(["蝦皮商品名稱", "蝦皮規格名稱", "真實SKU名稱", "真實成本"])
-            return {}
-        
-        data = sheet.get_all_values()
-        if len(data) <= 1: return {}
-        rules = {}
-        for row in data[1:]:
-            # 支援舊版(3欄) 與 新版(4欄)
-            if len(row) >= 4:
-                # Key: (商品名稱, 規格名稱)
-                key = (row[0].strip(), row[1].strip())
-                rules[key] = {'sku': row[2], 'cost': float(row[3])}
-            elif len(row) == 3:
-                # 舊版資料，將規格視為空字串，或只對應名稱
-                key = (row[0].strip(), "")
-                rules[key] = {'sku': row[1], 'cost': float(row[2])}
-        return rules
-    except: return {}
-
-def save_memory_rule(client, shopee_name, shopee_option, real_sku, real_cost):
-    try:
-        try: sheet = client.open(COST_SHEET_NAME).worksheet(MEMORY_SHEET_NAME)
-        except: sheet = client.open(COST_SHEET_NAME).add_worksheet(title=MEMORY_SHEET_NAME, rows=100, cols=4)
-        
-        shopee_name = str(shopee_name).strip()
-        shopee_option = str(shopee_option).strip()
-        
-        # 檢查是否已存在 (避免重複)
-        data = sheet.get_all_values()
-        exists = False
-        for row in data:
-            if len(row) >= 4:
-                if row[0].strip() == shopee_name and row[1].strip() == shopee_option:
-                    exists = True; break
-            elif len(row) == 3:
-                if row[0].strip() == shopee_name and shopee_option == "":
-                    exists = True; break
-        
-        if not exists:
-            # 寫入格式: 名稱, 規格, 真實SKU, 真實成本
-            sheet.append_row([shopee_name, shopee_option, real_sku, real_cost])
-            return True
-    except: pass
+@st.cache_resource
+def get_memory_store():
+    return MemoryRuleStore(get_storage(), get_cache(), flush_size=MEMORY_FLUSH_SIZE, flush_interval=MEMORY_FLUSH_SECONDS)
+
+def get_memory_rules(warn=None, store=None):
+    try: return (store or get_memory_store()).rules()
+    except Exception as e:
+        # 不再默默回傳空規則：讓使用者知道這次沒有套用記憶庫
+        print(f"Error loading memory rules: {e}")
+        (warn or st.warning)(f"⚠️ 歸戶記憶庫讀取失敗 (已重試)，本次不套用記憶規則：{e}")
+        return {}
+
+def save_memory_rule(shopee_name, shopee_option, real_sku, real_cost):
+    """加入記憶規則 (寫入會延後批次進行，批次結束請呼叫 flush_memory_rules)"""
+    try: return get_memory_store().add(shopee_name, shopee_option, real_sku, real_cost)
+    except Exception as e: print(f"Error saving memory rule: {e}")
     return False
 
-def update_master_cost_sheet(client, real_sku_name, new_cost):
+def flush_memory_rules():
+    try: return get_memory_store().flush()
+    except Exception as e: print(f"Error flushing memory rules: {e}")
+    return 0
+
+@st.cache_resource
+def get_cost_index():
+    cache, storage = get_cache(), get_storage()
+    # 與 cached_cost_table 共用同一份快取，每個成本表版本只讀取一次
+    return MasterCostIndex(storage, cache, load_values=lambda: cache.get(DATASET_COST, lambda: load_cost_dataset(storage))[2])
+
+def update_master_costs(pairs):
     """
-    更新主成本表 (Cost Sheet) 中的成本
-    由於 Menu_Label 是 "Name | Cost"，我們主要透過 Name 來比對。
-    此功能會搜尋商品名稱並更新其成本欄位。
+    批次更新主成本表 (Cost Sheet) 中的成本
+    pairs = [(商品名稱 或 "商品名稱 | 成本$XXX", 新成本), ...]，透過名稱索引定位後一次寫回。
+    回傳成功更新的商品數
     """
+    if not pairs: return 0
     try:
-        sheet = client.open(COST_SHEET_NAME).sheet1
-        # 讀取所有資料 (注意：如果資料量非常大，這樣全讀可能會慢，但在普通規模下這是最安全的)
-        data = sheet.get_all_values()
-        if not data: return False
-        
-        headers = data[0]
-        try: 
-            # 嘗試找尋正確的欄位 index
-            name_idx = headers.index('商品名稱') if '商品名稱' in headers else headers.index('商品')
-            cost_idx = headers.index('成本')
-        except: return False
-        
-        # real_sku_name 從介面傳來是 "商品名稱 | 成本$XXX" 或 "商品名稱"
-        if " | 成本$" in real_sku_name:
-            target_name = real_sku_name.split(' | 成本$')[0].strip()
-        else:
-            target_name = real_sku_name.strip()
-            
-        cell_to_update = None
-        
-        # 尋找目標行 (從資料的第2行開始，對應 sheet row 2)
-        # sheet.update_cell 接受 (row, col) 其中 row 是從1開始
-        for i, row in enumerate(data):
-            if i == 0: continue # Skip header
-            
-            # 確保不會 index out of range
-            if len(row) > name_idx:
-                row_name_val = str(row[name_idx]).strip()
-                # 簡單字串比對
-                if row_name_val == target_name:
-                    cell_to_update = (i + 1, cost_idx + 1)
-                    break
-        
-        if cell_to_update:
-            sheet.update_cell(cell_to_update[0], cell_to_update[1], new_cost)
-            return True
-        return False
-        
+        updated, missing = get_cost_index().update_costs(pairs)
+        if missing: print(f"Master cost not found: {missing}")
+        return len(updated)
     except Exception as e:
         print(f"Error updating master cost: {e}")
-        return False
+        return 0
+
+def update_master_cost_sheet(real_sku_name, new_cost):
+    """更新單一商品成本 (由於 Menu_Label 是 "Name | Cost"，透過 Name 來比對)"""
+    return update_master_costs([(real_sku_name, new_cost)]) > 0
 
 # ==========================================
 # 3. 資料讀取
 # ==========================================
 def get_cost_sheet_raw():
     try:
-        client = get_gspread_client()
-        sheet = client.open(COST_SHEET_NAME).sheet1
-        data = sheet.get_all_values()
+        data = get_storage().get_values(DATASET_COST)
         df = pd.DataFrame(data[1:], columns=data[0])
         df['原始行號'] = range(2, len(df) + 2)
         if '商品' in df.columns and '商品名稱' not in df.columns:
@@ -322,115 +362,201 @@ def get_cost_sheet_raw():
         return df
     except: return None
 
-@st.cache_data(ttl=60)
-def load_cloud_cost_table():
-    try:
-        client = get_gspread_client()
-        sheet = client.open(COST_SHEET_NAME).sheet1
-        data = sheet.get_all_values()
-        if len(data) <= 1: return None, sheet
-        
-        # === 強韌標題判斷 ===
-        if "商品" in str(data[0]) or "成本" in str(data[0]):
-            df = pd.DataFrame(data[1:], columns=data[0])
-        else:
-            expected = ['商品名稱', '蝦皮商品編碼', '成本']
-            if len(data[0]) > 3: expected += [f"Col_{i}" for i in range(4, len(data[0])+1)]
-            df = pd.DataFrame(data, columns=expected[:len(data[0])])
-            st.warning("⚠️ 偵測到表頭缺失，已自動補全。")
+def parse_cost_table(data):
+    """將商品編碼表 values 整理成成本查詢表，回傳 (df, 提示訊息)；df 為 None 時訊息即失敗原因"""
+    if len(data) <= 1: return None, None
+    notice = None
+    
+    # === 強韌標題判斷 ===
+    if "商品" in str(data[0]) or "成本" in str(data[0]):
+        df = pd.DataFrame(data[1:], columns=data[0])
+    else:
+        expected = ['商品名稱', '蝦皮商品編碼', '成本']
+        if len(data[0]) > 3: expected += [f"Col_{i}" for i in range(4, len(data[0])+1)]
+        df = pd.DataFrame(data, columns=expected[:len(data[0])])
+        notice = "⚠️ 偵測到表頭缺失，已自動補全。"
 
-        df.columns = df.columns.str.strip()
-        if '商品' in df.columns: df.rename(columns={'商品': '商品名稱'}, inplace=True)
-            
-        if '蝦皮商品編碼' not in df.columns or '成本' not in df.columns:
-            st.error(f"❌ 『{COST_SHEET_NAME}』缺少關鍵欄位。偵測到：{list(df.columns)}")
-            return None, sheet
-
-        df['蝦皮商品編碼'] = df['蝦皮商品編碼'].apply(clean_id)
-        df['成本'] = pd.to_numeric(df['成本'].astype(str).str.replace(',', ''), errors='coerce').fillna(0)
-        df['Menu_Label'] = df['商品名稱'] + " | 成本$" + df['成本'].astype(str)
-        df['has_cost'] = df['成本'] > 0
-        df = df.sort_values(by=['蝦皮商品編碼', 'has_cost'], ascending=[True, True])
-        df = df.drop_duplicates(subset=['蝦皮商品編碼'], keep='last')
+    df.columns = df.columns.str.strip()
+    if '商品' in df.columns: df.rename(columns={'商品': '商品名稱'}, inplace=True)
         
-        return df, sheet
+    if '蝦皮商品編碼' not in df.columns or '成本' not in df.columns:
+        return None, f"❌ 『{COST_SHEET_NAME}』缺少關鍵欄位。偵測到：{list(df.columns)}"
+
+    df['蝦皮商品編碼'] = clean_ids(df['蝦皮商品編碼'])
+    df['成本'] = pd.to_numeric(df['成本'].astype(str).str.replace(',', ''), errors='coerce').fillna(0)
+    df['Menu_Label'] = df['商品名稱'] + " | 成本$" + df['成本'].astype(str)
+    df['has_cost'] = df['成本'] > 0
+    df = df.sort_values(by=['蝦皮商品編碼', 'has_cost'], ascending=[True, True])
+    df = df.drop_duplicates(subset=['蝦皮商品編碼'], keep='last')
+    
+    return df, notice
+
+def load_cost_dataset(storage):
+    """讀取一次商品編碼表 → (成本查詢表, 提示訊息, 原始 values)；原始 values 供 MasterCostIndex 建立列號索引"""
+    values = storage.get_values(DATASET_COST)
+    return (*parse_cost_table(values), values)
+
+def cached_cost_table(cache, storage):
+    df, notice, _ = cache.get(DATASET_COST, lambda: load_cost_dataset(storage))
+    return df, notice
+
+def load_cloud_cost_table():
+    """成本查詢表 (共用快取，唯讀；成本表有寫入時才會重新載入)"""
+    try:
+        df, notice = cached_cost_table(get_cache(), get_storage())
     except Exception as e:
         st.error(f"❌ 讀取『{COST_SHEET_NAME}』失敗：{e}")
-        return None, None
+        return None
+    if notice:
+        if df is None: st.error(notice)
+        else: st.warning(notice)
+    return df
+
+# === 真實商品建議 ===
+@st.cache_resource
+def get_sku_index_slot():
+    return {}
+
+def get_sku_index(df_cost):
+    """成本表的 n-gram 索引；依成本表在資料集快取中的世代 (有寫入才會遞增) 沿用，不因快取逾時重新載入而重建"""
+    slot = get_sku_index_slot()
+    version = get_cache().generation(DATASET_COST)
+    if slot.get('version') != version:
+        slot['index'] = SkuIndex(df_cost['商品名稱'].astype(str), df_cost['Menu_Label'])
+        slot['version'] = version
+    return slot['index']
+
+def suggest_real_products(df, df_cost):
+    """
+    待歸戶訂單 → (建議商品, 其他候選) 兩個 Series (index 同 df)。
+    第一名分數達 SKU_SUGGEST_MIN_SCORE 才列為建議商品 (否則為空字串)，其餘候選附分數列出供參考。
+    建議不會直接帶入「真實商品」：操作者自行選擇或勾選「採用建議」後才會歸戶並寫入記憶庫。
+    """
+    index = get_sku_index(df_cost)
+    blank = pd.Series("", index=df.index)
+    best, others = [], []
+    for name, option, note in zip(df['商品名稱'], df.get('商品選項名稱', blank), df.get('買家備註', blank)):
+        found = index.search(name, option, note, k=SKU_SUGGEST_TOP_K)
+        pick = found[0][0] if found and found[0][1] >= SKU_SUGGEST_MIN_SCORE else None
+        best.append(pick or "")
+        others.append(" / ".join(f"{label} ({score:.2f})" for label, score in found if label != pick))
+    return pd.Series(best, index=df.index), pd.Series(others, index=df.index)
+
+def confirmed_real_product(row):
+    """編輯表的一列 → 操作者確認的真實商品：手動選擇優先，其次為勾選「採用建議」的建議商品；都沒有則為預設選項"""
+    real_item = row['真實商品']
+    if real_item == "請選擇對應的真實商品..." and row.get('採用建議') and row.get('建議商品'): return row['建議商品']
+    return real_item
+
+# === 平行預載 ===
+@st.cache_resource
+def get_prefetch_pool():
+    return ThreadPoolExecutor(max_workers=PREFETCH_WORKERS, thread_name_prefix="prefetch")
+
+def order_prefetch(order_db, cache, typed=False):
+    """
+    預載訂單時要讀的 (快取 key, loader)；key 即 loader 會填入的快取項目，已新鮮時 cache.prefetch 不再重送。
+    typed=True 為前台 (鏡像的有型別版本)，否則為後台/上傳比對讀取的原始 values。
+    索引還沒快取時先取索引 (未分片才接著讀訂單)；已分片時月分片等日期範圍決定後才下載，這裡不預載。
+    """
+    typed = typed and order_db.mirror is not None
+    key, read = (DATASET_ORDERS + TYPED_SUFFIX, order_db.typed_frame) if typed else (DATASET_ORDERS, order_db.values)
+    if not cache.is_fresh(DATASET_ORDER_SHARDS):
+        def load():
+            if not order_db.is_sharded(): read()
+        return DATASET_ORDER_SHARDS, load
+    if order_db.is_sharded(): return None, None
+    return key, read
+
+def prefetch_datasets(*datasets, typed_orders=False):
+    """
+    在背景同時下載尚未快取的資料集，回傳 {快取 key: Future}。
+    之後的 order_db.frame() / load_cloud_cost_table() 等呼叫會直接拿到預載結果，
+    等待時間取決於最慢的一張表，而不是全部相加。
+    typed_orders=True 時訂單預載前台讀取的有型別版本 (見 order_prefetch)。
+    """
+    cache, storage = get_cache(), get_storage()
+    # 物件先在主執行緒取好，背景執行緒內不呼叫任何 st.*
+    order_db, memory_store, ad_store = get_order_db(), get_memory_store(), get_ad_store()
+    loaders = {
+        DATASET_COST: lambda: cached_cost_table(cache, storage),
+        DATASET_MEMORY: memory_store.rules,
+        DATASET_AD_COST: ad_store.frame,
+    }
+    tasks = {}
+    for ds in datasets:
+        if ds != DATASET_ORDERS: tasks[ds] = loaders[ds]; continue
+        key, loader = order_prefetch(order_db, cache, typed=typed_orders)
+        if key is not None: tasks[key] = loader
+    return cache.prefetch(tasks, get_prefetch_pool())
 
 def process_mass_update_file(uploaded_file):
-    try:
-        try: import python_calamine; engine = 'calamine'
-        except: engine = 'openpyxl'
-        try: df = pd.read_excel(uploaded_file, header=2, engine=engine)
-        except: return None
-        df = df.dropna(subset=['商品ID'])
-        df['key'] = df['商品ID'].apply(clean_id) + "_" + df['商品選項ID'].apply(clean_id)
-        df['Full_Name'] = df['商品名稱'].astype(str)
-        if '商品規格名稱' in df.columns:
-             df['Full_Name'] += " [" + df['商品規格名稱'].astype(str).fillna('') + "]"
-        return df[['Full_Name', 'key']]
-    except: return None
+    """mass_update.xlsx → 逐批 (MASS_UPDATE_CHUNK_ROWS 列) 產生 (DataFrame[Full_Name, key], 已讀列數, 總列數)"""
+    return iter_mass_update(uploaded_file.getvalue(), MASS_UPDATE_CHUNK_ROWS)
+
+def prepare_sales_report(df):
+    # 重複列已在 read_report 以完整欄位去除 (此時只剩部分欄位，不能再去重複)
+    if '蝦皮商品編碼' in df.columns: df['蝦皮商品編碼'] = clean_ids(df['蝦皮商品編碼'])
+    return df
 
-def load_sales_report(uploaded_file):
+def load_sales_report(uploaded_file, on_error=None):
     try:
-        file_content = uploaded_file.getvalue()
-        try: df = pd.read_excel(io.BytesIO(file_content), engine='openpyxl')
-        except:
-            decrypted = io.BytesIO()
-            office_file = msoffcrypto.OfficeFile(io.BytesIO(file_content))
-            office_file.load_key(password=EXCEL_PWD)
-            office_file.decrypt(decrypted)
-            decrypted.seek(0)
-            df = pd.read_excel(decrypted)
-        
-        df.columns = df.columns.astype(str).str.strip().str.replace('\n', '')
-        mapping = {'蝦皮商品編碼 (商品ID_規格ID)': '蝦皮商品編碼', '商品總價': '售價', '訂單小計 (撥款金額)': '進蝦皮錢包', '買家支付運費': '運費'}
-        for col in df.columns:
-            if "撥款金額" in col or "進蝦皮錢包" in col or "進帳" in col: mapping[col] = "進蝦皮錢包"
-            if "商品編碼" in col and "規格" in col: mapping[col] = "蝦皮商品編碼"
-            if "規格名稱" in col: mapping[col] = "商品選項名稱" # 新增映射
-            if "買家" in col and "備註" in col: mapping[col] = "買家備註"
-        df.rename(columns=mapping, inplace=True)
-        if '蝦皮商品編碼' in df.columns: df['蝦皮商品編碼'] = df['蝦皮商品編碼'].apply(clean_id)
-        df = df.drop_duplicates()
-        return df
-    except Exception as e: st.error(f"Excel 解析失敗: {e}"); return None
+        # 依檔頭判斷是否加密 (只解密一次)，calamine 解析，去除重複列後只保留 process_orders 需要的欄位
+        return prepare_sales_report(read_report(uploaded_file.getvalue(), EXCEL_PWD))
+    except Exception as e: (on_error or st.error)(f"Excel 解析失敗: {e}"); return None
+
+@st.cache_resource
+def get_report_pool():
+    # spawn：不複製 Streamlit 主程序 (含各種執行緒與連線)，子程序只載入 sales_report
+    return ProcessPoolExecutor(max_workers=REPORT_PARSE_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+
+def load_sales_reports(files, pool=None, on_error=None, ledger=None, on_warning=None):
+    """
+    files = [(檔名, 檔案內容), ...] (依檔名排序 = 依報表日期先後)。
+    各檔案在 pool 中平行解析後合併成一份，同一訂單以較新的報表為準；任一檔案失敗即回傳 None。
+    on_error / on_warning 預設為 st.error / st.warning (背景工作中請改傳 job.log)。
+    有 ledger 時先找先前解析過的結果，新解析的也存進去。
+    """
+    digests = [file_digest(data) for _, data in files]
+    frames = [ledger.load_frame(d) if ledger is not None else None for d in digests]
+    todo = [i for i, df in enumerate(frames) if df is None]
+    results = read_reports([files[i][1] for i in todo], EXCEL_PWD, pool, on_warning=on_warning or st.warning)
+    for i, (df, err) in zip(todo, results):
+        if df is None: (on_error or st.error)(f"{files[i][0]} Excel 解析失敗: {err}"); return None
+        if ledger is not None: ledger.save_frame(digests[i], df)
+        frames[i] = df
+    return prepare_sales_report(merge_reports([df.copy() for df in frames]))
 
 # ==========================================
 # 4. 寫入邏輯
 # ==========================================
-def sync_new_products(new_products_df, sheet, progress_bar):
-    current_data = sheet.get_all_values()
+def sync_new_products(chunks, storage, progress_bar):
+    """chunks = process_mass_update_file() 的結果；編碼表沒有的 key 每 COST_APPEND_BATCH_ROWS 列 append 一次"""
+    current_data = storage.get_values(DATASET_COST)
     if len(current_data) > 1:
-        current_ids = set([clean_id(row[1]) for row in current_data[1:]])
+        current_ids = set(clean_ids(pd.Series([row[1] if len(row) > 1 else "" for row in current_data[1:]], dtype=object)))
     else:
         current_ids = set()
-        if not current_data: sheet.append_row(['商品名稱', '蝦皮商品編碼', '成本'])
-    rows_to_add = []
-    for _, row in new_products_df.iterrows():
-        if row['key'] not in current_ids and row['key'] != "_":
-            rows_to_add.append([row['Full_Name'], row['key'], 0])
-            current_ids.add(row['key'])
-    if rows_to_add: sheet.append_rows(rows_to_add); return len(rows_to_add)
-    return 0
+        if not current_data: storage.append_rows(DATASET_COST, [['商品名稱', '蝦皮商品編碼', '成本']])
+    added = 0
+    for chunk, done, total in chunks:
+        fresh = chunk[(chunk['key'] != "_") & ~chunk['key'].isin(current_ids)].drop_duplicates(subset=['key'])
+        current_ids.update(fresh['key'])
+        rows_to_add = [[name, key, 0] for name, key in zip(fresh['Full_Name'], fresh['key'])]
+        for start in range(0, len(rows_to_add), COST_APPEND_BATCH_ROWS):
+            storage.append_rows(DATASET_COST, rows_to_add[start:start + COST_APPEND_BATCH_ROWS])
+        added += len(rows_to_add)
+        progress_bar.progress(min(99, int(done * 100 / max(total, 1))), text=f"已讀取 {done}/{total} 列，新增 {added} 筆...")
+    progress_bar.progress(100, text="完成")
+    return added
 
 def auto_fill_costs_from_legacy(progress_bar):
-    client = get_gspread_client()
+    storage = get_storage()
     progress_bar.progress(10, text=f"搜尋舊表『{LEGACY_SHEET_NAME}』...")
     try:
-        sh = client.open(LEGACY_SHEET_NAME)
-        worksheets = sh.worksheets()
-        target_ws = None; df_old = None
-        for ws in worksheets:
-            data = ws.get_all_values()
-            if len(data) > 2: 
-                row1 = str(data[0])
-                if "編碼" in row1 or "ID" in row1 or "成本" in row1:
-                    target_ws = ws
-                    df_old = pd.DataFrame(data[1:], columns=data[0])
-                    break
-        if df_old is None: return f"❌ 舊表無資料"
+        data = storage.get_values(DATASET_LEGACY)
+        if len(data) <= 2: return f"❌ 舊表無資料"
+        df_old = pd.DataFrame(data[1:], columns=data[0])
 
         df_old.columns = df_old.columns.str.strip()
         col_id = None; col_cost = None
@@ -441,17 +567,15 @@ def auto_fill_costs_from_legacy(progress_bar):
         if not col_id or not col_cost: return f"❌ 欄位對應失敗"
         
         cost_map = {}
-        for _, row in df_old.iterrows():
-            code = clean_id(row[col_id])
-            try: cost = float(str(row[col_cost]).replace(',', ''))
+        for code, raw_cost in zip(clean_ids(df_old[col_id]), df_old[col_cost]):
+            try: cost = float(str(raw_cost).replace(',', ''))
             except: cost = 0
             if cost > 0: cost_map[code] = cost
     except Exception as e: return f"❌ 讀取舊表失敗：{e}"
 
     progress_bar.progress(40, text=f"讀取新表『{COST_SHEET_NAME}』...")
     try:
-        new_sheet = client.open(COST_SHEET_NAME).sheet1
-        new_data = new_sheet.get_all_values()
+        new_data = storage.get_values(DATASET_COST)
         if "商品" in str(new_data[0]) or "成本" in str(new_data[0]): df_new = pd.DataFrame(new_data[1:], columns=new_data[0])
         else:
              expected = ['商品名稱', '蝦皮商品編碼', '成本']
@@ -466,10 +590,9 @@ def auto_fill_costs_from_legacy(progress_bar):
 
     progress_bar.progress(60, text="寫入成本資料...")
     updated_count = 0
-    for i, row in df_new.iterrows():
-        code = clean_id(row[new_col_id])
+    for i, code, raw_cost in zip(df_new.index, clean_ids(df_new[new_col_id]), df_new[new_col_cost]):
         current_cost = 0
-        try: current_cost = float(str(row[new_col_cost]).replace(',', ''))
+        try: current_cost = float(str(raw_cost).replace(',', ''))
         except: pass
         if current_cost == 0 and code in cost_map:
             df_new.at[i, new_col_cost] = cost_map[code]
@@ -477,26 +600,21 @@ def auto_fill_costs_from_legacy(progress_bar):
 
     if updated_count > 0:
         updated_values = [df_new.columns.tolist()] + df_new.astype(str).values.tolist()
-        new_sheet.clear(); new_sheet.update(updated_values)
+        storage.replace_values(DATASET_COST, updated_values)
         progress_bar.progress(100, text="完成！")
         return f"✅ 成功救援 {updated_count} 筆成本資料！"
     else: 
         progress_bar.progress(100, text="完成！")
         return "✅ 無需更新"
 
-def normalize_name(name):
+def process_orders(df_sales, df_cost, progress_bar, order_db, matcher, memory_store):
     """
-    將名稱進行標準化處理，移除空白、全形轉半形、統一大小寫
+    比對上傳的訂單並寫回訂單總表，回傳結果訊息。
+    progress_bar 需提供 progress(值, text=...) 與 log(level, 訊息)；
+    本函式在背景工作中執行，不直接呼叫 st.*，診斷訊息一律透過 log 回報；
+    order_db / matcher / memory_store 由送出工作的主執行緒取好傳入 (背景執行緒沒有 ScriptRunContext，不能呼叫 st.cache_resource)。
     """
-    if not isinstance(name, str): return str(name)
-    name = name.strip().lower()
-    # 移除所有空白 (包含全形空白)
-    name = name.replace(" ", "").replace("　", "")
-    # 標點符號標準化
-    name = name.replace("，", ",").replace("（", "(").replace("）", ")").replace("【", "[").replace("】", "]")
-    return name
-
-def process_orders(df_sales, df_cost, progress_bar):
+    log = progress_bar.log
     required_cols = ['訂單編號', '商品名稱']
     for col in required_cols:
         if col not in df_sales.columns: return f"❌ 失敗：報表找不到『{col}』。"
@@ -524,9 +642,6 @@ def process_orders(df_sales, df_cost, progress_bar):
     df_merged['總利潤'] = df_merged['進蝦皮錢包'] - df_merged['成本']
     
     progress_bar.progress(50, text=f"比對 {DB_SHEET_NAME}...")
-    client = get_gspread_client()
-    try: db_sheet = client.open(DB_SHEET_NAME).sheet1
-    except: return f"❌ 找不到資料庫：{DB_SHEET_NAME}"
     
     headers = ['訂單編號', '訂單成立日期', '商品名稱', '商品選項名稱', '數量', '售價', '成交手續費', '金流與系統處理費', '其他服務費', '蝦皮付費總金額', '進蝦皮錢包', '成本', '總利潤', '蝦皮商品編碼', '買家備註', '資料備份時間', '備註']
     
@@ -534,91 +649,41 @@ def process_orders(df_sales, df_cost, progress_bar):
     df_upload_ready['資料備份時間'] = get_taiwan_time().strftime("%Y-%m-%d %H:%M:%S")
     df_upload_ready['備註'] = "" 
     
-    memory_rules = get_memory_rules(client)
+    memory_rules = get_memory_rules(warn=lambda msg: log('warning', msg), store=memory_store)
     if '商品名稱' in df_upload_ready.columns:
-        mask_special = df_upload_ready['商品名稱'].astype(str).apply(lambda x: any(sp in x for sp in SPECIAL_PRODUCTS))
-        df_upload_ready.loc[mask_special, '備註'] = "待人工確認"
+        mask_special = matcher.mask(df_upload_ready['商品名稱'])
+        df_upload_ready.loc[mask_special, '備註'] = PENDING_NOTE
         df_upload_ready.loc[mask_special, '總利潤'] = 0
         
-        # 建立成本查詢表 (for Smart Match)
-        name_cost_map = {}
-        normalized_cost_map = {} # 新增：標準化查詢表
-        
-        if not df_cost.empty and '商品名稱' in df_cost.columns and '成本' in df_cost.columns:
-            for _, r in df_cost.iterrows():
-                raw_name = str(r['商品名稱']).strip()
-                cost_val = float(r['成本'])
-                name_cost_map[raw_name] = cost_val
-                
-                # 建立模糊比對鍵值
-                norm_name = normalize_name(raw_name)
-                normalized_cost_map[norm_name] = {'cost': cost_val, 'sku': raw_name}
-
-        for idx, row in df_upload_ready[mask_special].iterrows():
-            p_name = str(row['商品名稱']).strip()
-            p_opt = str(row['商品選項名稱']).strip()
-            
-            found_cost = None
-            found_sku = None
-            source_type = ""
-            
-            # 優先嘗試完全匹配 (名稱 + 規格)
-            if (p_name, p_opt) in memory_rules:
-                rule = memory_rules[(p_name, p_opt)]
-                found_cost = rule['cost']
-                found_sku = rule['sku']
-                source_type = "記憶"
-            # 嘗試反向兼容 (只匹配名稱，且記憶庫中規格為空)
-            elif (p_name, "") in memory_rules:
-                rule = memory_rules[(p_name, "")]
-                found_cost = rule['cost']
-                found_sku = rule['sku']
-                source_type = "記憶"
-            
-            # === 智能匹配 (Smart Match) ===
-            # 如果記憶庫沒找到，嘗試直接從成本表 (df_cost) 找對應名稱
-            else:
-                # 嘗試組合: "商品名稱 [規格名稱]", "商品名稱"
-                candidates = []
-                if p_opt: candidates.append(f"{p_name} [{p_opt}]")
-                candidates.append(p_name)
-                
-                for cand in candidates:
-                    # 方法 A: 精確比對
-                    if cand in name_cost_map:
-                        found_cost = name_cost_map[cand]
-                        found_sku = cand 
-                        source_type = "智能"
-                        break
-                    
-                    # 方法 B: 模糊比對 (忽略空白、標點)
-                    cand_norm = normalize_name(cand)
-                    if cand_norm in normalized_cost_map:
-                        found_cost = normalized_cost_map[cand_norm]['cost']
-                        found_sku = normalized_cost_map[cand_norm]['sku']
-                        source_type = "智能(模糊)"
-                        break
-            
-            if found_cost is not None:
-                real_cost = found_cost
-                income = float(row['進蝦皮錢包'])
-                # real_profit = income - real_cost # Original line
-                real_profit = income - real_cost # Modified formula applied above to all, but here we overwrite special orders
-                
-                df_upload_ready.at[idx, '成本'] = real_cost
-                df_upload_ready.at[idx, '總利潤'] = real_profit
-                df_upload_ready.at[idx, '備註'] = f"已歸戶({source_type}): {found_sku}"
+        # 記憶庫 → 成本表名稱 (精確/標準化) 依序整批比對
+        special = df_upload_ready[mask_special]
+        hits = smart_match(special['商品名稱'], special.get('商品選項名稱', pd.Series("", index=special.index)), memory_rules, df_cost)
+        hits = hits[hits['source'].notna()]
+        if not hits.empty:
+            df_upload_ready.loc[hits.index, '成本'] = hits['cost']
+            df_upload_ready.loc[hits.index, '總利潤'] = df_upload_ready.loc[hits.index, '進蝦皮錢包'].astype(float) - hits['cost']
+            df_upload_ready.loc[hits.index, '備註'] = "已歸戶(" + hits['source'] + "): " + hits['sku'].astype(str)
 
     for h in headers:
         if h not in df_upload_ready.columns: df_upload_ready[h] = ""
     df_upload_ready = df_upload_ready[headers].fillna('').astype(str)
     
     # === Smart Merge Logic ===
-    existing_data = db_sheet.get_all_values()
+    # 已分片時只讀取本次報表日期範圍 (前後各放寬 ORDER_MATCH_MARGIN_DAYS 天) 所在的月分片，
+    # 範圍外的分片只比對 訂單編號，含有本次訂單的分片才一併讀取 (既有訂單不會被當成新訂單重複寫入)
+    upload_dates = pd.to_datetime(df_upload_ready['訂單成立日期'], errors='coerce').dropna()
+    if upload_dates.empty: load_start = load_end = None
+    else:
+        load_start = (upload_dates.min() - timedelta(days=ORDER_MATCH_MARGIN_DAYS)).date()
+        load_end = (upload_dates.max() + timedelta(days=ORDER_MATCH_MARGIN_DAYS)).date()
+    try:
+        snapshot = order_db.snapshot(load_start, load_end, ids=df_upload_ready['訂單編號'].str.strip())
+        existing_data = snapshot.values
+    except: return f"❌ 找不到資料庫：{DB_SHEET_NAME}"
     
     if len(existing_data) <= 1:
         # Initial Write
-        db_sheet.clear(); db_sheet.append_row(headers); db_sheet.append_rows(df_upload_ready.values.tolist())
+        order_db.replace_values([headers] + df_upload_ready.values.tolist())
         return f"✅ 初始化完成！新增 {len(df_upload_ready)} 筆。"
     else:
         # Load existing data
@@ -636,140 +701,195 @@ def process_orders(df_sales, df_cost, progress_bar):
         df_existing['訂單編號'] = df_existing['訂單編號'].astype(str).str.strip()
         df_upload_ready['訂單編號'] = df_upload_ready['訂單編號'].astype(str).str.strip()
         
-        # Create a dictionary of existing orders for fast lookup: {ID: Row}
-        existing_dict = df_existing.set_index('訂單編號').to_dict('index')
+        # 已歸戶 → 只同步日期等欄位；未歸戶 → 更新；不存在 → 新增 (以 訂單編號 整批對齊)
+        merged = merge_upload(df_existing, df_upload_ready)
+        protected, new_records = merged['protected'], merged['new']
+        updated_count, skipped_count = len(merged['updated']), len(protected)
+        sync_logs = [f"🔄 [Sync] {oid} 日期更新: {d}" for oid, d in zip(protected['訂單編號'], protected['訂單成立日期'])] \
+            if '訂單成立日期' in protected.columns else []
         
-        new_records = []
-        sync_logs = []  # To capture what is being synced
-        updated_count = 0
-        skipped_count = 0
+        # DEBUG: Show counts and details (上傳診斷，顯示於工作結果)
+        log('write', f"📂 讀取到的 Excel 列數: {len(df_sales)}")
+        log('write', f"🧹 清理後準備寫入的列數: {len(df_upload_ready)}")
+        log('write', f"📋 準備寫入的前 3 筆 ID: {df_upload_ready['訂單編號'].head(3).tolist()}")
         
-        for idx, row in df_upload_ready.iterrows():
-            order_id = row['訂單編號']
-            
-            if order_id in existing_dict:
-                # Order exists
-                old_row = existing_dict[order_id]
-                old_note = str(old_row.get('備註', ''))
-                
-                if "已歸戶" in old_note:
-                    # Case 1: Already consolidated -> PROTECT, but SYNC Date/Status
-                    skipped_count += 1
-                    target_idx = df_existing.index[df_existing['訂單編號'] == order_id]
-                    if not target_idx.empty:
-                        # Sync crucial fields if they exist in schema
-                        sync_fields = ['訂單成立日期', '訂單狀態', '商品名稱', '買家備註']
-                        for field in sync_fields:
-                            if field in df_existing.columns and field in row:
-                                val_str = str(row[field])
-                                df_existing.at[target_idx[0], field] = val_str
-                                if field == '訂單成立日期':
-                                    sync_logs.append(f"🔄 [Sync] {order_id} 日期更新: {val_str}")
-                else:
-                    # Case 2: Not consolidated -> UPDATE
-                    target_idx = df_existing.index[df_existing['訂單編號'] == order_id]
-                    if not target_idx.empty:
-                        df_existing.loc[target_idx[0]] = row
-                        updated_count += 1
-            else:
-                # Case 3: New Order -> ADD
-                new_records.append(row)
+        log('write', f"🗄️ 資料庫現有筆數: {len(df_existing)}")
+        log('write', f"📊 判定結果 - 新增: {len(new_records)}, 更新: {updated_count}, 略過: {skipped_count}")
         
-        # DEBUG: Show counts and details
-        with st.expander("🕵️ Upload Debug Info (上傳診斷)", expanded=True):
-            st.write(f"📂 讀取到的 Excel 列數: {len(df_sales)}")
-            st.write(f"🧹 清理後準備寫入的列數: {len(df_upload_ready)}")
-            st.write("📋 準備寫入的前 3 筆 ID:", df_upload_ready['訂單編號'].head(3).tolist())
-            
-            st.write(f"🗄️ 資料庫現有筆數: {len(df_existing)}")
-            st.write(f"📊 判定結果 - 新增: {len(new_records)}, 更新: {updated_count}, 略過: {skipped_count}")
-            
-            if skipped_count > 0:
-                st.warning(f"⚠️ 發現 {skipped_count} 筆重複資料被略過 (因為已歸戶)")
-                # Find first skipped example
-                for idx, row in df_upload_ready.iterrows():
-                    oid = row['訂單編號']
-                    if oid in existing_dict:
-                        old_note = str(existing_dict[oid].get('備註', ''))
-                        if "已歸戶" in old_note:
-                            st.write(f"範例略過 ID: {oid} (備註: {old_note})")
-                            break
-            
-            if len(sync_logs) > 0:
-                st.write("🔄 同步日誌 (Sync Logs):")
-                for log in sync_logs[:5]: # Show first 5 logs
-                    st.text(log)
-                if len(sync_logs) > 5: st.text(f"... 以及其他 {len(sync_logs)-5} 筆")
-            else:
-                st.write("⚠️ 無日期同步記錄 (可能是欄位名稱不符或資料已一致)")
-                st.write(f"系統檢查到的欄位: {df_existing.columns.tolist()[:10]}...") # Debug columns
+        if skipped_count > 0:
+            log('warning', f"⚠️ 發現 {skipped_count} 筆重複資料被略過 (因為已歸戶)")
+            oid = protected['訂單編號'].iloc[0]
+            old_note = df_existing.loc[df_existing['訂單編號'] == oid, '備註'].iloc[0]
+            log('write', f"範例略過 ID: {oid} (備註: {old_note})")
+        
+        if len(sync_logs) > 0:
+            log('write', "🔄 同步日誌 (Sync Logs):")
+            for line in sync_logs[:5]: # Show first 5 logs
+                log('text', line)
+            if len(sync_logs) > 5: log('text', f"... 以及其他 {len(sync_logs)-5} 筆")
+        else:
+            log('write', "⚠️ 無日期同步記錄 (可能是欄位名稱不符或資料已一致)")
+            log('write', f"系統檢查到的欄位: {df_existing.columns.tolist()[:10]}...") # Debug columns
+        
+        if updated_count > 0:
+            log('info', f"ℹ️ 更新了 {updated_count} 筆既有資料")
             
-            if updated_count > 0:
-                st.info(f"ℹ️ 更新了 {updated_count} 筆既有資料")
-                
-            if len(new_records) == 0:
-                st.error("❌ 警告：判定為 0 筆新資料！請檢查上方 '準備寫入的前 3 筆 ID' 是否真的已存在於資料庫。")
+        if len(new_records) == 0:
+            log('error', "❌ 警告：判定為 0 筆新資料！請檢查上方 '準備寫入的前 3 筆 ID' 是否真的已存在於資料庫。")
 
         # Combine Existing (Updated) + New Records
-        
-        # Combine Existing (Updated) + New Records
-        if new_records:
-            df_new = pd.DataFrame(new_records)
-            df_final = pd.concat([df_existing, df_new], ignore_index=True)
-        else:
-            df_final = df_existing
+        df_final = pd.concat([df_existing, new_records], ignore_index=True) if len(new_records) else df_existing
 
-        # Write back to sheet (Overwrite everything to ensure updates are reflected)
-        # Using clear and update is safer for consistency than appending mixed
+        # Write back only the delta (changed rows in one batch, new orders in one append)
+        # 既有列的順序不變，新訂單接在表尾，因此可以逐列比對舊資料
         progress_bar.progress(90, text="正在同步資料庫...")
         
         # Convert to list of lists
-        final_data = [df_final.columns.tolist()] + df_final.astype(str).values.tolist()
-        db_sheet.clear()
-        try:
-            # Try new argument name first (gspread v6)
-            db_sheet.update(range_name='A1', values=final_data)
-        except:
-            # Fallback for older gspread
-            db_sheet.update('A1', final_data)
+        final_data = [df_final.columns.tolist()] + df_final.fillna('').astype(str).values.tolist()
+        delta = order_db.write_snapshot(snapshot, final_data)
+        log('write', f"✍️ 差異寫入：更新 {delta['changed']} 列、新增 {delta['new']} 列、未變動 {delta['unchanged']} 列")
         
         # === Read-Back Verification ===
-        st.write("🔎 正在驗證寫入結果...")
-        # Check specific order if synced
-        if len(sync_logs) > 0:
-            # Extract first synced ID from logs
-            first_synced_id = sync_logs[0].split('] ')[1].split(' ')[0]
-            # Re-read sheet
-            check_data = db_sheet.get_all_records()
-            check_df = pd.DataFrame(check_data)
-            # Find the row
-            check_row = check_df[check_df['訂單編號'].astype(str) == first_synced_id]
-            if not check_row.empty:
-                saved_date = check_row.iloc[0]['訂單成立日期']
-                st.success(f"✅ 寫入驗證成功！資料庫內 ID: {first_synced_id} 的日期已變更為: {saved_date}")
-            else:
-                st.error(f"❌ 寫入驗證失敗：無法在資料庫中找到剛剛同步的 ID {first_synced_id}")
+        # 只讀回剛剛寫入的區塊 (抽查 VERIFY_SAMPLE_RANGES 個)，驗證成本只跟寫入量有關
+        if any(delta['written'].values()):
+            log('write', "🔎 正在驗證寫入結果...")
+            check = order_db.verify_write(delta['written'], sample=VERIFY_SAMPLE_RANGES)
+            for ds, start, count, bad in check['mismatches']:
+                log('error', f"❌ 寫入驗證失敗：{ds} 第 {start}~{start + count - 1} 列中有 {len(bad)} 列與寫入內容不符 (列號 {', '.join(map(str, bad[:10]))}{' ...' if len(bad) > 10 else ''})")
+            if not check['mismatches']:
+                log('success', f"✅ 寫入驗證成功！抽查 {check['ranges']} 個寫入區塊共 {check['rows']} 列，內容一致")
         
         progress_bar.progress(100, text="完成")
-        st.cache_data.clear() # Force clear cache to ensure frontend sees new data immediately
         return f"✅ 同步完成！新增 {len(new_records)} 筆，更新 {updated_count} 筆，保留 {skipped_count} 筆已歸戶資料。"
 
-def update_special_order(order_sn, real_sku_name, real_cost, df_db, db_sheet):
-    idx = df_db.index[df_db['訂單編號'] == order_sn].tolist()
-    if not idx: return False
-    idx = idx[0]
-    
-    income = float(str(df_db.at[idx, '進蝦皮錢包']).replace(',', ''))
-    real_profit = income - real_cost
+# === 特殊商品 ===
+@st.cache_resource
+def get_special_matcher():
+    # 判斷結果依商品名稱快取在 matcher 內，跨 rerun / 訂單總表版本共用
+    return SpecialMatcher(SPECIAL_PRODUCTS)
+
+def run_reclassify_job(job, order_db, matcher):
+    """
+    背景執行：依目前的特殊商品關鍵字，一次掃過所有訂單 (全部分片)。
+    新符合的未歸戶訂單 → 備註「待人工確認」、總利潤 0；
+    不再符合的「待人工確認」訂單 → 清除備註、總利潤改回 進蝦皮錢包 - 成本。
+    order_db / matcher 由主執行緒取好傳入 (背景執行緒不呼叫 st.cache_resource)。
+    """
+    job.progress(10, text="讀取所有訂單...")
+    df_db = order_db.frame()
+    job.progress(50, text="比對特殊商品關鍵字...")
+    mark, unmark = plan_reclassification(df_db, matcher)
+    cells = []
+    for idx in mark: cells += [(idx, '備註', PENDING_NOTE), (idx, '總利潤', 0)]
+    for idx in unmark:
+        try: profit = float(str(df_db.at[idx, '進蝦皮錢包']).replace(',', '')) - float(str(df_db.at[idx, '成本']).replace(',', '') or 0)
+        except ValueError: job.log('warning', f"⚠️ {df_db.at[idx, '訂單編號']} 金額無法解析，僅清除備註"); profit = None
+        cells.append((idx, '備註', ""))
+        if profit is not None: cells.append((idx, '總利潤', profit))
+    if cells:
+        job.progress(70, text=f"寫回 {len(mark) + len(unmark)} 筆訂單...")
+        order_db.update_cells(cells)
+    job.progress(100, text="完成")
+    return f"✅ 重新分類成功：掃描 {len(df_db)} 筆訂單，新標記 {len(mark)} 筆待人工確認，解除 {len(unmark)} 筆。"
+
+# === 背景上傳工作 ===
+@st.cache_resource
+def get_job_queue():
+    # 只有一個 worker：多份報表依序處理，不會同時改寫訂單總表
+    return JobQueue(INGEST_JOBS_DIR, workers=1)
+
+@st.cache_resource
+def get_ingest_ledger():
+    return IngestLedger(INGEST_LEDGER_DIR, max_frames=INGEST_FRAME_CACHE)
+
+def run_ingest_job(job, files, df_cost, order_db, matcher, memory_store, pool=None, ledger=None, force=False):
+    """
+    背景執行：解析報表 → 比對寫入。job 為 JobReporter，files = [(檔名, 檔案內容), ...]。
+    order_db / matcher / memory_store 需在主執行緒取好傳入，錯誤一律透過 job.log 回報。
+    多份報表合併後只比對/寫入一次 (讀一次訂單總表、寫一次差異)。
+    ledger 中已成功匯入過的相同內容檔案會略過 (force=True 時照樣重新處理)。
+    """
+    if ledger is not None and not force:
+        fresh = []
+        for name, data in files:
+            prev = ledger.lookup(file_digest(data))
+            if prev is None: fresh.append((name, data)); continue
+            job.log('info', f"♻️ {name} 與 {prev['ingested_at']} 匯入的 {prev['name']} 內容完全相同，略過。")
+        if not fresh:
+            if len(files) == 1: return f"♻️ 此檔案已於 {prev['ingested_at']} 匯入過，未重新處理。上次結果：{prev['result']}"
+            return f"♻️ {len(files)} 個檔案先前都已匯入過，未重新處理。"
+        files = fresh
+
+    job.progress(5, text=f"解析 Excel ({len(files)} 個檔案)...")
+    df_sales = load_sales_reports(files, pool, on_error=lambda msg: job.log('error', msg), ledger=ledger,
+                                  on_warning=lambda msg: job.log('warning', msg))
+    if df_sales is None: return "❌ 失敗：Excel 解析失敗。"
+    if len(files) > 1: job.log('write', f"📚 已合併 {len(files)} 份報表，共 {len(df_sales)} 列 (重複的訂單以較新的報表為準)")
+    result = process_orders(df_sales, df_cost, job, order_db, matcher, memory_store)
+    if ledger is not None and result.startswith("✅"):
+        for name, data in files: ledger.record(file_digest(data), name, result, job.job_id)
+    return result
+
+def render_ingest_job(job, mine):
+    st.markdown(f"**{job['label']}** `{job['id']}` · {job['created_at']}")
+    if job['status'] in ACTIVE_STATUSES:
+        st.progress(job['progress'], text=job['stage'])
+    elif job['status'] == STATUS_DONE:
+        res = job['result'] or ""
+        if "成功" in res: st.success(res)
+        else: st.warning(res)
+    else:
+        st.error(f"❌ 工作失敗：{job['error']}")
+    if job['logs']:
+        with st.expander("🕵️ Upload Debug Info (上傳診斷)", expanded=mine):
+            for level, text in job['logs']: getattr(st, level, st.write)(text)
+
+@st.fragment(run_every=INGEST_POLL_SECONDS)
+def render_ingest_jobs():
+    """上傳工作列表 (每幾秒自動更新，任何使用者都看得到)"""
+    jobs = get_job_queue().recent(INGEST_JOBS_SHOWN)
+    if not jobs: return
+    st.markdown("**📋 上傳工作**")
+    my_job = st.session_state.get("ingest_job")
+    for job in jobs: render_ingest_job(job, mine=(job['id'] == my_job))
+    # 自己送出的工作完成後，整頁重新整理一次以讀取新資料
+    mine = next((j for j in jobs if j['id'] == my_job), None)
+    if mine and mine['status'] not in ACTIVE_STATUSES and st.session_state.get("ingest_job_seen") != my_job:
+        st.session_state["ingest_job_seen"] = my_job
+        st.rerun(scope="app")
+
+def consolidate_orders(assignments, df_db, order_db):
+    """
+    批次歸戶：assignments = [(訂單編號, 真實SKU名稱, 成本), ...]
+    先在記憶體 (df_db) 中套用，再只寫回受影響列的 成本/總利潤/備註 (每個分片一次 update_ranges)。
+    df_db 必須是 order_db.frame() 建立的 DataFrame (index 為 "資料集#列號")。
+    回傳 (成功的訂單編號, 失敗的訂單編號)
+    """
+    # 同一訂單編號只處理第一列 (與舊版行為一致)
+    first_idx = df_db.reset_index().drop_duplicates(subset=['訂單編號']).set_index('訂單編號')['index']
     
-    df_db.at[idx, '成本'] = real_cost
-    df_db.at[idx, '總利潤'] = real_profit
-    df_db.at[idx, '備註'] = f"已歸戶: {real_sku_name}"
+    cells = []
+    done, failed = [], []
+    for order_sn, real_sku_name, real_cost in assignments:
+        if order_sn not in first_idx.index: failed.append(order_sn); continue
+        idx = first_idx[order_sn]
+        try: income = float(str(df_db.at[idx, '進蝦皮錢包']).replace(',', ''))
+        except ValueError: failed.append(order_sn); continue
+        real_profit = income - real_cost
+        
+        df_db.at[idx, '成本'] = real_cost
+        df_db.at[idx, '總利潤'] = real_profit
+        df_db.at[idx, '備註'] = f"已歸戶: {real_sku_name}"
+        
+        cells += [(idx, '成本', real_cost), (idx, '總利潤', real_profit), (idx, '備註', f"已歸戶: {real_sku_name}")]
+        done.append(order_sn)
     
-    updated_data = [df_db.columns.tolist()] + df_db.astype(str).values.tolist()
-    db_sheet.clear()
-    db_sheet.update(updated_data)
-    return True
+    if cells: order_db.update_cells(cells)
+    return done, failed
+
+def update_special_order(order_sn, real_sku_name, real_cost, df_db, order_db):
+    done, _ = consolidate_orders([(order_sn, real_sku_name, real_cost)], df_db, order_db)
+    return bool(done)
 
 # ==========================================
 # 5. 主程式
@@ -788,7 +908,7 @@ if mode == "🔍 成本神探":
         with st.spinner(f"正在掃描『{COST_SHEET_NAME}』..."):
             df_raw = get_cost_sheet_raw()
             if df_raw is not None:
-                df_raw['Clean_ID'] = df_raw['蝦皮商品編碼'].apply(clean_id)
+                df_raw['Clean_ID'] = clean_ids(df_raw['蝦皮商品編碼'])
                 target_clean = clean_id(target_id)
                 matches = df_raw[df_raw['Clean_ID'] == target_clean]
                 if not matches.empty: st.error(f"出現 {len(matches)} 次："); st.dataframe(matches)
@@ -798,17 +918,14 @@ elif mode == "📊 前台戰情室":
     st.title("📊 蝦皮營業額戰情室")
     
     if st.sidebar.button("🔄 刷新資料"):
-        st.cache_data.clear(); st.rerun()
+        get_memory_store().flush(); get_cache().invalidate_all(); st.rerun()
 
-    client = get_gspread_client()
+    storage = get_storage()
+    order_db = get_order_db()
+    # 訂單、廣告費用、成本表同時下載 (待歸戶區塊會用到成本表)
+    prefetch_datasets(DATASET_ORDERS, DATASET_AD_COST, DATASET_COST, typed_orders=True)
     try:
-        sheet = client.open(DB_SHEET_NAME).sheet1
-        data = sheet.get_all_values()
-        if len(data) > 1:
-            df_all = pd.DataFrame(data[1:], columns=data[0])
-            for c in ['售價', '成本', '數量', '總利潤', '進蝦皮錢包']:
-                if c in df_all.columns: df_all[c] = pd.to_numeric(df_all[c].astype(str).str.replace(',',''), errors='coerce').fillna(0)
-        else: st.warning("資料庫目前為空"); st.stop()
+        first_day, last_day = order_db.date_bounds()
     except gspread.exceptions.SpreadsheetNotFound:
         st.error(f"❌ 找不到 Google Sheet：『{DB_SHEET_NAME}』")
         st.info("請確認：\n1. 是否已建立名為『蝦皮訂單總表』的試算表\n2. 是否已將試算表共用給機器人信箱")
@@ -816,6 +933,58 @@ elif mode == "📊 前台戰情室":
     except Exception as e:
         st.error(f"讀取 Google Sheet 失敗。\n錯誤訊息：{e}")
         st.stop()
+    if first_day is None: st.warning("資料庫目前為空"); st.stop()
+
+    # === 全新升級：日期篩選器 ===
+    # 先決定日期範圍，再只下載與範圍重疊的月分片
+    st.markdown("### 📅 日期篩選器")
+    col_quick, col_date_range = st.columns([1, 2])
+
+    with col_quick:
+        st.markdown("**快速選擇**")
+        quick_col1, quick_col2 = st.columns(2)
+        with quick_col1:
+            if st.button("今日", use_container_width=True):
+                st.session_state['date_start'] = get_taiwan_time().date()
+                st.session_state['date_end'] = get_taiwan_time().date()
+            if st.button("昨日", use_container_width=True):
+                yesterday = get_taiwan_time().date() - timedelta(days=1)
+                st.session_state['date_start'] = yesterday
+                st.session_state['date_end'] = yesterday
+        with quick_col2:
+            if st.button("本月", use_container_width=True):
+                today = get_taiwan_time().date()
+                st.session_state['date_start'] = today.replace(day=1)
+                st.session_state['date_end'] = today
+            if st.button("上月", use_container_width=True):
+                today = get_taiwan_time().date()
+                # Calculate first day of this month, then substract 1 day to get last month end
+                last_month_end = today.replace(day=1) - timedelta(days=1)
+                last_month_start = last_month_end.replace(day=1)
+                st.session_state['date_start'] = last_month_start
+                st.session_state['date_end'] = last_month_end
+
+    with col_date_range:
+        st.markdown("**自訂範圍**")
+        col_start, col_end = st.columns(2)
+        # Default: 最近 ORDER_DEFAULT_MONTHS 個月 (由分片索引取得資料庫日期範圍，不必下載全部訂單)
+        min_date, max_date, default_start = default_order_range(first_day, last_day)
+        
+        # Initialize session state if not present
+        if 'date_start' not in st.session_state: st.session_state['date_start'] = default_start
+        if 'date_end' not in st.session_state: st.session_state['date_end'] = max_date
+
+        with col_start:
+            start_date = st.date_input("起始日期", value=st.session_state['date_start'])
+        with col_end:
+            end_date = st.date_input("結束日期", value=st.session_state['date_end'])
+
+    try:
+        df_all = order_db.typed_frame(start_date, end_date)
+        if len(df_all) == 0: st.warning(f"⚠️ 該日期區間 ({start_date} ~ {end_date}) 無資料"); st.stop()
+    except Exception as e:
+        st.error(f"讀取 Google Sheet 失敗。\n錯誤訊息：{e}")
+        st.stop()
 
     if df_all is not None:
         if '備註' not in df_all.columns: df_all['備註'] = ""
@@ -831,51 +1000,7 @@ elif mode == "📊 前台戰情室":
             df_all['日期標籤'] = df_all['訂單成立日期'].dt.strftime('%Y-%m-%d')
         else: st.error("資料庫缺少『訂單成立日期』欄位"); st.stop()
 
-        # === 全新升級：日期篩選器 ===
-        st.markdown("### 📅 日期篩選器")
-        col_quick, col_date_range = st.columns([1, 2])
-
-        with col_quick:
-            st.markdown("**快速選擇**")
-            quick_col1, quick_col2 = st.columns(2)
-            with quick_col1:
-                if st.button("今日", use_container_width=True):
-                    st.session_state['date_start'] = get_taiwan_time().date()
-                    st.session_state['date_end'] = get_taiwan_time().date()
-                if st.button("昨日", use_container_width=True):
-                    yesterday = get_taiwan_time().date() - timedelta(days=1)
-                    st.session_state['date_start'] = yesterday
-                    st.session_state['date_end'] = yesterday
-            with quick_col2:
-                if st.button("本月", use_container_width=True):
-                    today = get_taiwan_time().date()
-                    st.session_state['date_start'] = today.replace(day=1)
-                    st.session_state['date_end'] = today
-                if st.button("上月", use_container_width=True):
-                    today = get_taiwan_time().date()
-                    # Calculate first day of this month, then substract 1 day to get last month end
-                    last_month_end = today.replace(day=1) - timedelta(days=1)
-                    last_month_start = last_month_end.replace(day=1)
-                    st.session_state['date_start'] = last_month_start
-                    st.session_state['date_end'] = last_month_end
-
-        with col_date_range:
-            st.markdown("**自訂範圍**")
-            col_start, col_end = st.columns(2)
-            # Default to today if not set, or min/max from data
-            min_date = df_all['訂單成立日期'].min().date() if not df_all['訂單成立日期'].isnull().all() else get_taiwan_time().date()
-            max_date = df_all['訂單成立日期'].max().date() if not df_all['訂單成立日期'].isnull().all() else get_taiwan_time().date()
-            
-            # Initialize session state if not present
-            if 'date_start' not in st.session_state: st.session_state['date_start'] = min_date
-            if 'date_end' not in st.session_state: st.session_state['date_end'] = max_date
-
-            with col_start:
-                start_date = st.date_input("起始日期", value=st.session_state['date_start'])
-            with col_end:
-                end_date = st.date_input("結束日期", value=st.session_state['date_end'])
-
-        # 資料篩選
+        # 資料篩選 (分片以月為單位，仍需依日期篩選)
         df_filtered = df_all[
             (df_all['訂單成立日期'].dt.date >= start_date) & 
             (df_all['訂單成立日期'].dt.date <= end_date)
@@ -885,14 +1010,28 @@ elif mode == "📊 前台戰情室":
         with st.expander("🕵️ Debug Mode (資料診斷)", expanded=True):
             c_dbg1, c_dbg2 = st.columns(2)
             with c_dbg1:
-                st.write(f"📊 原始資料: {len(df_all)} 筆")
-                st.write(f"📅 資料庫最新日期: {df_all['訂單成立日期'].max()}")
+                st.write(f"📊 已載入資料: {len(df_all)} 筆")
+                st.write(f"📅 資料庫最新日期: {max_date}")
             with c_dbg2:
                 st.write(f"🔍 篩選後資料: {len(df_filtered)} 筆")
                 st.write(f"📆 目前篩選範圍: {start_date} ~ {end_date}")
+                db_stats = order_db.stats()
+                st.caption(f"🗂️ 訂單快照 v{db_stats['version']}：下載 {db_stats['fetches']} 次 / 共用 {db_stats['hits']} 次" +
+                           (f" (月分片 {len(order_db.datasets_for(start_date, end_date))}/{db_stats['shards']})" if db_stats['shards'] else ""))
+                if getattr(storage, 'registry', None) is not None:
+                    reg_stats = storage.registry.stats()
+                    st.caption(f"📇 分頁快取：開啟試算表 {reg_stats['opens']} 次，省下 {reg_stats['saved']} 次查找")
+                mirror = get_order_mirror()
+                if mirror is not None and mirror.last_sync:
+                    m_pulled = sum(v['pulled'] for v in mirror.last_sync.values())
+                    m_rows = sum(v['rows'] for v in mirror.last_sync.values())
+                    st.caption(f"💾 本機鏡像：{m_rows} 筆，最近一次同步下載 {m_pulled} 列")
+                q_stats = get_scheduler().stats()
+                if q_stats['read'] or q_stats['write']:
+                    st.caption(f"⏱️ API 配額：讀 {q_stats['read']} / 寫 {q_stats['write']} 次，重試 {q_stats['retries']} 次，排隊等待 {q_stats['throttled']} 次")
             
-            if df_filtered.empty and not df_all.empty:
-                last_date = df_all['訂單成立日期'].max().date()
+            if df_filtered.empty:
+                last_date = max_date
                 if last_date < start_date:
                     st.warning(f"⚠️ 您的資料庫最新訂單只到 `{last_date}`，但您選了 `{start_date}` 之後的日期。請嘗試選擇「昨日」或「本月」。")
         
@@ -902,25 +1041,20 @@ elif mode == "📊 前台戰情室":
             df_day = df_filtered # Use filtered data as the main dataset
             
             # 分離特殊與正常訂單
-            mask_special = (
-                df_day['商品名稱'].astype(str).apply(lambda x: any(sp in x for sp in SPECIAL_PRODUCTS)) & 
-                (~df_day['備註'].astype(str).str.contains("已歸戶"))
-            )
+            mask_special = pending_special(df_day, get_special_matcher())
             df_special = df_day[mask_special]
-            df_normal = df_day[~df_day.index.isin(df_special.index)]
+            df_normal = df_day[~mask_special]
             
-            # 計算核心指標
-            total_rev = df_normal['售價'].sum()
-            total_cost = (df_normal['成本'] * df_normal['數量']).sum()
+            # 計算核心指標 (每日彙總表的累計值相減，不逐筆加總)
+            rollup = order_db.rollup(start_date, end_date)
+            normal = rollup.totals(start_date, end_date, special=False)
+            total_rev = normal['售價']
+            total_cost = normal['成本額']
             
             # 讀取廣告費用
-            ad_df = get_ad_costs_df(client)
-            period_ad_cost = 0
-            if not ad_df.empty:
-                mask = (ad_df['日期'] >= start_date) & (ad_df['日期'] <= end_date)
-                period_ad_cost = ad_df.loc[mask, '廣告費用'].sum()
+            period_ad_cost = get_period_ad_cost(start_date, end_date)
             
-            total_gp = df_normal['總利潤'].sum() - period_ad_cost
+            total_gp = normal['總利潤'] - period_ad_cost
             margin = (total_gp / total_rev * 100) if total_rev > 0 else 0
             
             # --- 視覺化指標卡片 ---
@@ -951,10 +1085,7 @@ elif mode == "📊 前台戰情室":
             
             with v_tab1:
                 # 折線圖：每日營業額 & 利潤
-                daily_stats = df_day.groupby('日期標籤').agg({
-                    '售價': 'sum',
-                    '總利潤': 'sum'
-                }).reset_index()
+                daily_stats = rollup.daily(start_date, end_date)[['日期', '售價', '總利潤']]
                 daily_stats.columns = ['日期', '營業額', '利潤']
                 
                 fig = go.Figure()
@@ -963,9 +1094,10 @@ elif mode == "📊 前台戰情室":
                 fig.update_layout(title="每日營收與獲利趨勢", height=400, hovermode="x unified")
                 st.plotly_chart(fig, use_container_width=True)
                 
+            prod_totals = rollup.by_product(start_date, end_date)
             with v_tab2:
                 # 圓餅圖：商品銷售佔比
-                prod_stats = df_day.groupby('商品名稱')['售價'].sum().reset_index().sort_values('售價', ascending=False)
+                prod_stats = prod_totals[['商品名稱', '售價']].sort_values('售價', ascending=False)
                 # 取前5名，其他合併
                 if len(prod_stats) > 5:
                     top5 = prod_stats.head(5)
@@ -981,7 +1113,7 @@ elif mode == "📊 前台戰情室":
                 
             with v_tab3:
                 # 長條圖：Top 10 熱賣
-                top10_stats = df_day.groupby('商品名稱').agg({'售價': 'sum', '總利潤': 'sum', '數量':'sum'}).reset_index().sort_values('售價', ascending=False).head(10)
+                top10_stats = prod_totals[['商品名稱', '售價', '總利潤', '數量']].sort_values('售價', ascending=False).head(10)
                 fig_bar = px.bar(top10_stats, x='售價', y='商品名稱', orientation='h', title='Top 10 熱賣商品 (按營業額)', text='售價', color='總利潤')
                 fig_bar.update_layout(yaxis={'categoryorder':'total ascending'}, height=500)
                 st.plotly_chart(fig_bar, use_container_width=True)
@@ -1018,7 +1150,7 @@ elif mode == "📊 前台戰情室":
             if not df_special.empty:
                 st.error(f"⚠️ 發現 {len(df_special)} 筆訂單尚未歸戶 (不會計入毛利)")
                 # 載入成本表供選擇
-                df_cost_ref, _ = load_cloud_cost_table()
+                df_cost_ref = load_cloud_cost_table()
                 cost_dict = {}
                 item_options = ["請選擇商品..."]
                 if df_cost_ref is not None:
@@ -1033,6 +1165,9 @@ elif mode == "📊 前台戰情室":
                     
                     progress_bar = st.progress(0, text="正在批次處理中...")
                     
+                    # 先收集所有已選擇商品的訂單，最後一次寫回
+                    assignments = []
+                    memory_rows = {}
                     for i, (idx, row) in enumerate(df_special.iterrows()):
                         order_sn = row['訂單編號']
                         # 從 session_state 獲取當前選擇的值
@@ -1049,22 +1184,28 @@ elif mode == "📊 前台戰情室":
                                 if cost_key in st.session_state:
                                     final_cost = st.session_state[cost_key]
                                 
-                                # 執行歸戶
-                                try:
-                                    real_sku_name = real_item.split(" |")[0].strip()
-                                    if update_special_order(order_sn, real_sku_name, final_cost, df_all, sheet):
-                                        # 自動記憶
-                                        if "7777" not in str(row['商品名稱']):
-                                            save_memory_rule(client, row['商品名稱'], row.get('商品選項名稱', ''), real_sku_name, final_cost)
-                                        success_count += 1
-                                    else:
-                                        fail_count += 1
-                                except Exception as e:
-                                    print(f"Batch Error: {e}")
-                                    fail_count += 1
+                                real_sku_name = real_item.split(" |")[0].strip()
+                                assignments.append((order_sn, real_sku_name, final_cost))
+                                memory_rows[order_sn] = (row['商品名稱'], row.get('商品選項名稱', ''), real_sku_name, final_cost)
                         
                         # Update progress
-                        progress_bar.progress((i + 1) / len(df_special), text=f"處理中... ({i + 1}/{len(df_special)})")
+                        progress_bar.progress((i + 1) / len(df_special) * 0.5, text=f"整理中... ({i + 1}/{len(df_special)})")
+                    
+                    # 執行歸戶 (一次寫入)
+                    if assignments:
+                        progress_bar.progress(0.5, text=f"正在寫入 {len(assignments)} 筆歸戶...")
+                        try:
+                            done, failed = consolidate_orders(assignments, df_all, order_db)
+                            success_count, fail_count = len(done), len(failed)
+                            # 自動記憶
+                            for order_sn in done:
+                                shopee_name, shopee_option, real_sku_name, final_cost = memory_rows[order_sn]
+                                if "7777" not in str(shopee_name):
+                                    save_memory_rule(shopee_name, shopee_option, real_sku_name, final_cost)
+                        except Exception as e:
+                            print(f"Batch Error: {e}")
+                            fail_count = len(assignments)
+                        flush_memory_rules()
                     
                     progress_bar.empty()
                     if success_count > 0:
@@ -1134,14 +1275,15 @@ elif mode == "📊 前台戰情室":
                                         real_sku_name = real_item.split(" |")[0].strip()
                                         
                                         # 更新資料庫
-                                        if update_special_order(row['訂單編號'], real_sku_name, final_cost, df_all, sheet): # Fix: pass df_all (dataframe) and sheet (worksheet)
+                                        if update_special_order(row['訂單編號'], real_sku_name, final_cost, df_all, order_db): # Fix: pass df_all (dataframe) and order_db
                                             # 自動記憶 (預設開啟)
                                             if "7777" not in str(row['商品名稱']):
-                                                save_memory_rule(client, row['商品名稱'], row.get('商品選項名稱', ''), real_sku_name, final_cost)
+                                                save_memory_rule(row['商品名稱'], row.get('商品選項名稱', ''), real_sku_name, final_cost)
+                                                flush_memory_rules()
                                             
                                             # 同步成本表
                                             if final_cost != default_cost or default_cost == 0:
-                                                update_master_cost_sheet(client, real_item, final_cost)
+                                                update_master_cost_sheet(real_item, final_cost)
                                             
                                             st.success("歸戶成功！")
                                             time.sleep(1)
@@ -1157,16 +1299,17 @@ elif mode == "📊 前台戰情室":
             
             with c_chart1:
                 st.markdown("##### 🏆 熱銷商品 (依營收)")
-                if not df_normal.empty:
-                    top_items = df_normal.groupby('商品名稱')['售價'].sum().nlargest(5).sort_values()
+                normal_totals = rollup.by_product(start_date, end_date, special=False).set_index('商品名稱')
+                if not normal_totals.empty:
+                    top_items = normal_totals['售價'].nlargest(5).sort_values()
                     st.bar_chart(top_items, color="#FF512F")
                 else:
                     st.info("無資料")
                     
             with c_chart2:
                 st.markdown("##### 💎 高毛利商品 (依利潤)")
-                if not df_normal.empty:
-                    top_profits = df_normal.groupby('商品名稱')['總利潤'].sum().nlargest(5).sort_values()
+                if not normal_totals.empty:
+                    top_profits = normal_totals['總利潤'].nlargest(5).sort_values()
                     st.bar_chart(top_profits, color="#DD2476")
                 else:
                     st.info("無資料")
@@ -1198,6 +1341,8 @@ elif mode == "⚙️ 後台管理":
     pwd = st.text_input("🔑 請輸入管理員密碼", type="password", value=def_pwd)
     
     if pwd == ADMIN_PWD:
+        # 各分頁都會用到的資料集先在背景同時下載
+        prefetch_datasets(DATASET_COST, DATASET_ORDERS, DATASET_MEMORY, DATASET_AD_COST)
         # 使用更美觀的 Tabs
         st.markdown("###")
         tab1, tab2, tab3, tab4, tab5 = st.tabs(["📥 訂單上傳", "🔗 歸戶系統", "🛠️ 商品維護", "🤝 非蝦皮訂單", "📢 廣告費用管理"])
@@ -1209,49 +1354,90 @@ elif mode == "⚙️ 後台管理":
             with c1:
                 # 檢查成本表狀態
                 st.markdown("**系統狀態檢測**")
-                df_cost, _ = load_cloud_cost_table()
+                df_cost = load_cloud_cost_table()
                 if df_cost is not None:
                     st.success(f"✅ 成本表連線正常 (共 {len(df_cost)} 筆資料)")
                 else:
                     st.error("❌ 無法讀取成本表")
 
             with c2:
-                sales_file = st.file_uploader("拖曳或點擊上傳 Excel", type=['xlsx'])
+                sales_files = st.file_uploader("拖曳或點擊上傳 Excel (可一次選多天的報表)", type=['xlsx'], accept_multiple_files=True)
                 
-            if sales_file:
+            if sales_files:
                 # 檔案名稱防呆機制
-                if not sales_file.name.lower().startswith("order.all"):
-                    st.error("❌ 檔案錯誤：請上傳檔名以 `Order.all` 開頭的蝦皮原始報表！")
+                bad_names = [f.name for f in sales_files if not f.name.lower().startswith("order.all")]
+                force_reingest = st.checkbox("重新匯入已匯入過的檔案", value=False, help="預設會略過內容完全相同、先前已成功匯入的檔案")
+                if bad_names:
+                    st.error(f"❌ 檔案錯誤：請上傳檔名以 `Order.all` 開頭的蝦皮原始報表！({', '.join(bad_names)})")
                     st.info("💡 提示：蝦皮匯出的檔名通常為 `Order.all.YYYYMMDD.xlsx`")
                 elif st.button("🚀 開始分析訂單", type="primary", use_container_width=True):
-                    bar = st.progress(0, "初始化中...")
-                    df_sales = load_sales_report(sales_file)
-                    if df_sales is not None:
-                        res = process_orders(df_sales, df_cost, bar)
-                        time.sleep(0.5)
-                        if "成功" in res:
-                            st.success(res)
-                            time.sleep(1.5) # Wait for cache clear signal
-                            st.cache_data.clear()
-                            st.rerun()
-                        else: st.warning(res)
-                        st.cache_data.clear() # Redundant safety clear
+                    if df_cost is None: st.error("❌ 無法讀取成本表，請稍後再試")
+                    else:
+                        # 解析 Excel 的同時先下載訂單總表與記憶庫
+                        prefetch_datasets(DATASET_ORDERS, DATASET_MEMORY)
+                        queue = get_job_queue()
+                        waiting = queue.active_count()
+                        files = sorted(((f.name, f.getvalue()) for f in sales_files), key=lambda f: f[0])
+                        label = files[0][0] if len(files) == 1 else f"{files[0][0]} 等 {len(files)} 個檔案"
+                        job_id = queue.submit(label, run_ingest_job, files, df_cost, get_order_db(), get_special_matcher(), get_memory_store(),
+                                              get_report_pool() if len(files) > 1 else None, ledger=get_ingest_ledger(), force=force_reingest)
+                        st.session_state["ingest_job"] = job_id
+                        if waiting: st.info(f"⏳ 已排入佇列 (前面還有 {waiting} 個工作)，可以關閉頁面，處理會在背景繼續。")
+                        else: st.info("⏳ 已開始在背景處理，可以關閉頁面，處理會在背景繼續。")
+
+            render_ingest_jobs()
 
         with tab2:
             st.markdown("#### 🔗 特殊訂單歸戶 (信用卡/補差價/客製化)")
             
-            client = get_gspread_client()
+            order_db = get_order_db()
+            try: first_day, last_day = order_db.date_bounds()
+            except: st.error("資料讀取失敗"); st.stop()
+            if first_day is None: st.warning("目前無訂單資料"); st.stop()
+            min_d, max_d, default_d = default_order_range(first_day, last_day)
+            
+            # --- 日期篩選區塊 (先選範圍，只下載該範圍的月分片) ---
+            st.markdown("##### 📅 篩選待處理訂單")
+            sc1, sc2 = st.columns([1, 2])
+            with sc1:
+                sq1, sq2 = st.columns(2)
+                with sq1:
+                    if st.button("今日", key="btn_sp_today", use_container_width=True):
+                        set_date_range('sp', get_taiwan_time().date(), get_taiwan_time().date())
+                    if st.button("昨日", key="btn_sp_yest", use_container_width=True):
+                        yest = get_taiwan_time().date() - timedelta(days=1)
+                        set_date_range('sp', yest, yest)
+                with sq2:
+                    if st.button("本月", key="btn_sp_tmonth", use_container_width=True):
+                        today = get_taiwan_time().date()
+                        set_date_range('sp', today.replace(day=1), today)
+                    if st.button("全部待處理", key="btn_sp_all", use_container_width=True):
+                        set_date_range('sp', min_d, max_d)
+            
+            if 'sp_start' not in st.session_state: st.session_state['sp_start'] = default_d
+            if 'sp_end' not in st.session_state: st.session_state['sp_end'] = max_d
+            for k in ('sp_start', 'sp_end'):
+                if k + '_in' not in st.session_state: st.session_state[k + '_in'] = st.session_state[k]
+            
+            with sc2:
+                sd1, sd2 = st.columns(2)
+                with sd1:
+                    sp_start = st.date_input("起始日期", key="sp_start_in")
+                with sd2:
+                    sp_end = st.date_input("結束日期", key="sp_end_in")
+            
+            st.session_state['sp_start'] = sp_start
+            st.session_state['sp_end'] = sp_end
+
             try:
-                db_sheet = client.open(DB_SHEET_NAME).sheet1
-                data = db_sheet.get_all_values()
-                if len(data) > 1: df_db = pd.DataFrame(data[1:], columns=data[0])
-                else: st.warning("目前無訂單資料"); st.stop()
+                df_db = order_db.frame(sp_start, sp_end)
+                if len(df_db) == 0: df_db = pd.DataFrame(columns=['訂單成立日期', '訂單編號', '商品名稱', '備註', '買家備註', '成本'])
             except: st.error("資料讀取失敗"); st.stop()
             
             if '備註' not in df_db.columns: df_db['備註'] = ""
             if '買家備註' not in df_db.columns: df_db['買家備註'] = ""
             mask = (
-                df_db['商品名稱'].astype(str).apply(lambda x: any(sp in x for sp in SPECIAL_PRODUCTS)) & 
+                get_special_matcher().mask(df_db['商品名稱']) & 
                 (~df_db['備註'].astype(str).str.contains("已歸戶"))
             )
             pending = df_db[mask]
@@ -1260,51 +1446,12 @@ elif mode == "⚙️ 後台管理":
 
             if pending.empty:
                 st.balloons()
-                st.success("🎉 太棒了！目前所有特殊訂單都已完成歸戶。")
+                st.success(f"🎉 太棒了！{sp_start} ~ {sp_end} 所有特殊訂單都已完成歸戶。")
             else:
-                st.info(f"💡 系統偵測到有 {len(pending)} 筆待處理特殊訂單，您可透過下方篩選器縮小範圍。")
+                st.info(f"💡 系統偵測到有 {len(pending)} 筆待處理特殊訂單 (篩選範圍所在月份)，可透過上方篩選器調整範圍。")
                 
                 if '訂單成立日期' in pending.columns:
                     pending['訂單成立日期_dt'] = pd.to_datetime(pending['訂單成立日期'], errors='coerce')
-                    min_d = pending['訂單成立日期_dt'].min().date() if not pending['訂單成立日期_dt'].isnull().all() else get_taiwan_time().date()
-                    max_d = pending['訂單成立日期_dt'].max().date() if not pending['訂單成立日期_dt'].isnull().all() else get_taiwan_time().date()
-                else:
-                    min_d = max_d = get_taiwan_time().date()
-                
-                # --- 日期篩選區塊 ---
-                st.markdown("##### 📅 篩選待處理訂單")
-                sc1, sc2 = st.columns([1, 2])
-                with sc1:
-                    sq1, sq2 = st.columns(2)
-                    with sq1:
-                        if st.button("今日", key="btn_sp_today", use_container_width=True):
-                            st.session_state['sp_start'] = get_taiwan_time().date()
-                            st.session_state['sp_end'] = get_taiwan_time().date()
-                        if st.button("昨日", key="btn_sp_yest", use_container_width=True):
-                            yest = get_taiwan_time().date() - timedelta(days=1)
-                            st.session_state['sp_start'] = yest
-                            st.session_state['sp_end'] = yest
-                    with sq2:
-                        if st.button("本月", key="btn_sp_tmonth", use_container_width=True):
-                            today = get_taiwan_time().date()
-                            st.session_state['sp_start'] = today.replace(day=1)
-                            st.session_state['sp_end'] = today
-                        if st.button("全部待處理", key="btn_sp_all", use_container_width=True):
-                            st.session_state['sp_start'] = min_d
-                            st.session_state['sp_end'] = max_d
-                
-                if 'sp_start' not in st.session_state: st.session_state['sp_start'] = min_d
-                if 'sp_end' not in st.session_state: st.session_state['sp_end'] = max_d
-                
-                with sc2:
-                    sd1, sd2 = st.columns(2)
-                    with sd1:
-                        sp_start = st.date_input("起始日期", value=st.session_state['sp_start'], key="sp_start_in")
-                    with sd2:
-                        sp_end = st.date_input("結束日期", value=st.session_state['sp_end'], key="sp_end_in")
-                
-                st.session_state['sp_start'] = sp_start
-                st.session_state['sp_end'] = sp_end
 
                 if '訂單成立日期_dt' in pending.columns:
                     pending_filtered = pending[(pending['訂單成立日期_dt'].dt.date >= sp_start) & (pending['訂單成立日期_dt'].dt.date <= sp_end)]
@@ -1315,7 +1462,7 @@ elif mode == "⚙️ 後台管理":
                     st.warning(f"⚠️ 該區間 ({sp_start} ~ {sp_end}) 內目前無待歸戶的特殊訂單。")
                 else:
                     st.success(f"📌 篩選後共有 {len(pending_filtered)} 筆特殊訂單待歸戶，請直接在下方表格編輯：")
-                    df_cost_ref, _ = load_cloud_cost_table()
+                    df_cost_ref = load_cloud_cost_table()
                     
                     if df_cost_ref is not None:
                         cost_dict = pd.Series(df_cost_ref.成本.values, index=df_cost_ref.Menu_Label).to_dict()
@@ -1325,7 +1472,9 @@ elif mode == "⚙️ 後台管理":
                         show_cols = [c for c in ['訂單成立日期', '訂單編號', '商品名稱', '商品選項名稱', '進蝦皮錢包', '買家備註'] if c in pending_filtered.columns]
                         df_editor = pending_filtered[show_cols].copy()
                         
-                        # 新增編輯欄位 (預設值)
+                        # 新增編輯欄位 (相似度最高的真實商品只列為建議，需自行選擇或勾選採用)
+                        df_editor['建議商品'], df_editor['其他候選'] = suggest_real_products(pending_filtered, df_cost_ref)
+                        df_editor['採用建議'] = False
                         df_editor['真實商品'] = "請選擇對應的真實商品..."
                         df_editor['成本(若為0則自動帶入)'] = 0
                     
@@ -1346,6 +1495,9 @@ elif mode == "⚙️ 後台管理":
                                 options=options,
                                 required=True
                             ),
+                            "建議商品": st.column_config.TextColumn("建議商品", help="相似度最高的真實商品 (僅供參考)", disabled=True, width="medium"),
+                            "採用建議": st.column_config.CheckboxColumn("採用建議", help="勾選後，未選擇真實商品的列以建議商品歸戶"),
+                            "其他候選": st.column_config.TextColumn("其他候選 (相似度)", disabled=True, width="medium"),
                             "成本(若為0則自動帶入)": st.column_config.NumberColumn(
                                 "確認成本",
                                 help="輸入 0 系統會自動從成本表帶入預設成本",
@@ -1364,6 +1516,7 @@ elif mode == "⚙️ 後台管理":
                     if st.button("💾 批量確認歸戶 (Save All)", type="primary", use_container_width=True):
                         success_count = 0
                         fail_count = 0
+                        failed_ids = []
                         updated_rows = 0
                         
                         progress_bar = st.progress(0, text="正在處理中...")
@@ -1372,8 +1525,11 @@ elif mode == "⚙️ 後台管理":
                         # Iterate rows to check valid selections
                         total_rows = len(edited_df)
                         
+                        # 先收集所有選擇，最後一次寫回訂單總表
+                        assignments = []
+                        followups = {}
                         for i, (index, row) in enumerate(edited_df.iterrows()):
-                            real_item = row['真實商品']
+                            real_item = confirmed_real_product(row)
                             input_cost = row['成本(若為0則自動帶入)']
                             order_sn = row['訂單編號']
                             shopee_name = row['商品名稱']
@@ -1387,47 +1543,52 @@ elif mode == "⚙️ 後台管理":
                                 if final_cost == 0 and real_item in cost_dict:
                                     final_cost = int(cost_dict[real_item])
                                 
-                                # 執行歸戶
-                                try:
-                                    real_sku_name = real_item.split(" |")[0].strip()
-                                    
-                                    # 讀取 row 的原始資訊 (為了 save_memory_rule)
-                                    # 其實上面已經有 shopee_name 了
-                                    
-                                    if update_special_order(order_sn, real_sku_name, final_cost, df_db, db_sheet):
-                                        # 自動記憶
-                                        if "7777" not in str(shopee_name):
-                                            save_memory_rule(client, shopee_name, shopee_option, real_sku_name, final_cost)
-                                            
-                                        # 如果使用者手動改了成本，也同步回主表? 
-                                        # 這裡邏輯保留：如果 final_cost != default_cost (user changed it), maybe update master
-                                        default_cost_ref = cost_dict.get(real_item, 0)
-                                        if final_cost != default_cost_ref and final_cost > 0:
-                                            update_master_cost_sheet(client, real_item, final_cost)
-                                            
-                                        success_count += 1
-                                    else:
-                                        fail_count += 1
-                                        print(f"Failed to update {order_sn}")
-                                except Exception as e:
-                                    fail_count += 1
-                                    st.error(f"Error processing {order_sn}: {e}")
+                                real_sku_name = real_item.split(" |")[0].strip()
+                                assignments.append((order_sn, real_sku_name, final_cost))
+                                followups[order_sn] = (shopee_name, shopee_option, real_item, real_sku_name, final_cost)
                             
-                            progress_bar.progress((i + 1) / total_rows)
+                            progress_bar.progress((i + 1) / total_rows * 0.5)
+
+                        # 執行歸戶
+                        if assignments:
+                            try:
+                                done, failed = consolidate_orders(assignments, df_db, order_db)
+                                success_count, fail_count, failed_ids = len(done), len(failed), [str(o) for o in failed]
+                                
+                                cost_updates = []
+                                for order_sn in done:
+                                    shopee_name, shopee_option, real_item, real_sku_name, final_cost = followups[order_sn]
+                                    # 自動記憶
+                                    if "7777" not in str(shopee_name):
+                                        save_memory_rule(shopee_name, shopee_option, real_sku_name, final_cost)
+                                        
+                                    # 如果使用者手動改了成本，也同步回主表? 
+                                    # 這裡邏輯保留：如果 final_cost != default_cost (user changed it), maybe update master
+                                    default_cost_ref = cost_dict.get(real_item, 0)
+                                    if final_cost != default_cost_ref and final_cost > 0:
+                                        cost_updates.append((real_item, final_cost))
+                                update_master_costs(cost_updates)
+                            except Exception as e:
+                                fail_count = len(assignments)
+                                st.error(f"Error processing batch: {e}")
+                            flush_memory_rules()
+                        progress_bar.progress(1.0)
 
                         progress_bar.empty()
                         
                         if updated_rows == 0:
-                            st.warning("⚠️ 您尚未選擇任何「真實商品」，請在表格中選擇後再儲存。")
+                            st.warning("⚠️ 您尚未選擇任何「真實商品」，請在表格中選擇 (或勾選「採用建議」) 後再儲存。")
                         else:
                             if success_count > 0:
                                 st.success(f"✅ 成功歸戶 {success_count} 筆訂單！")
                                 if fail_count > 0:
-                                    st.error(f"❌ {fail_count} 筆處理失敗")
-                                time.sleep(1.5)
-                                st.rerun()
+                                    # 有失敗時不自動重新整理，失敗的訂單編號留在畫面上
+                                    st.error(f"❌ {fail_count} 筆處理失敗" + (f"：{', '.join(failed_ids[:10])}" if failed_ids else ""))
+                                else:
+                                    time.sleep(1.5)
+                                    st.rerun()
                             else:
-                                st.error("❌ 更新失敗，請檢查網路或稍後再試。")
+                                st.error("❌ 更新失敗，請檢查網路或稍後再試。" + (f" (找不到或無法更新：{', '.join(failed_ids[:10])})" if failed_ids else ""))
 
 
             # ========================================================
@@ -1437,18 +1598,46 @@ elif mode == "⚙️ 後台管理":
             st.markdown("#### 💰 一般訂單成本補填 (成本 = $0)")
             st.info("以下為成本欄位為 $0 且尚未歸戶的**一般**訂單（非特殊區），請選擇真實商品並補填成本。")
 
+            # --- 一般訂單日期篩選區塊 (先選範圍，只下載該範圍的月分片；「全部待處理」為整個資料庫的日期範圍) ---
+            st.markdown("##### 📅 篩選一般待處理訂單")
+            zc1, zc2 = st.columns([1, 2])
+            with zc1:
+                zq1, zq2 = st.columns(2)
+                with zq1:
+                    if st.button("今日", key="btn_z_today", use_container_width=True):
+                        set_date_range('z', get_taiwan_time().date(), get_taiwan_time().date())
+                    if st.button("昨日", key="btn_z_yest", use_container_width=True):
+                        yest_z = get_taiwan_time().date() - timedelta(days=1)
+                        set_date_range('z', yest_z, yest_z)
+                with zq2:
+                    if st.button("本月", key="btn_z_tmonth", use_container_width=True):
+                        today_z = get_taiwan_time().date()
+                        set_date_range('z', today_z.replace(day=1), today_z)
+                    if st.button("全部待處理", key="btn_z_all", use_container_width=True):
+                        set_date_range('z', min_d, max_d)
+
+            if 'z_start' not in st.session_state: st.session_state['z_start'] = default_d
+            if 'z_end' not in st.session_state: st.session_state['z_end'] = max_d
+            for k in ('z_start', 'z_end'):
+                if k + '_in' not in st.session_state: st.session_state[k + '_in'] = st.session_state[k]
+
+            with zc2:
+                zd1, zd2 = st.columns(2)
+                with zd1:
+                    z_start = st.date_input("起始日期", key="z_start_in")
+                with zd2:
+                    z_end = st.date_input("結束日期", key="z_end_in")
+
+            st.session_state['z_start'] = z_start
+            st.session_state['z_end'] = z_end
+
             try:
-                client_zero = get_gspread_client()
-                db_sheet_zero = client_zero.open(DB_SHEET_NAME).sheet1
-                data_zero = db_sheet_zero.get_all_values()
-                if len(data_zero) > 1:
-                    df_db_zero = pd.DataFrame(data_zero[1:], columns=data_zero[0])
-                else:
-                    df_db_zero = pd.DataFrame()
+                df_db_zero = order_db.frame(z_start, z_end)
             except Exception as e:
                 st.error(f"讀取資料失敗：{e}")
                 df_db_zero = pd.DataFrame()
 
+            pending_zero_filtered = pd.DataFrame()
             if not df_db_zero.empty:
                 if '備註' not in df_db_zero.columns:
                     df_db_zero['備註'] = ""
@@ -1464,162 +1653,126 @@ elif mode == "⚙️ 後台管理":
                 mask_zero = (
                     (df_db_zero['成本'] == 0) &
                     (~df_db_zero['備註'].astype(str).str.contains("已歸戶")) &
-                    (~df_db_zero['商品名稱'].astype(str).apply(
-                        lambda x: any(sp in x for sp in SPECIAL_PRODUCTS)
-                    ))
+                    (~get_special_matcher().mask(df_db_zero['商品名稱']))
                 )
-                pending_zero = df_db_zero[mask_zero].copy()
+                pending_zero_filtered = df_db_zero[mask_zero].copy()
+                # 分片以月為單位，仍需依所選日期篩選
+                if '訂單成立日期' in pending_zero_filtered.columns:
+                    dates_z = pd.to_datetime(pending_zero_filtered['訂單成立日期'], errors='coerce').dt.date
+                    pending_zero_filtered = pending_zero_filtered[(dates_z >= z_start) & (dates_z <= z_end)]
+
+            if pending_zero_filtered.empty:
+                st.success(f"✅ {z_start} ~ {z_end} 的一般訂單成本均已填寫完成！")
+            else:
+                st.success(f"📌 篩選後共有 {len(pending_zero_filtered)} 筆一般特殊訂單待補填，請在下方表格編輯：")
+                df_cost_ref_zero = load_cloud_cost_table()
+                if df_cost_ref_zero is not None:
+                    cost_dict_zero = pd.Series(
+                        df_cost_ref_zero.成本.values,
+                        index=df_cost_ref_zero.Menu_Label
+                    ).to_dict()
+                    options_zero = ["請選擇對應的真實商品..."] + list(cost_dict_zero.keys())
+
+                    show_cols_zero = [c for c in ['訂單成立日期', '訂單編號', '商品名稱', '商品選項名稱', '進蝦皮錢包', '買家備註'] if c in pending_zero_filtered.columns]
+                    df_editor_zero = pending_zero_filtered[show_cols_zero].copy()
+                    df_editor_zero['建議商品'], df_editor_zero['其他候選'] = suggest_real_products(pending_zero_filtered, df_cost_ref_zero)
+                    df_editor_zero['採用建議'] = False
+                    df_editor_zero['真實商品'] = "請選擇對應的真實商品..."
+                    df_editor_zero['成本(若為0則自動帶入)'] = 0
+
+                    edited_zero = st.data_editor(
+                        df_editor_zero,
+                        column_config={
+                            "訂單成立日期": st.column_config.TextColumn("日期", disabled=True),
+                            "訂單編號": st.column_config.TextColumn("訂單編號", disabled=True),
+                            "商品名稱": st.column_config.TextColumn("蝦皮商品名稱", disabled=True, width="large"),
+                            "商品選項名稱": st.column_config.TextColumn("規格", disabled=True),
+                            "進蝦皮錢包": st.column_config.NumberColumn("進帳", disabled=True, format="$%d"),
+                            "買家備註": st.column_config.TextColumn("買家備註", disabled=True),
+                            "真實商品": st.column_config.SelectboxColumn(
+                                "選擇真實商品",
+                                help="請選擇對應的進貨成本商品",
+                                width="medium",
+                                options=options_zero,
+                                required=True
+                            ),
+                            "建議商品": st.column_config.TextColumn("建議商品", help="相似度最高的真實商品 (僅供參考)", disabled=True, width="medium"),
+                            "採用建議": st.column_config.CheckboxColumn("採用建議", help="勾選後，未選擇真實商品的列以建議商品歸戶"),
+                            "其他候選": st.column_config.TextColumn("其他候選 (相似度)", disabled=True, width="medium"),
+                            "成本(若為0則自動帶入)": st.column_config.NumberColumn(
+                                "確認成本",
+                                help="輸入 0 系統會自動從成本表帶入預設成本",
+                                min_value=0,
+                                step=1,
+                                format="$%d"
+                            ),
+                        },
+                        hide_index=True,
+                        use_container_width=True,
+                        num_rows="fixed",
+                        key="zero_cost_editor"
+                    )
 
-                if pending_zero.empty:
-                    st.success("✅ 所有一般訂單的成本均已填寫完成！")
+                    if st.button("💾 批量補填成本 (Save All)", type="primary", use_container_width=True, key="save_zero_cost"):
+                        success_z = 0
+                        fail_z = 0
+                        updated_z = 0
+                        bar_z = st.progress(0, text="正在處理...")
+                        total_z = len(edited_zero)
+
+                        assignments_z = []
+                        followups_z = {}
+                        for i, (idx_z, row_z) in enumerate(edited_zero.iterrows()):
+                            real_item_z = confirmed_real_product(row_z)
+                            input_cost_z = row_z['成本(若為0則自動帶入)']
+                            order_sn_z = row_z['訂單編號']
+                            shopee_name_z = row_z['商品名稱']
+                            shopee_opt_z = row_z.get('商品選項名稱', '')
+
+                            if real_item_z != "請選擇對應的真實商品...":
+                                updated_z += 1
+                                final_cost_z = input_cost_z
+                                if final_cost_z == 0 and real_item_z in cost_dict_zero:
+                                    final_cost_z = int(cost_dict_zero[real_item_z])
+
+                                real_sku_name_z = real_item_z.split(" |")[0].strip()
+                                assignments_z.append((order_sn_z, real_sku_name_z, final_cost_z))
+                                followups_z[order_sn_z] = (shopee_name_z, shopee_opt_z, real_item_z, real_sku_name_z, final_cost_z)
+
+                            bar_z.progress((i + 1) / total_z * 0.5)
+
+                        if assignments_z:
+                            try:
+                                done_z, failed_z = consolidate_orders(assignments_z, df_db_zero, order_db)
+                                success_z, fail_z = len(done_z), len(failed_z)
+                                cost_updates_z = []
+                                for order_sn_z in done_z:
+                                    shopee_name_z, shopee_opt_z, real_item_z, real_sku_name_z, final_cost_z = followups_z[order_sn_z]
+                                    save_memory_rule(shopee_name_z, shopee_opt_z, real_sku_name_z, final_cost_z)
+                                    default_cost_z = cost_dict_zero.get(real_item_z, 0)
+                                    if final_cost_z != default_cost_z and final_cost_z > 0:
+                                        cost_updates_z.append((real_item_z, final_cost_z))
+                                update_master_costs(cost_updates_z)
+                            except Exception as e:
+                                fail_z = len(assignments_z)
+                                st.error(f"批次補填時發生錯誤：{e}")
+                            flush_memory_rules()
+                        bar_z.progress(1.0)
+
+                        bar_z.empty()
+
+                        if updated_z == 0:
+                            st.warning("⚠️ 您尚未選擇任何「真實商品」，請在表格中選擇 (或勾選「採用建議」) 後再儲存。")
+                        else:
+                            if success_z > 0:
+                                st.success(f"✅ 成功補填 {success_z} 筆訂單的成本！")
+                            if fail_z > 0:
+                                st.error(f"❌ {fail_z} 筆處理失敗")
+                            if success_z > 0:
+                                time.sleep(1.5)
+                                st.rerun()
                 else:
-                    st.info(f"💡 系統偵測到有 {len(pending_zero)} 筆待處理的一般零元訂單，您可透過下方篩選器縮小範圍。")
-                    
-                    if '訂單成立日期' in pending_zero.columns:
-                        pending_zero['訂單成立日期_dt'] = pd.to_datetime(pending_zero['訂單成立日期'], errors='coerce')
-                        min_d_z = pending_zero['訂單成立日期_dt'].min().date() if not pending_zero['訂單成立日期_dt'].isnull().all() else get_taiwan_time().date()
-                        max_d_z = pending_zero['訂單成立日期_dt'].max().date() if not pending_zero['訂單成立日期_dt'].isnull().all() else get_taiwan_time().date()
-                    else:
-                        min_d_z = max_d_z = get_taiwan_time().date()
-                    
-                    # --- 一般訂單日期篩選區塊 ---
-                    st.markdown("##### 📅 篩選一般待處理訂單")
-                    zc1, zc2 = st.columns([1, 2])
-                    with zc1:
-                        zq1, zq2 = st.columns(2)
-                        with zq1:
-                            if st.button("今日", key="btn_z_today", use_container_width=True):
-                                st.session_state['z_start'] = get_taiwan_time().date()
-                                st.session_state['z_end'] = get_taiwan_time().date()
-                            if st.button("昨日", key="btn_z_yest", use_container_width=True):
-                                yest_z = get_taiwan_time().date() - timedelta(days=1)
-                                st.session_state['z_start'] = yest_z
-                                st.session_state['z_end'] = yest_z
-                        with zq2:
-                            if st.button("本月", key="btn_z_tmonth", use_container_width=True):
-                                today_z = get_taiwan_time().date()
-                                st.session_state['z_start'] = today_z.replace(day=1)
-                                st.session_state['z_end'] = today_z
-                            if st.button("全部待處理", key="btn_z_all", use_container_width=True):
-                                st.session_state['z_start'] = min_d_z
-                                st.session_state['z_end'] = max_d_z
-                    
-                    if 'z_start' not in st.session_state: st.session_state['z_start'] = min_d_z
-                    if 'z_end' not in st.session_state: st.session_state['z_end'] = max_d_z
-                    
-                    with zc2:
-                        zd1, zd2 = st.columns(2)
-                        with zd1:
-                            z_start = st.date_input("起始日期", value=st.session_state['z_start'], key="z_start_in")
-                        with zd2:
-                            z_end = st.date_input("結束日期", value=st.session_state['z_end'], key="z_end_in")
-                            
-                    st.session_state['z_start'] = z_start
-                    st.session_state['z_end'] = z_end
-
-                    if '訂單成立日期_dt' in pending_zero.columns:
-                        pending_zero_filtered = pending_zero[(pending_zero['訂單成立日期_dt'].dt.date >= z_start) & (pending_zero['訂單成立日期_dt'].dt.date <= z_end)]
-                    else:
-                        pending_zero_filtered = pending_zero
-
-                    if pending_zero_filtered.empty:
-                        st.warning(f"⚠️ 該區間 ({z_start} ~ {z_end}) 內目前無一般零元訂單待補填。")
-                    else:
-                        st.success(f"📌 篩選後共有 {len(pending_zero_filtered)} 筆一般特殊訂單待補填，請在下方表格編輯：")
-                        df_cost_ref_zero, _ = load_cloud_cost_table()
-                        if df_cost_ref_zero is not None:
-                            cost_dict_zero = pd.Series(
-                                df_cost_ref_zero.成本.values,
-                                index=df_cost_ref_zero.Menu_Label
-                            ).to_dict()
-                            options_zero = ["請選擇對應的真實商品..."] + list(cost_dict_zero.keys())
-
-                            show_cols_zero = [c for c in ['訂單成立日期', '訂單編號', '商品名稱', '商品選項名稱', '進蝦皮錢包', '買家備註'] if c in pending_zero_filtered.columns]
-                            df_editor_zero = pending_zero_filtered[show_cols_zero].copy()
-                            df_editor_zero['真實商品'] = "請選擇對應的真實商品..."
-                            df_editor_zero['成本(若為0則自動帶入)'] = 0
-
-                            edited_zero = st.data_editor(
-                                df_editor_zero,
-                                column_config={
-                                    "訂單成立日期": st.column_config.TextColumn("日期", disabled=True),
-                                    "訂單編號": st.column_config.TextColumn("訂單編號", disabled=True),
-                                    "商品名稱": st.column_config.TextColumn("蝦皮商品名稱", disabled=True, width="large"),
-                                    "商品選項名稱": st.column_config.TextColumn("規格", disabled=True),
-                                    "進蝦皮錢包": st.column_config.NumberColumn("進帳", disabled=True, format="$%d"),
-                                    "買家備註": st.column_config.TextColumn("買家備註", disabled=True),
-                                    "真實商品": st.column_config.SelectboxColumn(
-                                        "選擇真實商品",
-                                        help="請選擇對應的進貨成本商品",
-                                        width="medium",
-                                        options=options_zero,
-                                        required=True
-                                    ),
-                                    "成本(若為0則自動帶入)": st.column_config.NumberColumn(
-                                        "確認成本",
-                                        help="輸入 0 系統會自動從成本表帶入預設成本",
-                                        min_value=0,
-                                        step=1,
-                                        format="$%d"
-                                    ),
-                                },
-                                hide_index=True,
-                                use_container_width=True,
-                                num_rows="fixed",
-                                key="zero_cost_editor"
-                            )
-
-                            if st.button("💾 批量補填成本 (Save All)", type="primary", use_container_width=True, key="save_zero_cost"):
-                                success_z = 0
-                                fail_z = 0
-                                updated_z = 0
-                                bar_z = st.progress(0, text="正在處理...")
-                                total_z = len(edited_zero)
-
-                                for i, (idx_z, row_z) in enumerate(edited_zero.iterrows()):
-                                    real_item_z = row_z['真實商品']
-                                    input_cost_z = row_z['成本(若為0則自動帶入)']
-                                    order_sn_z = row_z['訂單編號']
-                                    shopee_name_z = row_z['商品名稱']
-                                    shopee_opt_z = row_z.get('商品選項名稱', '')
-
-                                    if real_item_z != "請選擇對應的真實商品...":
-                                        updated_z += 1
-                                        final_cost_z = input_cost_z
-                                        if final_cost_z == 0 and real_item_z in cost_dict_zero:
-                                            final_cost_z = int(cost_dict_zero[real_item_z])
-
-                                        try:
-                                            real_sku_name_z = real_item_z.split(" |")[0].strip()
-                                            if update_special_order(order_sn_z, real_sku_name_z, final_cost_z, df_db_zero, db_sheet_zero):
-                                                save_memory_rule(client_zero, shopee_name_z, shopee_opt_z, real_sku_name_z, final_cost_z)
-                                                default_cost_z = cost_dict_zero.get(real_item_z, 0)
-                                                if final_cost_z != default_cost_z and final_cost_z > 0:
-                                                    update_master_cost_sheet(client_zero, real_item_z, final_cost_z)
-                                                success_z += 1
-                                            else:
-                                                fail_z += 1
-                                        except Exception as e:
-                                            fail_z += 1
-                                            st.error(f"處理 {order_sn_z} 時發生錯誤：{e}")
-
-                                    bar_z.progress((i + 1) / total_z)
-
-                                bar_z.empty()
-
-                                if updated_z == 0:
-                                    st.warning("⚠️ 您尚未選擇任何「真實商品」，請在表格中選擇後再儲存。")
-                                else:
-                                    if success_z > 0:
-                                        st.success(f"✅ 成功補填 {success_z} 筆訂單的成本！")
-                                    if fail_z > 0:
-                                        st.error(f"❌ {fail_z} 筆處理失敗")
-                                    if success_z > 0:
-                                        time.sleep(1.5)
-                                        st.cache_data.clear()
-                                        st.rerun()
-                    else:
-                        st.error("❌ 無法載入成本表，請確認 Google Sheet 連線。")
+                    st.error("❌ 無法載入成本表，請確認 Google Sheet 連線。")
 
         with tab3:
             st.markdown("#### 🛠️ 商品資料批量維護")
@@ -1629,28 +1782,72 @@ elif mode == "⚙️ 後台管理":
                 if mass_file:
                     if st.button("開始同步至編碼表"):
                         bar = st.progress(0, "分析中...")
-                        df_new = process_mass_update_file(mass_file)
-                        if df_new is not None:
-                            client = get_gspread_client()
-                            sheet = client.open(COST_SHEET_NAME).sheet1
-                            cnt = sync_new_products(df_new, sheet, bar)
+                        try:
+                            cnt = sync_new_products(process_mass_update_file(mass_file), get_storage(), bar)
                             st.success(f"✅ 同步完成！共新增 {cnt} 筆新商品。")
-                        else:
-                            st.error("檔案解析失敗")
+                        except Exception as e:
+                            st.error(f"檔案解析失敗：{e}")
+                        # 中途失敗時前面的批次可能已寫入
+                        get_cache().invalidate(DATASET_COST)
             
             with st.expander("🚑 成本資料救援 (從 2026 舊表)", expanded=False):
                 st.warning("⚠️ 此功能僅在「新增商品」後，發現成本都是 0 時使用。")
                 if st.button("執行救援任務"):
                     bar2 = st.progress(0, "連線舊資料庫...")
                     res = auto_fill_costs_from_legacy(bar2)
+                    get_cache().invalidate(DATASET_COST)
                     st.success(res)
-            
+
+            with st.expander("🗂️ 訂單月分片", expanded=False):
+                order_db = get_order_db()
+                shards = order_db.manifest()
+                if shards:
+                    st.success(f"✅ 訂單已依月份分片 (共 {len(shards)} 個分片)，查詢時只會讀取所選日期範圍的分片。")
+                    st.dataframe(pd.DataFrame(shards)[['month', 'start', 'end', 'rows', 'updated']].rename(
+                        columns={'month': '分片', 'start': '起始日期', 'end': '結束日期', 'rows': '列數', 'updated': '更新時間'}),
+                        use_container_width=True, hide_index=True)
+                else:
+                    st.info(f"目前所有訂單都在『{DB_SHEET_NAME}』同一個分頁，每次查詢都要讀取全部訂單。"
+                            "轉換後每個月份一個分頁 (原分頁保留不動，作為備份)。")
+                    if st.button("🗂️ 轉換為月分片", use_container_width=True):
+                        with st.spinner("正在拆分訂單..."):
+                            try:
+                                res = order_db.migrate_to_shards()
+                                st.success(f"✅ 轉換完成：{res}")
+                            except Exception as e: st.error(f"❌ 轉換失敗：{e}")
+
+            with st.expander("🏷️ 特殊商品重新分類", expanded=False):
+                st.info("特殊商品關鍵字：" + "、".join(SPECIAL_PRODUCTS))
+                st.caption("關鍵字清單修改後執行一次：所有歷史訂單依新清單重新標記「待人工確認」(已歸戶的訂單不受影響)。")
+                if st.button("🏷️ 重新分類所有訂單", use_container_width=True):
+                    st.session_state["ingest_job"] = get_job_queue().submit("特殊商品重新分類", run_reclassify_job, get_order_db(), get_special_matcher())
+                    st.info("⏳ 已排入背景工作，進度請見「📥 訂單上傳」分頁的工作列表。")
+
+            if STORAGE_BACKEND != "sheets":
+                with st.expander("☁️ 本機資料庫 ⇄ Google Sheets 同步", expanded=False):
+                    st.info(f"目前使用本機儲存 ({STORAGE_BACKEND})，Google Sheets 僅作為同步備份。")
+                    sc_pull, sc_push = st.columns(2)
+                    with sc_pull:
+                        if st.button("⬇️ 從 Google Sheets 匯入", use_container_width=True):
+                            try:
+                                res = sync_storage(get_sheets_storage(), get_storage())
+                                st.success(f"✅ 匯入完成：{res}")
+                                get_memory_store().flush(); get_cache().invalidate_all()
+                            except Exception as e: st.error(f"❌ 匯入失敗：{e}")
+                    with sc_push:
+                        if st.button("⬆️ 上傳至 Google Sheets", use_container_width=True):
+                            try:
+                                res = sync_storage(get_storage(), get_sheets_storage(),
+                                                   datasets=[DATASET_COST, DATASET_ORDERS, DATASET_MEMORY, DATASET_AD_COST, DATASET_ORDER_SHARDS])
+                                st.success(f"✅ 上傳完成：{res}")
+                            except Exception as e: st.error(f"❌ 上傳失敗：{e}")
+
         with tab4:
             st.markdown("#### 🤝 非蝦皮訂單手動錄入 (私下轉帳)")
             st.info("此功能用於記錄「非蝦皮平台」的交易（如街口、將來銀行轉帳），手續費將自動設為 $0。")
             
             # 取得成本表資料
-            df_cost_ref, _ = load_cloud_cost_table()
+            df_cost_ref = load_cloud_cost_table()
             
             if df_cost_ref is not None:
                 cost_dict = pd.Series(df_cost_ref.成本.values, index=df_cost_ref.Menu_Label).to_dict()
@@ -1695,7 +1892,7 @@ elif mode == "⚙️ 後台管理":
                                 total_profit = total_income - total_cost
                                 
                                 # 準備寫入 Row
-                                # headers = ['訂單編號', '訂單成立日期', '商品名稱', '商品選項名稱', '數量', '售價', '成交手續費', '金流與系統處理費', '其他服務費', '蝦皮付費總金額', '進蝦皮錢包', '成本', '總利潤', '蝦皮商品編碼', '資料備份時間', '備註']
+                                # headers = ['訂單編號', '訂單成立日期', '商品名稱', '商品選項名稱', '數量', '售價', '成交手續費', '金流與系統處理費', '其他服務費', '蝦皮付費總金額', '進蝦皮錢包', '成本', '總利潤', '蝦皮商品編碼', '買家備註', '資料備份時間', '備註']
                                 new_row = [
                                     off_id,
                                     m_date.strftime("%Y-%m-%d"),
@@ -1708,17 +1905,15 @@ elif mode == "⚙️ 後台管理":
                                     m_cost,
                                     total_profit,
                                     "OFF-PLATFORM", # 編碼
+                                    "", # 買家備註
                                     get_taiwan_time().strftime("%Y-%m-%d %H:%M:%S"),
                                     f"轉帳: {m_bank}"
                                 ]
                                 
                                 try:
-                                    client = get_gspread_client()
-                                    db_sheet = client.open(DB_SHEET_NAME).sheet1
-                                    db_sheet.append_row([str(x) for x in new_row])
+                                    get_order_db().append_rows([[str(x) for x in new_row]])
                                     st.success(f"🎉 訂單錄入成功！ ID: {off_id}")
                                     st.balloons()
-                                    st.cache_data.clear()
                                 except Exception as e:
                                     st.error(f"❌ 寫入失敗: {e}")
             else:
@@ -1729,8 +1924,7 @@ elif mode == "⚙️ 後台管理":
             st.info("請輸入每天在蝦皮或站外投放廣告所產生的真實費用，這將會合併至前台戰情室計算真淨毛利。")
             
             # Form for input
-            client = get_gspread_client()
-            ad_df = get_ad_costs_df(client)
+            ad_df = get_ad_costs_df()
             
             with st.form("ad_cost_form", clear_on_submit=False):
                 c1, c2 = st.columns(2)
@@ -1739,10 +1933,10 @@ elif mode == "⚙️ 後台管理":
                 
                 # Check exist ad cost
                 default_ad_cost = 0
-                if not ad_df.empty:
-                    exist_row = ad_df[ad_df['日期'] == ad_date]
-                    if not exist_row.empty:
-                        default_ad_cost = int(exist_row.iloc[0]['廣告費用'])
+                try: exist_cost = get_ad_store().cost_on(ad_date)
+                except: exist_cost = None
+                if exist_cost is not None:
+                    default_ad_cost = int(exist_cost)
                         
                 with c2:
                     ad_cost_val = st.number_input("💰 廣告花費金額", min_value=0, value=default_ad_cost, step=50, format="%d")
@@ -1751,10 +1945,9 @@ elif mode == "⚙️ 後台管理":
                 
                 if submit_ad:
                     with st.spinner("正在儲存資料..."):
-                        if save_ad_cost(client, ad_date, ad_cost_val):
+                        if save_ad_cost(ad_date, ad_cost_val):
                             st.success(f"✅ 成功儲存 {ad_date.strftime('%Y-%m-%d')} 廣告費用: ${ad_cost_val}")
                             time.sleep(1)
-                            st.cache_data.clear()
                             st.rerun()
                         else:
                             st.error("❌ 儲存失敗，請檢查網路狀態或重試")
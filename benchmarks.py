@@ -0,0 +1,328 @@
+# ==========================================
+# 效能基準測試 (離線執行，不連 Google Sheets)
+# ==========================================
+# 用法：python benchmarks.py <項目> [--rows N]
+#   excel : 蝦皮訂單報表讀取 (舊流程 vs sales_report.read_report)
+#   ids   : 編碼正規化 (逐格 clean_id vs 向量化 clean_ids)，預設 10k / 100k / 1M 筆
+#   merge : 上傳訂單併入訂單總表 (逐列搜尋 vs order_db.merge_upload)，--rows 為訂單總表列數
+#   sku   : 真實商品模糊搜尋 (sku_index.SkuIndex)，--rows 為成本表商品數，另查詢 1k 筆待歸戶訂單
+#   rollup: 前台區間統計 (逐筆篩選+groupby vs 每日彙總表)，--rows 為訂單數
+import argparse
+import io
+import random
+import time
+
+import pandas as pd
+
+EXCEL_PWD = "287667"
+
+
+def timed(fn, *args, repeat=1):
+    """回傳 (最短秒數, 最後一次的結果)"""
+    best, result = None, None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = fn(*args)
+        elapsed = time.perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def report(title, rows):
+    print(f"\n== {title} ==")
+    base = rows[0][1]
+    for label, sec in rows:
+        print(f"  {label:<28} {sec:8.3f}s   x{base / sec:5.1f}")
+
+
+# ==========================================
+# 蝦皮訂單報表
+# ==========================================
+# 蝦皮 Order.all 報表約 50 欄，process_orders 只用到其中十幾欄
+SHOPEE_COLUMNS = ['訂單編號', '訂單狀態', '不成立原因', '退貨 / 退款狀態', '買家帳號', '訂單成立日期', '訂單付款時間', '付款方式', '分期付款期數',
+                  '分期手續費率', '商品名稱', '商品選項名稱', '商品原價', '商品活動價格', '商品總價', '數量', '退貨數量', '主商品貨號', '商品選項貨號',
+                  '蝦皮商品編碼 (商品ID_規格ID)', '商品重量', '訂單總重量', '賣場優惠券', '蝦幣折抵', '蝦皮優惠券', '優惠代碼', '成交手續費',
+                  '金流與系統處理費', '其他服務費', '買家支付運費', '蝦皮補貼運費', '預估運費', '訂單小計 (撥款金額)', '收件者姓名', '收件者電話',
+                  '取件門市店號', '城市', '行政區', '郵遞區號', '收件地址', '寄送方式', '出貨方式', '物流追蹤號碼', '預計出貨日期', '實際出貨時間',
+                  '訂單完成時間', '買家備註', '備註', '發票類型', '統一編號']
+
+
+def make_sales_report(rows, seed=0):
+    rng = random.Random(seed)
+    data = {}
+    for col in SHOPEE_COLUMNS:
+        if col == '訂單編號': data[col] = [f"2601{i:08d}ABC" for i in range(rows)]
+        elif col == '訂單成立日期': data[col] = [f"2026-01-{rng.randint(1, 28):02d} {rng.randint(0, 23):02d}:{rng.randint(0, 59):02d}" for _ in range(rows)]
+        elif col in ('商品總價', '商品原價', '商品活動價格', '訂單小計 (撥款金額)'): data[col] = [rng.randint(100, 3000) for _ in range(rows)]
+        elif col in ('數量', '成交手續費', '金流與系統處理費', '其他服務費', '買家支付運費'): data[col] = [rng.randint(0, 60) for _ in range(rows)]
+        elif col == '蝦皮商品編碼 (商品ID_規格ID)': data[col] = [f"{rng.randint(10**9, 10**10)}_{rng.randint(10**9, 10**10)}" for _ in range(rows)]
+        else: data[col] = [f"{col}{rng.randint(0, 999)}" for _ in range(rows)]
+    return pd.DataFrame(data)
+
+
+def encrypt_xlsx(plain, password):
+    from msoffcrypto.format.ooxml import OOXMLFile
+    out = io.BytesIO()
+    OOXMLFile(io.BytesIO(plain)).encrypt(password, out)
+    return out.getvalue()
+
+
+def legacy_load_sales_report(file_content):
+    """舊版 load_sales_report：先用 openpyxl 試讀，失敗才解密，再以 openpyxl 解析全部欄位"""
+    import msoffcrypto
+    try: df = pd.read_excel(io.BytesIO(file_content), engine='openpyxl')
+    except Exception:
+        decrypted = io.BytesIO()
+        office_file = msoffcrypto.OfficeFile(io.BytesIO(file_content))
+        office_file.load_key(password=EXCEL_PWD)
+        office_file.decrypt(decrypted)
+        decrypted.seek(0)
+        df = pd.read_excel(decrypted)
+    df.columns = df.columns.astype(str).str.strip().str.replace('\n', '')
+    return df
+
+
+def bench_excel(rows):
+    from sales_report import read_report
+    print(f"產生 {rows} 列 × {len(SHOPEE_COLUMNS)} 欄的測試報表...")
+    buf = io.BytesIO()
+    make_sales_report(rows).to_excel(buf, index=False, engine='openpyxl')
+    plain = buf.getvalue()
+    encrypted = encrypt_xlsx(plain, EXCEL_PWD)
+
+    legacy_sec, legacy_df = timed(legacy_load_sales_report, encrypted)
+    full_sec, _ = timed(read_report, encrypted, EXCEL_PWD, None)
+    fast_sec, fast_df = timed(read_report, encrypted, EXCEL_PWD)
+    assert len(fast_df) == len(legacy_df) == rows
+    assert fast_df['訂單編號'].tolist() == legacy_df['訂單編號'].tolist()
+    report(f"加密報表 {rows} 列", [("舊流程 (openpyxl 試讀+解密)", legacy_sec),
+                                  ("read_report (全部欄位)", full_sec),
+                                  (f"read_report ({len(fast_df.columns)} 欄)", fast_sec)])
+
+    legacy_sec, _ = timed(legacy_load_sales_report, plain)
+    fast_sec, _ = timed(read_report, plain, EXCEL_PWD)
+    report(f"未加密報表 {rows} 列", [("舊流程 (openpyxl)", legacy_sec), ("read_report", fast_sec)])
+
+
+# ==========================================
+# 編碼正規化
+# ==========================================
+def make_ids(rows, seed=0, mixed=False):
+    """
+    mixed=False：試算表讀回的編碼 (全是字串：ID_規格ID、純數字、科學記號、"xxx.0"、空字串)
+    mixed=True ：Excel 讀回的欄位 (另外混有浮點數與 None)
+    """
+    rng = random.Random(seed)
+    out = []
+    for _ in range(rows):
+        r = rng.random()
+        if r < 0.6: out.append(f"{rng.randint(10**9, 10**11)}_{rng.randint(10**9, 10**11)}")
+        elif r < 0.7: out.append(f"{rng.randint(10**9, 10**11):.5E}")
+        elif r < 0.8: out.append(f"{rng.randint(10**9, 10**11)}.0")
+        elif r < 0.95: out.append(float(rng.randint(10**9, 10**11)) if mixed else str(rng.randint(10**9, 10**11)))
+        else: out.append(rng.choice(["", None]) if mixed else "")
+    return pd.Series(out, dtype=object)
+
+
+def bench_ids(rows):
+    from ids import clean_id, clean_ids
+    for n in ([rows] if rows else [10_000, 100_000, 1_000_000]):
+        for mixed, label in ((False, "試算表字串"), (True, "Excel 混合型別")):
+            ids = make_ids(n, mixed=mixed)
+            repeat = 3 if n <= 100_000 else 1
+            row_sec, expected = timed(lambda: ids.apply(clean_id), repeat=repeat)
+            vec_sec, got = timed(lambda: clean_ids(ids), repeat=repeat)
+            assert got.tolist() == expected.tolist()
+            report(f"編碼正規化 {n} 筆 ({label})", [("Series.apply(clean_id)", row_sec), ("clean_ids", vec_sec)])
+
+
+# ==========================================
+# 上傳訂單併入訂單總表
+# ==========================================
+ORDER_HEADERS = ['訂單編號', '訂單成立日期', '商品名稱', '商品選項名稱', '數量', '售價', '成交手續費', '金流與系統處理費', '其他服務費',
+                 '蝦皮付費總金額', '進蝦皮錢包', '成本', '總利潤', '蝦皮商品編碼', '買家備註', '資料備份時間', '備註']
+
+
+def make_orders(ids, rng, consolidated=0.0):
+    rows = []
+    for oid in ids:
+        note = f"已歸戶(記憶): SKU{rng.randint(0, 99)}" if rng.random() < consolidated else rng.choice(["", "", "待人工確認"])
+        rows.append([oid, f"2026-0{rng.randint(1, 9)}-{rng.randint(10, 28)} 12:00", f"商品{rng.randint(0, 999)}", "", "1",
+                     str(rng.randint(100, 999)), "10", "5", "0", "15", "300", "100", "200", f"{rng.randint(10**9, 10**10)}_1", "",
+                     "2026-10-01 00:00:00", note])
+    return rows
+
+
+def legacy_merge_upload(df_existing, df_upload):
+    """舊版 process_orders 的逐列合併 (每筆既有訂單都對整欄做一次比對)"""
+    existing_dict = df_existing.set_index('訂單編號').to_dict('index')
+    new_records, updated, skipped = [], 0, 0
+    for _, row in df_upload.iterrows():
+        order_id = row['訂單編號']
+        if order_id in existing_dict:
+            if "已歸戶" in str(existing_dict[order_id].get('備註', '')):
+                skipped += 1
+                target_idx = df_existing.index[df_existing['訂單編號'] == order_id]
+                for field in ['訂單成立日期', '訂單狀態', '商品名稱', '買家備註']:
+                    if field in df_existing.columns and field in row: df_existing.at[target_idx[0], field] = str(row[field])
+            else:
+                target_idx = df_existing.index[df_existing['訂單編號'] == order_id]
+                df_existing.loc[target_idx[0]] = row
+                updated += 1
+        else: new_records.append(row)
+    df_final = pd.concat([df_existing, pd.DataFrame(new_records)], ignore_index=True) if new_records else df_existing
+    return df_final, (len(new_records), updated, skipped)
+
+
+def fast_merge_upload(df_existing, df_upload):
+    from order_db import merge_upload
+    merged = merge_upload(df_existing, df_upload)
+    df_final = pd.concat([df_existing, merged['new']], ignore_index=True) if len(merged['new']) else df_existing
+    return df_final, (len(merged['new']), len(merged['updated']), len(merged['protected']))
+
+
+def bench_merge(rows):
+    rng = random.Random(0)
+    existing = pd.DataFrame(make_orders([f"E{i:09d}" for i in range(rows)], rng, consolidated=0.3), columns=ORDER_HEADERS)
+    print(f"訂單總表 {rows} 列 (30% 已歸戶)；上傳一半是既有訂單、一半是新訂單")
+    for n in (500, 1000, 2000, 4000, 8000):
+        picked = rng.sample(range(rows), min(n // 2, rows))
+        ids = [f"E{i:09d}" for i in picked] + [f"N{i:09d}" for i in range(n - len(picked))]
+        rng.shuffle(ids)
+        upload = pd.DataFrame(make_orders(ids, rng), columns=ORDER_HEADERS)
+        fast_sec, (fast_df, fast_counts) = timed(lambda: fast_merge_upload(existing.copy(), upload), repeat=3)
+        results = [("merge_upload", fast_sec)]
+        if n <= 2000:
+            legacy_sec, (legacy_df, legacy_counts) = timed(lambda: legacy_merge_upload(existing.copy(), upload))
+            assert legacy_counts == fast_counts and legacy_df.fillna('').equals(fast_df.fillna(''))
+            results.insert(0, ("逐列合併 (舊流程)", legacy_sec))
+        report(f"上傳 {n} 列 (新增/更新/略過 = {fast_counts})", results)
+
+
+# ==========================================
+# 真實商品模糊搜尋
+# ==========================================
+SKU_BRANDS = ['Apple', 'Samsung', 'Sony', 'Netflix', 'Spotify', 'ChatGPT', 'Canva', 'Adobe', 'Nintendo', 'Xiaomi', '美圖秀秀', 'YouTube']
+SKU_ITEMS = ['手機殼', '保護貼', '充電線', '耳機套', '月費', '年費', '禮物卡', '點數卡', '會員', '序號', '貼紙', '鑰匙圈', '帆布袋', '馬克杯']
+SKU_VARIANTS = ['黑色', '白色', '透明', '粉紅', '1個月', '3個月', '12個月', 'Plus', 'Pro', 'Max', '大', '小', '客製刻字', '雙入組']
+
+
+def make_skus(rows, rng):
+    names = set()
+    while len(names) < rows:
+        names.add(f"{rng.choice(SKU_BRANDS)} {rng.choice(SKU_ITEMS)} {rng.choice(SKU_VARIANTS)} {rng.randint(1, 999)}型")
+    return sorted(names)
+
+
+def make_pending(skus, rows, rng):
+    """待歸戶訂單 (商品名稱, 規格, 買家備註, 正解)：蝦皮名稱是特殊賣場，真實商品藏在規格或備註裡"""
+    out = []
+    for _ in range(rows):
+        sku = rng.choice(skus)
+        words = sku.split()
+        rng.shuffle(words)
+        hint = (" " if rng.random() < 0.5 else "").join(w.upper() if rng.random() < 0.3 else w for w in words)
+        name = rng.choice(["7777下單信用卡專區", "客製化專屬賣場", "補差價專用"])
+        if rng.random() < 0.6: out.append((name, hint, "", sku))
+        else: out.append((name, "", f"我要買 {hint} 謝謝", sku))
+    return out
+
+
+def bench_sku(rows):
+    from matching import normalize_name
+    from sku_index import SkuIndex
+    rng = random.Random(0)
+    skus = make_skus(rows, rng)
+    pending = make_pending(skus, 1000, rng)
+    build_sec, index = timed(SkuIndex, skus, repeat=3)
+    print(f"成本表 {rows} 個商品，索引建立 {build_sec * 1000:.0f} ms")
+
+    exact = {normalize_name(s): s for s in skus}
+    exact_hits = sum(exact.get(normalize_name(f"{n} [{o}]" if o else n)) == sku or exact.get(normalize_name(o)) == sku
+                     for n, o, _, sku in pending)
+    per_query, top1, top5 = [], 0, 0
+    for name, option, note, sku in pending:
+        t0 = time.perf_counter()
+        found = index.search(name, option, note, k=5)
+        per_query.append(time.perf_counter() - t0)
+        labels = [label for label, _ in found]
+        top1 += bool(labels) and labels[0] == sku
+        top5 += sku in labels
+    per_query.sort()
+    n = len(pending)
+    print(f"  每筆查詢: 平均 {sum(per_query) / n * 1000:.3f} ms, p99 {per_query[int(n * 0.99)] * 1000:.3f} ms, 全部 {sum(per_query):.3f}s")
+    print(f"  標準化完全比對命中: {exact_hits / n:6.1%}")
+    print(f"  n-gram 第一名正確  : {top1 / n:6.1%}")
+    print(f"  n-gram 前 5 名含正解: {top5 / n:6.1%}")
+
+
+# ==========================================
+# 前台區間統計
+# ==========================================
+def make_typed_orders(rows, rng, days=365, products=2000):
+    base = pd.Timestamp("2026-01-01")
+    return pd.DataFrame({
+        '訂單成立日期': [base + pd.Timedelta(days=rng.randrange(days), minutes=rng.randrange(1440)) for _ in range(rows)],
+        '商品名稱': [f"商品{rng.randrange(products)}" if rng.random() > 0.05 else "補差價專區" for _ in range(rows)],
+        '備註': [""] * rows,
+        '售價': [float(rng.randint(100, 3000)) for _ in range(rows)],
+        '成本': [float(rng.randint(50, 1500)) for _ in range(rows)],
+        '數量': [float(rng.randint(1, 3)) for _ in range(rows)],
+        '總利潤': [float(rng.randint(-100, 800)) for _ in range(rows)],
+    })
+
+
+def legacy_range_stats(df, start, end, is_special):
+    """舊版前台：篩選日期後逐筆計算 KPI、每日趨勢、商品排行"""
+    day = df[(df['訂單成立日期'].dt.date >= start) & (df['訂單成立日期'].dt.date <= end)]
+    special = is_special(day)
+    normal = day[~special]
+    kpi = (normal['售價'].sum(), (normal['成本'] * normal['數量']).sum(), normal['總利潤'].sum())
+    daily = day.groupby(day['訂單成立日期'].dt.strftime('%Y-%m-%d')).agg({'售價': 'sum', '總利潤': 'sum'})
+    top = day.groupby('商品名稱').agg({'售價': 'sum', '總利潤': 'sum', '數量': 'sum'}).nlargest(10, '售價')
+    return kpi, daily, top
+
+
+def rollup_range_stats(view, start, end):
+    normal = view.totals(start, end)
+    kpi = (normal['售價'], normal['成本額'], normal['總利潤'])
+    return kpi, view.daily(start, end), view.by_product(start, end).nlargest(10, '售價')
+
+
+def bench_rollup(rows):
+    from datetime import date
+    from rollup import DailyRollup, RollupView
+    from special import SpecialMatcher, pending_special
+    matcher = SpecialMatcher(["補差價"])
+    classify = lambda df: pending_special(df, matcher)
+    df = make_typed_orders(rows, random.Random(0))
+    build_sec, rollup = timed(DailyRollup.build, df, classify)
+    view_sec, view = timed(RollupView, [rollup.table])
+    print(f"{rows} 筆訂單 → 彙總表 {len(rollup.table)} 列 (建立 {build_sec:.3f}s，累計陣列 {view_sec * 1000:.0f} ms)")
+    for start, end in ((date(2026, 3, 1), date(2026, 3, 1)), (date(2026, 3, 1), date(2026, 3, 31)), (date(2026, 1, 1), date(2026, 12, 31))):
+        legacy_sec, legacy = timed(legacy_range_stats, df, start, end, classify, repeat=3)
+        fast_sec, fast = timed(rollup_range_stats, view, start, end, repeat=3)
+        assert all(abs(a - b) < 1e-6 for a, b in zip(legacy[0], fast[0]))
+        report(f"{start} ~ {end}", [("逐筆篩選 + groupby", legacy_sec), ("每日彙總表", fast_sec)])
+    added = make_typed_orders(2000, random.Random(1))
+    apply_sec, _ = timed(rollup.apply, None, added, classify, repeat=3)
+    print(f"\n上傳 2000 筆的增量更新: {apply_sec * 1000:.0f} ms (重建整張彙總表 {build_sec * 1000:.0f} ms)")
+
+
+BENCHMARKS = {
+    'excel': (bench_excel, 50000),
+    'ids': (bench_ids, None),
+    'merge': (bench_merge, 200000),
+    'sku': (bench_sku, 10000),
+    'rollup': (bench_rollup, 200000),
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="shopee_bot 效能基準測試")
+    parser.add_argument('name', choices=sorted(BENCHMARKS) + ['all'])
+    parser.add_argument('--rows', type=int, default=None, help="資料列數 (預設依項目而定)")
+    args = parser.parse_args()
+    for name in (sorted(BENCHMARKS) if args.name == 'all' else [args.name]):
+        fn, default_rows = BENCHMARKS[name]
+        fn(args.rows or default_rows)
@@ -0,0 +1,95 @@
+# ==========================================
+# 資料集快取 (每個資料集各自的世代與 TTL)
+# ==========================================
+# 取代 st.cache_data.clear() 的「全部清空」：寫入端只作廢自己動到的資料集，
+# 其他資料集 (例如成本表) 的快取不受影響。
+import threading
+import time
+from collections import defaultdict
+
+
+class DatasetCache:
+    """
+    ttls: {資料集: 秒數 或 None(只在作廢時才重新載入)}
+    get(資料集, loader) 在世代未變且未逾時時回傳快取值，否則呼叫 loader() 重新載入。
+    同一資料集同時只會有一個 loader 在執行，其他呼叫者會等待並共用結果。
+    """
+
+    def __init__(self, ttls=None):
+        self.ttls = dict(ttls or {})
+        self._lock = threading.Lock()
+        self._load_locks = defaultdict(threading.Lock)
+        self._generations = defaultdict(int)
+        self._entries = {}   # 資料集 -> (世代, 載入時間, 值)
+        self._stats = defaultdict(lambda: {'loads': 0, 'hits': 0})
+
+    def generation(self, dataset):
+        with self._lock: return self._generations[dataset]
+
+    def invalidate(self, *datasets):
+        with self._lock:
+            for ds in datasets: self._generations[ds] += 1
+
+    def invalidate_all(self):
+        with self._lock:
+            for ds in set(self._generations) | set(self._entries): self._generations[ds] += 1
+
+    def _fresh_entry(self, dataset):
+        entry = self._entries.get(dataset)
+        if entry is None or entry[0] != self._generations[dataset]: return None
+        ttl = self.ttls.get(dataset)
+        if ttl is not None and time.time() - entry[1] > ttl: return None
+        return entry
+
+    def is_fresh(self, dataset):
+        with self._lock: return self._fresh_entry(dataset) is not None
+
+    def get(self, dataset, loader):
+        with self._lock:
+            entry = self._fresh_entry(dataset)
+            if entry is not None:
+                self._stats[dataset]['hits'] += 1
+                return entry[2]
+            load_lock = self._load_locks[dataset]
+        with load_lock:
+            with self._lock:
+                # 等待期間可能已由其他執行緒載入完成
+                entry = self._fresh_entry(dataset)
+                if entry is not None:
+                    self._stats[dataset]['hits'] += 1
+                    return entry[2]
+                gen = self._generations[dataset]
+            value = loader()
+            with self._lock:
+                # 載入期間若被作廢，仍回傳結果但標記為舊世代，下次會重新載入
+                self._entries[dataset] = (gen, time.time(), value)
+                self._stats[dataset]['loads'] += 1
+            return value
+
+    def peek(self, dataset):
+        """仍有效的快取值 (不會觸發載入)，沒有則回傳 None"""
+        with self._lock:
+            entry = self._fresh_entry(dataset)
+            return entry[2] if entry is not None else None
+
+    def put(self, dataset, value):
+        """以目前世代存入呼叫端自行算好的值 (例如寫入後增量更新的彙總表)"""
+        with self._lock: self._entries[dataset] = (self._generations[dataset], time.time(), value)
+
+    def prefetch(self, loaders, executor):
+        """
+        loaders: {資料集: 透過本快取取得該資料集的函式 (不可呼叫 st.*)}
+        在 executor 上平行載入尚未新鮮的資料集，回傳 {資料集: Future}。
+        之後照常呼叫 get() 即可：預載還在進行時會等待並共用同一份結果，不會重複下載；
+        預載失敗時 get() 會自行重新載入，錯誤由原本的呼叫端處理。
+        """
+        futures = {}
+        for ds, loader in loaders.items():
+            if self.is_fresh(ds): continue
+            futures[ds] = executor.submit(loader)
+        return futures
+
+    def stats(self, dataset=None):
+        with self._lock:
+            if dataset is not None: return dict(self._stats[dataset], generation=self._generations[dataset])
+            return {ds: dict(s, generation=self._generations[ds]) for ds, s in self._stats.items()}
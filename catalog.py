@@ -0,0 +1,68 @@
+# ==========================================
+# 蝦皮批次更新檔 (mass_update.xlsx) 讀取
+# ==========================================
+# 大型賣場的 mass_update 可能有數萬個規格。逐列讀取，每 chunk_rows 列組成一個 DataFrame 交給呼叫端，
+# 不必等整份檔案轉成 DataFrame 才開始比對/寫入。
+import io
+
+import numpy as np
+import pandas as pd
+
+from ids import clean_ids
+from sales_report import excel_engine
+
+MASS_UPDATE_HEADER_ROW = 2   # 第 3 列是欄名 (前兩列是蝦皮的說明)
+
+
+def _iter_sheet_rows(data):
+    """回傳 (總列數, 逐列產生 list 的 iterator)"""
+    if excel_engine() == 'calamine':
+        from python_calamine import CalamineWorkbook
+        sheet = CalamineWorkbook.from_filelike(io.BytesIO(data)).get_sheet_by_index(0)
+        return (sheet.start or (0, 0))[0] + sheet.height, (list(r) for r in sheet.iter_rows())
+    from openpyxl import load_workbook
+    ws = load_workbook(io.BytesIO(data), read_only=True, data_only=True).worksheets[0]
+    return ws.max_row, (list(r) for r in ws.iter_rows(values_only=True))
+
+
+MASS_UPDATE_COLUMNS = ['商品ID', '商品選項ID', '商品名稱', '商品規格名稱']
+
+
+def _cell(v):
+    """與 pd.read_excel 相同：空格為 NaN，整數值的浮點數轉成 int"""
+    if v is None or v == "": return np.nan
+    if isinstance(v, float) and v.is_integer(): return int(v)
+    return v
+
+
+def _mass_update_frame(columns, rows):
+    """columns = {欄名: 欄位位置}，只取需要的欄位"""
+    df = pd.DataFrame({c: [_cell(r[i]) if i < len(r) else np.nan for r in rows] for c, i in columns.items()}, dtype=object)
+    df = df.dropna(subset=['商品ID'])
+    key = clean_ids(df['商品ID']) + "_" + clean_ids(df['商品選項ID'])
+    full_name = df['商品名稱'].astype(str)
+    if '商品規格名稱' in df.columns: full_name = full_name + " [" + df['商品規格名稱'].astype(str) + "]"
+    return pd.DataFrame({'Full_Name': full_name, 'key': key})
+
+
+def iter_mass_update(data, chunk_rows=5000):
+    """
+    逐批產生 (DataFrame[Full_Name, key], 已讀列數, 總列數)。
+    key = 商品ID_商品選項ID (正規化後)，Full_Name = 商品名稱 [商品規格名稱]。
+    """
+    total, rows = _iter_sheet_rows(data)
+    for _ in range(MASS_UPDATE_HEADER_ROW): next(rows, None)
+    header = [str(h) if h is not None else "" for h in next(rows, [])]
+    for col in MASS_UPDATE_COLUMNS[:3]:
+        if col not in header: raise ValueError(f"找不到欄位『{col}』")
+    columns = {c: header.index(c) for c in MASS_UPDATE_COLUMNS if c in header}
+    done, batch = MASS_UPDATE_HEADER_ROW + 1, []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= chunk_rows:
+            done += len(batch)
+            yield _mass_update_frame(columns, batch), done, total
+            batch = []
+    if batch:
+        done += len(batch)
+        yield _mass_update_frame(columns, batch), done, total
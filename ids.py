@@ -0,0 +1,55 @@
+# ==========================================
+# 商品編碼 / 訂單編號正規化
+# ==========================================
+# Excel 讀進來的編碼可能是字串、整數、浮點數 ("1234567890.0")，或被轉成科學記號 ("1.23457E+11")。
+# clean_id 處理單一值；clean_ids 以整個 Series 為單位處理 (Arrow 字串運算，沒有 pyarrow 時用 pandas .str)，
+# 結果與逐格 clean_id 完全相同：
+#   空值 / 空字串 → ""，含 e 的數字字串 → 整數格式，最後去掉所有 ".0"
+# 表格欄位一律用 clean_ids，clean_id 只用在使用者輸入等單一值。
+import pandas as pd
+
+
+def clean_id(val):
+    if pd.isna(val) or val == "": return ""
+    s = str(val).strip()
+    if "e" in s.lower():
+        try: s = "{:.0f}".format(float(s))
+        except: pass
+    return s.replace(".0", "")
+
+
+def _expand_sci(s):
+    try: return "{:.0f}".format(float(s))
+    except (TypeError, ValueError): return s
+
+
+def _clean_ids_pandas(values):
+    empty = values.isna() | (values.astype(object) == "")
+    s = values.astype(str).str.strip()
+    sci = s.str.contains("e", case=False, regex=False) & ~empty
+    if sci.any(): s[sci] = [_expand_sci(v) for v in s[sci]]
+    s = s.str.replace(".0", "", regex=False)
+    s[empty] = ""
+    return s
+
+
+def clean_ids(values):
+    """Series (或 list) 中的編碼 → 正規化後的字串 Series (object dtype，index 不變)"""
+    values = values if isinstance(values, pd.Series) else pd.Series(list(values), dtype=object)
+    try:
+        import pyarrow as pa
+        import pyarrow.compute as pc
+    except ImportError:
+        return _clean_ids_pandas(values)
+    # 全部都是字串 (試算表讀回的資料) 時直接轉 Arrow；混有數字時先 str()，與 clean_id 相同
+    try: arr = pa.array(values.to_numpy(dtype=object), type=pa.string(), from_pandas=True)
+    except (pa.ArrowTypeError, pa.ArrowInvalid):
+        arr = pa.array(values.astype(str).where(values.notna(), None).to_numpy(dtype=object), type=pa.string(), from_pandas=True)
+    empty = pc.or_kleene(pc.is_null(arr), pc.equal(arr, "")).fill_null(True)
+    s = pc.utf8_trim_whitespace(arr)
+    # 含 e 的只佔少數 (多半是科學記號)，只把這些取出來逐格用 float() 轉換，保證與 clean_id 一致
+    sci = pc.and_(pc.match_substring_regex(s, "[eE]").fill_null(False), pc.invert(empty))
+    if pc.any(sci).as_py():
+        s = pc.replace_with_mask(s, sci, pa.array([_expand_sci(v) for v in pc.filter(s, sci).to_pylist()], type=pa.string()))
+    s = pc.if_else(empty, "", pc.replace_substring(s, ".0", ""))
+    return pd.Series(s.to_numpy(zero_copy_only=False), index=values.index, dtype=object)
@@ -0,0 +1,132 @@
+# ==========================================
+# 背景工作佇列 (訂單上傳分析)
+# ==========================================
+# 上傳分析不再佔住 Streamlit 的執行緒：按下按鈕只負責送出工作，
+# 工作在背景 worker 執行，關掉瀏覽器也不會中斷寫入。
+# 每個工作有自己的 ID，階段/進度/結果寫入 state_dir/<ID>.json，任何使用者都可以查詢。
+# worker 只有一個，同時上傳的報表會依序排隊，不會互相覆寫訂單總表。
+import json
+import os
+import threading
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+STATUS_QUEUED = "queued"
+STATUS_RUNNING = "running"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+STATUS_INTERRUPTED = "interrupted"
+
+ACTIVE_STATUSES = (STATUS_QUEUED, STATUS_RUNNING)
+
+
+def _now():
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+class JobReporter:
+    """
+    傳給工作函式的回報物件。
+    progress(value, text=...) 與 st.progress 物件同介面，可直接取代原本的 progress_bar；
+    log(level, text) 記錄要顯示給使用者的訊息，level 為 st 的函式名稱 (write / info / warning / error / success / text)。
+    """
+
+    def __init__(self, queue, job_id):
+        self.queue = queue
+        self.job_id = job_id
+
+    def progress(self, value, text=None):
+        self.queue._update(self.job_id, progress=int(value), stage=text or "")
+
+    def log(self, level, text):
+        self.queue._update(self.job_id, log=(level, str(text)))
+
+
+class JobQueue:
+    def __init__(self, state_dir="ingest_jobs", workers=1, keep=50):
+        self.state_dir = state_dir
+        self.keep = keep
+        os.makedirs(state_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._jobs = {}
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ingest")
+        self._restore()
+
+    # === 狀態保存 ===
+    def _path(self, job_id):
+        return os.path.join(self.state_dir, f"{job_id}.json")
+
+    def _save(self, job):
+        tmp = self._path(job['id']) + ".tmp"
+        with open(tmp, 'w', encoding='utf-8') as f: json.dump(job, f, ensure_ascii=False)
+        os.replace(tmp, self._path(job['id']))
+
+    def _restore(self):
+        """讀回先前的工作紀錄；程序重啟前還沒跑完的工作標記為中斷"""
+        for fn in os.listdir(self.state_dir):
+            if not fn.endswith(".json"): continue
+            try:
+                with open(os.path.join(self.state_dir, fn), encoding='utf-8') as f: job = json.load(f)
+            except (OSError, ValueError): continue
+            if job.get('status') in ACTIVE_STATUSES:
+                job['status'] = STATUS_INTERRUPTED
+                job['error'] = "伺服器重新啟動，工作未完成，請重新上傳"
+                job['finished_at'] = _now()
+                self._save(job)
+            self._jobs[job['id']] = job
+        self._prune()
+
+    def _prune(self):
+        finished = sorted((j for j in self._jobs.values() if j['status'] not in ACTIVE_STATUSES), key=lambda j: j['created_at'])
+        for job in finished[:max(0, len(self._jobs) - self.keep)]:
+            self._jobs.pop(job['id'], None)
+            try: os.remove(self._path(job['id']))
+            except OSError: pass
+
+    def _update(self, job_id, log=None, **fields):
+        with self._lock:
+            job = self._jobs[job_id]
+            job.update(fields)
+            if log is not None: job['logs'].append(list(log))
+            self._save(job)
+
+    # === 對外介面 ===
+    def submit(self, label, fn, *args, **kwargs):
+        """
+        送出工作，回傳工作 ID。fn(reporter, *args, **kwargs) 的回傳值 (字串) 即為結果。
+        """
+        job_id = datetime.now().strftime("%Y%m%d%H%M%S") + "-" + uuid.uuid4().hex[:6]
+        job = {'id': job_id, 'label': label, 'status': STATUS_QUEUED, 'stage': "排隊中...", 'progress': 0,
+               'result': None, 'error': None, 'logs': [], 'created_at': _now(), 'started_at': None, 'finished_at': None}
+        with self._lock:
+            self._jobs[job_id] = job
+            self._save(job)
+            self._prune()
+        self._executor.submit(self._run, job_id, fn, args, kwargs)
+        return job_id
+
+    def _run(self, job_id, fn, args, kwargs):
+        self._update(job_id, status=STATUS_RUNNING, started_at=_now())
+        try:
+            result = fn(JobReporter(self, job_id), *args, **kwargs)
+            self._update(job_id, status=STATUS_DONE, progress=100, result=result, finished_at=_now())
+        except Exception as e:
+            print(f"Ingest job {job_id} failed: {e}")
+            traceback.print_exc()
+            self._update(job_id, status=STATUS_FAILED, error=str(e), finished_at=_now())
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return json.loads(json.dumps(job)) if job else None
+
+    def recent(self, limit=5):
+        """最新的工作 (新的在前)"""
+        with self._lock:
+            jobs = sorted(self._jobs.values(), key=lambda j: j['id'], reverse=True)[:limit]
+            return json.loads(json.dumps(jobs))
+
+    def active_count(self):
+        with self._lock: return sum(1 for j in self._jobs.values() if j['status'] in ACTIVE_STATUSES)
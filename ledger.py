@@ -0,0 +1,81 @@
+# ==========================================
+# 上傳報表帳本 (以檔案內容 SHA-256 為 key)
+# ==========================================
+# 同一份 Order.all 常被重複上傳「確認一下」。帳本記錄每個檔案內容 (SHA-256) 何時匯入、結果為何，
+# 內容完全相同的檔案直接回報上次的結果，不再解密、解析、比對、寫入。
+# 另外保留最近 max_frames 份解析後的 DataFrame (pickle)，比對/寫入失敗後重跑時不必再解密一次。
+import hashlib
+import json
+import os
+import threading
+from datetime import datetime
+
+import pandas as pd
+
+
+def file_digest(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+class IngestLedger:
+    def __init__(self, directory="ingest_ledger", max_frames=20, max_entries=1000):
+        self.directory = directory
+        self.frames_dir = os.path.join(directory, "frames")
+        self.max_frames = max_frames
+        self.max_entries = max_entries
+        os.makedirs(self.frames_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._path = os.path.join(directory, "ledger.json")
+        self._entries = self._load()
+
+    # === 帳本 ===
+    def _load(self):
+        try:
+            with open(self._path, encoding='utf-8') as f: return json.load(f)
+        except (OSError, ValueError): return {}
+
+    def _save(self):
+        tmp = self._path + ".tmp"
+        with open(tmp, 'w', encoding='utf-8') as f: json.dump(self._entries, f, ensure_ascii=False)
+        os.replace(tmp, self._path)
+
+    def lookup(self, digest):
+        """先前成功匯入的紀錄 {'sha256', 'name', 'ingested_at', 'result', 'job_id'}，沒有則回傳 None"""
+        with self._lock:
+            entry = self._entries.get(digest)
+            return dict(entry) if entry else None
+
+    def record(self, digest, name, result, job_id=None):
+        with self._lock:
+            self._entries[digest] = {'sha256': digest, 'name': name, 'result': result, 'job_id': job_id,
+                                     'ingested_at': datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
+            if len(self._entries) > self.max_entries:
+                for old in sorted(self._entries, key=lambda d: self._entries[d]['ingested_at'])[:len(self._entries) - self.max_entries]:
+                    del self._entries[old]
+            self._save()
+
+    # === 解析結果快取 ===
+    def _frame_path(self, digest):
+        return os.path.join(self.frames_dir, f"{digest}.pkl")
+
+    def load_frame(self, digest):
+        path = self._frame_path(digest)
+        if not os.path.exists(path): return None
+        try:
+            df = pd.read_pickle(path)
+            os.utime(path)   # 最近使用的留久一點
+            return df
+        except Exception as e:
+            print(f"Cached report frame {digest[:12]} unreadable: {e}")
+            return None
+
+    def save_frame(self, digest, df):
+        path = self._frame_path(digest)
+        with self._lock:
+            df.to_pickle(path + ".tmp")
+            os.replace(path + ".tmp", path)
+            cached = sorted((os.path.join(self.frames_dir, fn) for fn in os.listdir(self.frames_dir) if fn.endswith(".pkl")),
+                            key=os.path.getmtime)
+            for old in cached[:max(0, len(cached) - self.max_frames)]:
+                try: os.remove(old)
+                except OSError: pass
@@ -0,0 +1,94 @@
+# ==========================================
+# 特殊訂單自動歸戶 (記憶庫 → 智能匹配)
+# ==========================================
+# 以整批 join 取代逐列查詢，優先順序與舊版逐列迴圈相同：
+#   1. 記憶庫 (名稱, 規格) 完全相符            → 已歸戶(記憶)
+#   2. 記憶庫 (名稱, "")                      → 已歸戶(記憶)
+#   3. 成本表名稱 == "名稱 [規格]"              → 已歸戶(智能)
+#   4. 標準化後 == 標準化 "名稱 [規格]"          → 已歸戶(智能(模糊))
+#   5. 成本表名稱 == "名稱"                    → 已歸戶(智能)
+#   6. 標準化後 == 標準化 "名稱"                → 已歸戶(智能(模糊))
+# (規格為空時跳過 3、4。) 成本表同名多筆時以最後一筆為準，與舊版 dict 覆寫相同。
+import numpy as np
+import pandas as pd
+
+
+NORMALIZE_REPLACEMENTS = ((" ", ""), ("　", ""), ("，", ","), ("（", "("), ("）", ")"), ("【", "["), ("】", "]"))
+_NORMALIZE_TABLE = str.maketrans({old: new for old, new in NORMALIZE_REPLACEMENTS})
+
+
+def normalize_name(name):
+    """名稱標準化 (模糊比對用)：去頭尾空白、轉小寫、移除所有空白 (含全形空白)、全形標點轉半形"""
+    return str(name).strip().lower().translate(_NORMALIZE_TABLE)
+
+
+def normalize_names(names):
+    """normalize_name 的向量化版本"""
+    s = names.astype(str).str.strip().str.lower()
+    for old, new in NORMALIZE_REPLACEMENTS: s = s.str.replace(old, new, regex=False)
+    return s
+
+
+def cost_name_tables(df_cost):
+    """
+    成本表 → (精確表, 標準化表)：
+      精確表   index = 商品名稱 (去頭尾空白)，欄位 cost
+      標準化表 index = 標準化名稱，欄位 cost, sku (原始名稱)
+    """
+    if df_cost is None or df_cost.empty or '商品名稱' not in df_cost.columns or '成本' not in df_cost.columns:
+        empty = pd.DataFrame({'cost': pd.Series(dtype=float), 'sku': pd.Series(dtype=object)})
+        return empty[['cost']], empty
+    names = df_cost['商品名稱'].astype(str).str.strip()
+    table = pd.DataFrame({'sku': names.to_numpy(), 'cost': df_cost['成本'].astype(float).to_numpy()})
+    exact = table.drop_duplicates('sku', keep='last').set_index('sku')[['cost']]
+    table['norm'] = normalize_names(table['sku'])
+    normalized = table.drop_duplicates('norm', keep='last').set_index('norm')[['cost', 'sku']]
+    return exact, normalized
+
+
+def memory_rule_table(memory_rules):
+    """{(名稱, 規格): {'sku', 'cost'}} → index 為 (名稱, 規格) 的 DataFrame[cost, sku]"""
+    if not memory_rules:
+        return pd.DataFrame({'cost': pd.Series(dtype=float), 'sku': pd.Series(dtype=object)},
+                            index=pd.MultiIndex.from_tuples([], names=['name', 'option']))
+    keys = list(memory_rules)
+    return pd.DataFrame({'cost': [float(memory_rules[k]['cost']) for k in keys], 'sku': [memory_rules[k]['sku'] for k in keys]},
+                        index=pd.MultiIndex.from_tuples(keys, names=['name', 'option']))
+
+
+def _lookup(keys, table, sku=None):
+    """keys (Series) 在 table 中的 (是否找到, cost, sku)；sku=None 時以 table 的 sku 欄為準"""
+    hit = np.asarray(keys.isin(table.index))
+    found = table.reindex(keys)
+    return hit, found['cost'].to_numpy(), (found['sku'].to_numpy() if sku is None else sku.to_numpy())
+
+
+def smart_match(names, options, memory_rules, df_cost):
+    """
+    names / options 為特殊訂單的 商品名稱 / 商品選項名稱 (同一個 index)。
+    回傳 DataFrame[cost, sku, source] (index 不變)，source 為 記憶 / 智能 / 智能(模糊)，找不到的列 source 為 None。
+    """
+    name = names.astype(str).str.strip()
+    opt = options.astype(str).str.strip()
+    result = pd.DataFrame({'cost': np.nan, 'sku': None, 'source': None}, index=names.index)
+    if result.empty: return result
+    exact, normalized = cost_name_tables(df_cost)
+    rules = memory_rule_table(memory_rules)
+
+    always, with_opt = np.ones(len(name), dtype=bool), (opt != "").to_numpy()
+    full = name + " [" + opt + "]"
+    steps = [
+        (always, _lookup(pd.MultiIndex.from_arrays([name, opt]), rules), "記憶"),
+        (always, _lookup(pd.MultiIndex.from_arrays([name, pd.Series("", index=name.index)]), rules), "記憶"),
+        (with_opt, _lookup(full, exact, sku=full), "智能"),
+        (with_opt, _lookup(normalize_names(full), normalized), "智能(模糊)"),
+        (always, _lookup(name, exact, sku=name), "智能"),
+        (always, _lookup(normalize_names(name), normalized), "智能(模糊)"),
+    ]
+    todo = np.ones(len(name), dtype=bool)
+    cost, sku, source = result['cost'].to_numpy(copy=True), result['sku'].to_numpy(copy=True), result['source'].to_numpy(copy=True)
+    for applicable, (hit, step_cost, step_sku), label in steps:
+        take = todo & applicable & hit
+        cost[take], sku[take], source[take] = step_cost[take], step_sku[take], label
+        todo &= ~take
+    return pd.DataFrame({'cost': cost, 'sku': sku, 'source': source}, index=names.index)
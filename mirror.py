@@ -0,0 +1,150 @@
+# ==========================================
+# 訂單本機鏡像 (Parquet)
+# ==========================================
+# 前台只需要「有型別」的訂單資料 (金額為數字、日期為 datetime)。
+# 每個訂單資料集 (未分片的訂單總表或各月分片) 在本機存一份 Parquet + 中繼資料 JSON：
+#   - 第一次 (或每 full_resync_seconds 秒) 整份下載
+#   - 之後只讀 訂單編號 / 資料備份時間 兩欄，找出
+#       a) 資料備份時間 晚於高水位 (減去 lookback_seconds 緩衝) 的列
+#       b) 超過上次列數的新列
+#     再只下載這些列
+# OrderDB 寫入時會把有變動的列的 資料備份時間 設為寫入時間，因此本程式的寫入都能被增量同步抓到；
+# 直接在試算表上手動修改而不改 資料備份時間 的列，要等下一次整份同步才會反映。
+import json
+import os
+import re
+import threading
+import time
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+NUMERIC_COLUMNS = ['售價', '成本', '總利潤', '進蝦皮錢包', '數量']
+DATE_COLUMN = "訂單成立日期"
+STAMP_COLUMN = "資料備份時間"
+ROW_COLUMN = "_row"
+STAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+STAMP_RE = re.compile(r'^\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}$')
+
+
+def to_typed(df):
+    """字串欄位的訂單 DataFrame → 金額轉數字、訂單成立日期 轉 datetime (原地修改並回傳)"""
+    for c in NUMERIC_COLUMNS:
+        if c in df.columns: df[c] = pd.to_numeric(df[c].astype(str).str.replace(',', ''), errors='coerce').fillna(0)
+    if DATE_COLUMN in df.columns: df[DATE_COLUMN] = pd.to_datetime(df[DATE_COLUMN], errors='coerce')
+    return df
+
+
+def _typed_rows(header, rows, row_numbers):
+    width = len(header)
+    rows = [(list(r) + [""] * width)[:width] for r in rows]
+    df = to_typed(pd.DataFrame(rows, columns=header))
+    df[ROW_COLUMN] = list(row_numbers)
+    return df
+
+
+def _header(row):
+    row = [str(h) for h in row]
+    while row and row[-1] == "": row.pop()
+    return row
+
+
+def _max_stamp(stamps, current=""):
+    valid = [s for s in stamps if STAMP_RE.match(s)]
+    return max(valid + [current or ""])
+
+
+class OrderMirror:
+    def __init__(self, storage, directory="order_mirror", lookback_seconds=3600, full_resync_seconds=86400):
+        self.storage = storage
+        self.directory = directory
+        self.lookback_seconds = lookback_seconds
+        self.full_resync_seconds = full_resync_seconds
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self.last_sync = {}   # 資料集 -> {'mode', 'pulled', 'rows'}
+
+    # === 本機檔案 ===
+    def _paths(self, dataset):
+        safe = dataset.replace("@", "_")
+        return os.path.join(self.directory, f"{safe}.parquet"), os.path.join(self.directory, f"{safe}.json")
+
+    def _load_local(self, dataset):
+        data_path, meta_path = self._paths(dataset)
+        if not (os.path.exists(data_path) and os.path.exists(meta_path)): return None, None
+        try:
+            with open(meta_path, encoding='utf-8') as f: meta = json.load(f)
+            return pd.read_parquet(data_path), meta
+        except Exception as e:
+            print(f"Order mirror for {dataset} unreadable, resyncing: {e}")
+            return None, None
+
+    def _save(self, dataset, df, meta):
+        data_path, meta_path = self._paths(dataset)
+        df.to_parquet(data_path + ".tmp", index=False)
+        os.replace(data_path + ".tmp", data_path)
+        with open(meta_path + ".tmp", 'w', encoding='utf-8') as f: json.dump(meta, f, ensure_ascii=False)
+        os.replace(meta_path + ".tmp", meta_path)
+
+    def drop(self, dataset=None):
+        """刪除本機鏡像 (下次 sync 會整份下載)"""
+        with self._lock:
+            for fn in os.listdir(self.directory):
+                if dataset is None or fn.startswith(dataset.replace("@", "_") + "."):
+                    os.remove(os.path.join(self.directory, fn))
+
+    # === 同步 ===
+    def sync(self, dataset):
+        """回傳同步後的有型別 DataFrame (含 _row = 試算表列號)"""
+        with self._lock:
+            df, meta = self._load_local(dataset)
+            if df is None or time.time() - meta.get('full_at', 0) > self.full_resync_seconds:
+                return self._full(dataset)
+            return self._incremental(dataset, df, meta)
+
+    def _full(self, dataset):
+        values = self.storage.get_values(dataset)
+        header = _header(values[0]) if values else []
+        df = _typed_rows(header, values[1:], range(2, len(values) + 1))
+        stamps = [r[header.index(STAMP_COLUMN)] if STAMP_COLUMN in header and header.index(STAMP_COLUMN) < len(r) else "" for r in values[1:]]
+        meta = {'header': header, 'row_count': len(values), 'hwm': _max_stamp(stamps), 'full_at': time.time()}
+        self._save(dataset, df, meta)
+        self.last_sync[dataset] = {'mode': 'full', 'pulled': max(0, len(values) - 1), 'rows': len(df)}
+        return df
+
+    def _incremental(self, dataset, df, meta):
+        header = meta['header']
+        if STAMP_COLUMN not in header: return self._full(dataset)
+        stamp_col = header.index(STAMP_COLUMN) + 1
+        head, ids, stamps = self.storage.get_ranges(dataset, [(1, 1, 1, len(header) + 1), (1, 1, None, 1), (1, stamp_col, None, 1)])
+        row_count = max(len(ids), len(stamps))
+        # 表頭改變或有列被刪除：列號不再可靠，整份重抓
+        if not head or _header(head[0]) != header or row_count < meta['row_count']: return self._full(dataset)
+
+        stamps = [r[0] if r else "" for r in stamps[1:]]
+        cutoff = ""
+        if meta['hwm']:
+            cutoff = (datetime.strptime(meta['hwm'], STAMP_FORMAT) - timedelta(seconds=self.lookback_seconds)).strftime(STAMP_FORMAT)
+        changed = {i + 2 for i, s in enumerate(stamps[:meta['row_count'] - 1]) if STAMP_RE.match(s) and s > cutoff}
+        pulled = sorted(changed | set(range(meta['row_count'] + 1, row_count + 1)))
+
+        if pulled:
+            ranges = []
+            for n in pulled:
+                if ranges and ranges[-1][0] + ranges[-1][2] == n: ranges[-1][2] += 1
+                else: ranges.append([n, 1, 1, len(header)])
+            blocks = self.storage.get_ranges(dataset, [tuple(r) for r in ranges])
+            rows, numbers = [], []
+            for (start, _, count, _), block in zip(ranges, blocks):
+                block = list(block) + [[]] * (count - len(block))
+                rows += block; numbers += range(start, start + count)
+            fresh = _typed_rows(header, rows, numbers)
+            df = pd.concat([df[~df[ROW_COLUMN].isin(numbers)], fresh], ignore_index=True).sort_values(ROW_COLUMN, ignore_index=True)
+
+        meta = dict(meta, row_count=row_count, hwm=_max_stamp(stamps, meta['hwm']))
+        if pulled: self._save(dataset, df, meta)
+        else:
+            _, meta_path = self._paths(dataset)
+            with open(meta_path, 'w', encoding='utf-8') as f: json.dump(meta, f, ensure_ascii=False)
+        self.last_sync[dataset] = {'mode': 'incremental', 'pulled': len(pulled), 'rows': len(df)}
+        return df
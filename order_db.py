@@ -0,0 +1,487 @@
+# ==========================================
+# 訂單總表 (蝦皮訂單總表) 共用快照 / 月分片
+# ==========================================
+# 訂單可以存成兩種格式：
+#   未分片：全部訂單在同一個資料集 (DATASET_ORDERS)，即原本的訂單總表
+#   月分片：每個月一個資料集 (orders@YYYY-MM)，另有一張小索引 (DATASET_ORDER_SHARDS)
+#           記錄每個分片的日期範圍與列數。讀取時只下載與查詢日期區間重疊的分片。
+# 索引中有任何分片即視為已分片；migrate_to_shards() 負責由舊格式轉換 (舊表保留不動)。
+import random
+import re
+
+import pandas as pd
+
+from mirror import ROW_COLUMN, STAMP_COLUMN, STAMP_FORMAT, to_typed
+from rollup import DailyRollup, RollupView
+from storage import (DATASET_ORDERS, DATASET_ORDER_SHARDS, DATASET_HEADERS, group_cell_ranges, shard_dataset, to_cell,
+                     verify_ranges)
+
+DATE_COLUMN = "訂單成立日期"
+DATE_COLUMN_INDEX = 1     # 標準欄位順序中 訂單成立日期 的位置 (手動新增的訂單列依此判斷月份)
+UNDATED = "undated"       # 日期無法辨識的訂單放在這個分片，每次查詢都會讀取
+TYPED_SUFFIX = ":typed"   # 有型別 (鏡像) 版本在資料集快取中的 key 後綴
+ROLLUP_SUFFIX = ":rollup" # 每日彙總表在資料集快取中的 key 後綴
+IDS_SUFFIX = ":ids"       # 訂單編號集合在資料集快取中的 key 後綴
+ID_COLUMN = "訂單編號"
+
+
+def month_of(date_str):
+    """'2026-01-05 10:00' / '2026/1/5' → '2026-01'；無法辨識則回傳 UNDATED"""
+    m = re.match(r'\s*(\d{4})[-/.](\d{1,2})', str(date_str))
+    if not m or not 1 <= int(m.group(2)) <= 12: return UNDATED
+    return f"{m.group(1)}-{int(m.group(2)):02d}"
+
+
+def _realign(rows, from_header, to_header):
+    """依欄位名稱把 rows 從 from_header 的欄位順序轉成 to_header 的順序"""
+    if list(from_header) == list(to_header): return [list(r) for r in rows]
+    pos = {h: i for i, h in enumerate(from_header)}
+    out = []
+    for r in rows:
+        out.append([r[pos[h]] if h in pos and pos[h] < len(r) else "" for h in to_header])
+    return out
+
+
+class OrderSnapshot:
+    """
+    某個日期區間的訂單快照。
+    values   : [表頭, 列...]，表頭為各分片表頭的聯集
+    segments : [(資料集, 列數)]，values 的資料列依序來自這些資料集
+    raw      : {資料集: 該資料集原始 values}，寫回時用來比對差異
+    """
+
+    def __init__(self, values, segments, raw):
+        self.values = values
+        self.segments = segments
+        self.raw = raw
+
+    def labels(self):
+        """每一資料列的位置標籤 "資料集#列號" (DataFrame 的 index)"""
+        out = []
+        for ds, count in self.segments: out += [f"{ds}#{i}" for i in range(2, count + 2)]
+        return out
+
+
+class OrderDB:
+    """
+    整個程序共用的訂單資料存取點，版本即資料集快取中 DATASET_ORDERS 的世代。
+    透過本物件寫入時會自動遞增版本並作廢受影響的分片；讀取端只有在版本改變時才重新下載。
+    """
+
+    def __init__(self, storage, cache, clock=None, mirror=None, classify=None):
+        self.storage = storage
+        self.cache = cache
+        self.clock = clock     # 回傳目前時間 (寫入 資料備份時間 / 索引更新時間用)
+        self.mirror = mirror   # OrderMirror (本機 Parquet 鏡像)，None = 不使用
+        self.classify = classify   # 有型別訂單 DataFrame → 「特殊且未歸戶」bool Series；None = 不維護每日彙總表
+        self._view = (None, None)  # (各資料集彙總表世代, RollupView)
+
+    @property
+    def version(self):
+        return self.cache.generation(DATASET_ORDERS)
+
+    def bump(self, *datasets):
+        """標記快照已過期 (寫入後或手動刷新時呼叫)"""
+        keys = [DATASET_ORDERS, *datasets]
+        self.cache.invalidate(DATASET_ORDER_SHARDS, *keys, *[k + suffix for k in keys for suffix in (TYPED_SUFFIX, ROLLUP_SUFFIX, IDS_SUFFIX)])
+
+    # === 分片索引 ===
+    def manifest(self):
+        """[{'month', 'dataset', 'start', 'end', 'rows', 'updated'}]，未分片時為空"""
+        data = self.cache.get(DATASET_ORDER_SHARDS, lambda: self.storage.get_values(DATASET_ORDER_SHARDS))
+        shards = []
+        for row in data[1:]:
+            if not row or not row[0]: continue
+            row = list(row) + [""] * 4
+            try: rows = int(row[3] or 0)
+            except ValueError: rows = 0
+            shards.append({'month': row[0], 'dataset': shard_dataset(row[0]), 'start': row[1], 'end': row[2], 'rows': rows, 'updated': row[4]})
+        return shards
+
+    def is_sharded(self):
+        return bool(self.manifest())
+
+    def datasets_for(self, start=None, end=None):
+        """與 start ~ end (date，含) 重疊的資料集；未給日期則為全部"""
+        shards = self.manifest()
+        if not shards: return [DATASET_ORDERS]
+        lo = start.isoformat() if start else None
+        hi = end.isoformat() if end else None
+        out = []
+        for s in shards:
+            if s['month'] == UNDATED or not s['start'] or not s['end']: out.append(s['dataset']); continue
+            if lo and s['end'] < lo: continue
+            if hi and s['start'] > hi: continue
+            out.append(s['dataset'])
+        return out
+
+    def date_bounds(self):
+        """(最早, 最晚) 訂單日期字串 (YYYY-MM-DD)；未分片時需讀取整張訂單總表 (有本機鏡像時從鏡像計算)"""
+        shards = [s for s in self.manifest() if s['month'] != UNDATED and s['start']]
+        if shards: return min(s['start'] for s in shards), max(s['end'] for s in shards)
+        if self.mirror is not None and not self.is_sharded():
+            dates = self.typed_frame().get(DATE_COLUMN, pd.Series(dtype='datetime64[ns]')).dropna()
+            if dates.empty: return None, None
+            return dates.min().strftime("%Y-%m-%d"), dates.max().strftime("%Y-%m-%d")
+        values = self._dataset_values(DATASET_ORDERS)
+        return _date_range(values)
+
+    # === 讀取 ===
+    def _dataset_values(self, dataset):
+        return self.cache.get(dataset, lambda: self.storage.get_values(dataset))
+
+    def order_ids(self, ds):
+        """ds 中所有 訂單編號 (去空白) 的 frozenset；整份資料已在快取時直接取用，否則只讀取表頭與 訂單編號 一欄"""
+        def load():
+            data = self.cache.peek(ds)
+            if data is not None: head, rows = (data[0] if data else []), data[1:]
+            else:
+                # 訂單編號 通常是第一欄：表頭與第一欄一次讀取，不是時再補讀該欄
+                head, rows = self.storage.get_ranges(ds, [(1, 1, 1, None), (2, 1, None, 1)])
+                head = head[0] if head else []
+            head = [str(h).strip() for h in head]
+            if ID_COLUMN not in head: return frozenset()
+            col = head.index(ID_COLUMN)
+            if data is None and col:
+                rows, col = self.storage.get_ranges(ds, [(2, col + 1, None, 1)])[0], 0
+            return frozenset(v for v in (str(r[col]).strip() for r in rows if col < len(r)) if v)
+        return self.cache.get(ds + IDS_SUFFIX, load)
+
+    def datasets_containing(self, ids, exclude=()):
+        """含有 ids 中任一訂單編號的分片 (exclude 以外)；未分片時為空"""
+        if not self.is_sharded(): return []
+        ids = set(ids)
+        return [ds for ds in self.datasets_for() if ds not in exclude and not ids.isdisjoint(self.order_ids(ds))]
+
+    def snapshot(self, start=None, end=None, ids=None):
+        """
+        start ~ end 所在資料集的快照；給 ids 時，範圍外含有這些訂單編號的分片也一併載入
+        (上傳比對用：訂單日期被更正、或重新上傳很久以前的報表時，既有訂單仍能找到並寫回原本的分片)。
+        """
+        raw, segments, header = {}, [], []
+        datasets = self.datasets_for(start, end)
+        if ids is not None: datasets += self.datasets_containing(ids, exclude=datasets)
+        for ds in datasets:
+            data = self._dataset_values(ds)
+            raw[ds] = data
+            if not data: continue
+            for h in data[0]:
+                if h not in header: header.append(h)
+        if not header: return OrderSnapshot([], [], raw)
+        values = [header]
+        for ds, data in raw.items():
+            if not data: continue
+            values += _realign(data[1:], data[0], header)
+            segments.append((ds, len(data) - 1))
+        return OrderSnapshot(values, segments, raw)
+
+    def values(self, start=None, end=None):
+        """回傳 start ~ end 所在分片的 values (含表頭)。未分片時即整張訂單總表 (共用資料，呼叫端請勿修改)。"""
+        if not self.is_sharded(): return self._dataset_values(DATASET_ORDERS)
+        return self.snapshot(start, end).values
+
+    def frame(self, start=None, end=None):
+        """
+        以 start ~ end 所在分片建立新的 DataFrame (字串欄位)，呼叫端可自由修改。
+        index 為 "資料集#列號"，供 update_cells 定位回寫。
+        分片以月為單位，回傳的資料可能超出 start ~ end，呼叫端仍需自行篩選日期。
+        """
+        snap = self.snapshot(start, end)
+        if not snap.values: return pd.DataFrame()
+        return pd.DataFrame(snap.values[1:], columns=snap.values[0], index=snap.labels())
+
+    def typed_frame(self, start=None, end=None):
+        """
+        同 frame()，但金額欄為數字、訂單成立日期 為 datetime (唯讀用途，例如前台統計)。
+        有本機鏡像時從鏡像讀取，每次只向試算表增量下載有變動的列。
+        """
+        if self.mirror is None: return to_typed(self.frame(start, end))
+        frames = []
+        for ds in self.datasets_for(start, end):
+            df = self.cache.get(ds + TYPED_SUFFIX, lambda ds=ds: self.mirror.sync(ds))
+            if df.empty: continue
+            df = df.copy()
+            df.index = (ds + "#" + df[ROW_COLUMN].astype(str)).to_numpy()
+            frames.append(df.drop(columns=[ROW_COLUMN]))
+        if not frames: return pd.DataFrame()
+        return pd.concat(frames) if len(frames) > 1 else frames[0]
+
+    def _typed_dataset(self, ds):
+        if self.mirror is not None: return self.cache.get(ds + TYPED_SUFFIX, lambda: self.mirror.sync(ds))
+        data = self._dataset_values(ds)
+        if not data: return pd.DataFrame()
+        width = len(data[0])
+        return to_typed(pd.DataFrame([(list(r) + [""] * width)[:width] for r in data[1:]], columns=data[0]))
+
+    # === 每日彙總表 ===
+    def rollup(self, start=None, end=None):
+        """start ~ end 所在資料集的 RollupView (各資料集彙總表都沒變時沿用上一次的結果)"""
+        if self.classify is None: return None
+        datasets = self.datasets_for(start, end)
+        tables = [self.cache.get(ds + ROLLUP_SUFFIX, lambda ds=ds: DailyRollup.build(self._typed_dataset(ds), self.classify)).table
+                  for ds in datasets]
+        key = tuple((ds, self.cache.generation(ds + ROLLUP_SUFFIX)) for ds in datasets)
+        cached_key, view = self._view
+        if cached_key != key:
+            view = RollupView(tables)
+            self._view = (key, view)
+        return view
+
+    def _rollup_delta(self, ds, old, header, changes):
+        """
+        寫入前先算好 ds 更新後的彙總表：old 為寫入前的 values，changes = {列號: 寫入後的整列 (header 順序)}。
+        快取中沒有有效的彙總表時回傳 None (之後讀取時重建)。
+        """
+        prev = self.cache.peek(ds + ROLLUP_SUFFIX) if self.classify is not None else None
+        if prev is None or not changes: return None
+        rows = sorted(r for r in changes if r > 1)
+        before = _realign([old[r - 1] for r in rows if r - 1 < len(old)], old[0], header) if old else []
+        def typed(rs): return to_typed(pd.DataFrame([(list(r) + [""] * len(header))[:len(header)] for r in rs], columns=header)) if rs else None
+        try: return prev.apply(typed(before), typed([changes[r] for r in rows]), self.classify)
+        except Exception as e:
+            print(f"Rollup update for {ds} failed, will rebuild: {e}")
+            return None
+
+    def _now(self):
+        return self.clock().strftime(STAMP_FORMAT) if self.clock else ""
+
+    # === 寫入 (完成後遞增版本) ===
+    def write_snapshot(self, snap, new_values):
+        """
+        差異寫回：new_values 的前段資料列與 snap.values 逐列對應 (只更新、不刪除、不重排)，
+        多出來的列為新訂單，依 訂單成立日期 放進所屬的月分片 (未分片時接在訂單總表後面)。
+        回傳 {'changed', 'new', 'unchanged', 'written': {資料集: 寫入的區塊}} (written 供 verify_write 使用)
+        """
+        header = [to_cell(h) for h in new_values[0]]
+        rows = new_values[1:]
+        sharded = self.is_sharded()
+        if not snap.values and not sharded:
+            self.replace_values(new_values)
+            written = [(1, 1, [[to_cell(v) for v in row] for row in new_values])]
+            return {'changed': 0, 'new': len(rows), 'unchanged': 0, 'written': {DATASET_ORDERS: written}}
+
+        # 既有列依來源資料集切回去，新列依月份分配
+        per_ds, pos = {}, 0
+        for ds, count in snap.segments:
+            per_ds[ds] = list(rows[pos:pos + count]); pos += count
+        date_idx = header.index(DATE_COLUMN) if DATE_COLUMN in header else DATE_COLUMN_INDEX
+        for row in rows[pos:]:
+            ds = shard_dataset(month_of(row[date_idx] if date_idx < len(row) else "")) if sharded else DATASET_ORDERS
+            per_ds.setdefault(ds, []).append(row)
+
+        # 內容有變的既有列，資料備份時間 一律更新為寫入時間 (本機鏡像依此增量同步)
+        stamp_idx = header.index(STAMP_COLUMN) if STAMP_COLUMN in header and self.clock else None
+        if stamp_idx is not None:
+            now = self._now()
+            for ds, ds_rows in per_ds.items():
+                old = snap.raw.get(ds)
+                if not old: continue
+                old_rows = _realign(old[1:], old[0], header)
+                for i, row in enumerate(ds_rows[:len(old_rows)]):
+                    if [to_cell(v) for v in row] != [to_cell(v) for v in old_rows[i]]:
+                        row = list(row); row[stamp_idx] = now; ds_rows[i] = row
+
+        total = {'changed': 0, 'new': 0, 'unchanged': 0}
+        written, ranges, rollups = {}, {}, {}
+        try:
+            for ds, ds_rows in per_ds.items():
+                if ds in snap.raw: old = snap.raw[ds]
+                else: old = self._dataset_values(ds)   # 查詢範圍外的分片 (例如新訂單屬於其他月份)
+                if old and ds not in snap.raw:
+                    # 未載入的分片：保留原有列，新列接在後面
+                    new = [header] + _realign(old[1:], old[0], header) + ds_rows
+                else:
+                    new = [header] + ds_rows
+                res = self.storage.write_delta(ds, old, new)
+                if not old: res = dict(res, new=len(ds_rows))   # 新分片整份寫入，不計表頭
+                for k in total: total[k] += res[k]
+                written[ds] = new
+                ranges[ds] = res['written']
+                # 只有寫入的列會影響彙總表
+                touched = {r: new[r - 1] for start, _, block in res['written'] for r in range(start, start + len(block))}
+                rollups[ds] = self._rollup_delta(ds, old, new[0], touched)
+        finally:
+            self.bump(*per_ds)
+        for ds, rollup in rollups.items():
+            if rollup is not None: self.cache.put(ds + ROLLUP_SUFFIX, rollup)
+        if sharded: self._update_manifest(written)
+        return dict(total, written=ranges)
+
+    def verify_write(self, written, sample=None):
+        """
+        讀回 write_snapshot 剛寫入的區塊並比對 (每個資料集一次部分讀取，不重新下載整張表)。
+        sample = 總共抽查的區塊數 (None = 全部)。回傳 {'ranges', 'rows', 'mismatches': [(資料集, 起始列, 列數, [不符的列號])]}
+        """
+        items = [(ds, r) for ds, rs in written.items() for r in rs]
+        if sample is not None and len(items) > sample: items = random.sample(items, sample)
+        report = {'ranges': 0, 'rows': 0, 'mismatches': []}
+        for ds in written:
+            picked = [r for d, r in items if d == ds]
+            if not picked: continue
+            res = verify_ranges(self.storage, ds, sorted(picked, key=lambda r: r[0]))
+            report['ranges'] += res['ranges']; report['rows'] += res['rows']
+            report['mismatches'] += [(ds, *m) for m in res['mismatches']]
+        return report
+
+    def replace_values(self, values):
+        """整份覆寫 (僅用於訂單總表為空的初始化)；已分片時依月份寫入各分片"""
+        if self.is_sharded():
+            return self.write_snapshot(OrderSnapshot([], [], {}), values)
+        try: self.storage.replace_values(DATASET_ORDERS, values)
+        finally: self.bump()
+
+    def append_rows(self, rows):
+        """附加訂單列 (欄位順序同訂單總表)；已分片時依月份放進所屬分片"""
+        if not rows: return
+        if not self.is_sharded():
+            try: self.storage.append_rows(DATASET_ORDERS, rows)
+            finally: self.bump()
+            return
+        per_ds = {}
+        for row in rows:
+            date = row[DATE_COLUMN_INDEX] if len(row) > DATE_COLUMN_INDEX else ""
+            per_ds.setdefault(shard_dataset(month_of(date)), []).append(row)
+        written = {}
+        try:
+            for ds, ds_rows in per_ds.items():
+                old = self._dataset_values(ds)
+                if old: self.storage.append_rows(ds, ds_rows)
+                else: self.storage.replace_values(ds, [self._canonical_header()] + ds_rows)
+                written[ds] = (old or [self._canonical_header()]) + [[to_cell(v) for v in r] for r in ds_rows]
+        finally:
+            self.bump(*per_ds)
+        self._update_manifest(written)
+
+    def update_cells(self, cells):
+        """
+        cells = [(index 標籤 "資料集#列號", 欄位名稱, 值), ...]，依資料集分組，各用一次 update_ranges 寫回。
+        分片缺少的欄位會自動加在表頭最後。
+        """
+        per_ds = {}
+        now = self._now()
+        for label, column, value in cells:
+            ds, row_no = str(label).rsplit("#", 1)
+            per_ds.setdefault(ds, []).append((int(row_no), column, value))
+        if now:
+            # 被修改的列同時更新 資料備份時間 (本機鏡像依此增量同步)
+            for ds, items in per_ds.items():
+                items += [(r, STAMP_COLUMN, now) for r in sorted({r for r, _, _ in items})]
+        rollups = {}
+        try:
+            for ds, items in per_ds.items():
+                old = self._dataset_values(ds)
+                header = list(old[0])
+                updates = []
+                for row_no, column, value in items:
+                    if column not in header:
+                        header.append(column)
+                        updates.append((1, len(header), column))
+                    updates.append((row_no, header.index(column) + 1, value))
+                self.storage.update_ranges(ds, group_cell_ranges(updates))
+                changed = {r: _realign([old[r - 1]], old[0], header)[0] for r, _, _ in items if r - 1 < len(old)}
+                for row_no, column, value in items:
+                    if row_no in changed: changed[row_no][header.index(column)] = to_cell(value)
+                rollups[ds] = self._rollup_delta(ds, old, header, changed)
+        finally:
+            self.bump(*per_ds)
+        for ds, rollup in rollups.items():
+            if rollup is not None: self.cache.put(ds + ROLLUP_SUFFIX, rollup)
+
+    # === 分片索引維護 ===
+    def _canonical_header(self):
+        for s in self.manifest():
+            data = self._dataset_values(s['dataset'])
+            if data: return list(data[0])
+        data = self._dataset_values(DATASET_ORDERS)
+        return list(data[0]) if data else []
+
+    def _update_manifest(self, written):
+        """written = {資料集: 寫入後的 values}，更新這些分片在索引中的日期範圍與列數"""
+        shards = {s['dataset']: s for s in self.manifest()}
+        now = self.clock().strftime("%Y-%m-%d %H:%M:%S") if self.clock else ""
+        for ds, values in written.items():
+            start, end = _date_range(values)
+            shards[ds] = {'month': ds.split("@", 1)[1], 'dataset': ds, 'start': start or "", 'end': end or "",
+                          'rows': max(0, len(values) - 1), 'updated': now}
+        rows = [[s['month'], s['start'], s['end'], s['rows'], s['updated']] for s in sorted(shards.values(), key=lambda s: s['month'])]
+        try: self.storage.replace_values(DATASET_ORDER_SHARDS, [DATASET_HEADERS[DATASET_ORDER_SHARDS]] + rows)
+        finally: self.cache.invalidate(DATASET_ORDER_SHARDS)
+
+    def migrate_to_shards(self):
+        """
+        將未分片的訂單總表依月份拆成分片並建立索引，回傳 {月份: 列數}。
+        原本的訂單總表保留不動 (可作為備份)；已分片時不做任何事。
+        """
+        if self.is_sharded(): return {}
+        data = self.storage.get_values(DATASET_ORDERS)
+        if len(data) <= 1: return {}
+        header = data[0]
+        date_idx = header.index(DATE_COLUMN) if DATE_COLUMN in header else DATE_COLUMN_INDEX
+        per_ds = {}
+        for row in data[1:]:
+            per_ds.setdefault(shard_dataset(month_of(row[date_idx] if date_idx < len(row) else "")), []).append(row)
+        written = {}
+        try:
+            for ds, rows in sorted(per_ds.items()):
+                self.storage.replace_values(ds, [header] + rows)
+                written[ds] = [header] + rows
+        finally:
+            self.bump(*per_ds)
+        self._update_manifest(written)
+        return {ds.split("@", 1)[1]: len(values) - 1 for ds, values in written.items()}
+
+    def stats(self):
+        s = self.cache.stats(DATASET_ORDERS)
+        shards = self.manifest()
+        if shards:
+            # 分片模式：下載/共用次數為各分片加總
+            per = [self.cache.stats(x['dataset']) for x in shards]
+            s = {'generation': s['generation'], 'loads': sum(p['loads'] for p in per), 'hits': sum(p['hits'] for p in per)}
+        return {'version': s['generation'], 'fetches': s['loads'], 'hits': s['hits'], 'shards': len(shards)}
+
+
+def _date_range(values):
+    """values 中 訂單成立日期 的 (最早, 最晚)，格式 YYYY-MM-DD；沒有有效日期則為 (None, None)"""
+    if len(values) <= 1: return None, None
+    header = values[0]
+    idx = header.index(DATE_COLUMN) if DATE_COLUMN in header else DATE_COLUMN_INDEX
+    dates = pd.to_datetime(pd.Series([r[idx] if idx < len(r) else "" for r in values[1:]]), errors='coerce').dropna()
+    if dates.empty: return None, None
+    return dates.min().strftime("%Y-%m-%d"), dates.max().strftime("%Y-%m-%d")
+
+
+CONSOLIDATED_MARK = "已歸戶"
+SYNC_FIELDS = ['訂單成立日期', '訂單狀態', '商品名稱', '買家備註']   # 已歸戶訂單仍同步這些欄位
+
+
+def merge_upload(df_existing, df_upload):
+    """
+    把上傳的訂單併入既有訂單 (兩者的 訂單編號 都已是去空白字串，df_existing 已含 df_upload 的所有欄位)：
+      - 已存在且備註含「已歸戶」 → 保留，只同步 SYNC_FIELDS
+      - 已存在但未歸戶           → 整列以上傳資料取代 (上傳沒有的欄位清空)
+      - 不存在                  → 新增
+    同一訂單編號在上傳中出現多次時，同步/取代以最後一列為準，新增則每一列都加入；
+    既有訂單編號重複時只對第一列動作。判斷一律依上傳前的備註。
+    以 訂單編號 為 key 整批對齊，不逐列搜尋。df_existing 會被就地修改。
+    回傳 dict(protected, updated, new)：三類上傳列 (DataFrame，依上傳順序)
+    """
+    ids = df_existing['訂單編號']
+    first = ~ids.duplicated()
+    position = pd.Series(first.to_numpy().nonzero()[0], index=ids[first].to_numpy())   # 訂單編號 → 既有列位置
+    consolidated = df_existing['備註'].astype(str).str.contains(CONSOLIDATED_MARK, regex=False).to_numpy()
+
+    target = df_upload['訂單編號'].map(position)
+    exists = target.notna()
+    protect = exists.copy()
+    protect[exists] = consolidated[target[exists].astype(int).to_numpy()]
+    update = exists & ~protect
+
+    fields = [f for f in SYNC_FIELDS if f in df_existing.columns and f in df_upload.columns]
+    synced = df_upload[protect].drop_duplicates('訂單編號', keep='last')
+    if fields and not synced.empty:
+        df_existing.iloc[target[synced.index].astype(int).to_numpy(), [df_existing.columns.get_loc(f) for f in fields]] = \
+            synced[fields].astype(str).to_numpy()
+    replaced = df_upload[update].drop_duplicates('訂單編號', keep='last')
+    if not replaced.empty:
+        df_existing.iloc[target[replaced.index].astype(int).to_numpy()] = replaced.reindex(columns=df_existing.columns).to_numpy()
+    return {'protected': df_upload[protect], 'updated': df_upload[update], 'new': df_upload[~exists]}
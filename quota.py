@@ -0,0 +1,169 @@
+# ==========================================
+# Google Sheets 配額排程 (Token Bucket + 重試)
+# ==========================================
+# Sheets API 的讀、寫各有每分鐘配額 (預設每位使用者 60 次/分)。
+# 所有讀寫都經過 RequestScheduler：
+#   - 讀、寫各一個 token bucket，容量 = 每分鐘配額
+#   - 429 / 5xx / 連線錯誤以指數退避 + 隨機抖動重試
+#   - 同時排隊時，讀取優先於寫入 (畫面先出來，寫入晚一點沒關係)
+import itertools
+import random
+import threading
+import time
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+
+def error_status(exc):
+    """取出 API 錯誤的 HTTP 狀態碼 (gspread APIError / 測試用假錯誤)，沒有則回傳 None"""
+    code = getattr(exc, 'code', None)
+    if isinstance(code, int): return code
+    response = getattr(exc, 'response', None)
+    status = getattr(response, 'status_code', None)
+    return status if isinstance(status, int) else None
+
+
+def is_retryable(exc):
+    if error_status(exc) in RETRYABLE_STATUS: return True
+    if isinstance(exc, (ConnectionError, TimeoutError)): return True
+    try:
+        import requests
+        return isinstance(exc, (requests.exceptions.ConnectionError, requests.exceptions.Timeout))
+    except ImportError:
+        return False
+
+
+class TokenBucket:
+    def __init__(self, per_minute, clock=time.monotonic):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.tokens = float(per_minute)
+        self.clock = clock
+        self._last = clock()
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def available(self):
+        self._refill()
+        return self.tokens >= 1
+
+    def take(self):
+        self.tokens -= 1
+
+    def wait_time(self):
+        """距離下一個 token 可用的秒數"""
+        self._refill()
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+
+class RequestScheduler:
+    """
+    call(kind, fn, *args) 會等到取得對應配額後才執行 fn，失敗時視情況重試。
+    kind: "read" 或 "write"
+    """
+    PRIORITY = {'read': 0, 'write': 1}
+
+    def __init__(self, read_per_minute=60, write_per_minute=60, max_retries=5,
+                 base_delay=1.0, max_delay=32.0, sleep=time.sleep, clock=time.monotonic, rng=random.random):
+        self.buckets = {'read': TokenBucket(read_per_minute, clock), 'write': TokenBucket(write_per_minute, clock)}
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.sleep = sleep
+        self.rng = rng
+        self._cond = threading.Condition()
+        self._waiting = []            # [(優先序, 序號, kind)]
+        self._seq = itertools.count()
+        self._stats = {'read': 0, 'write': 0, 'retries': 0, 'throttled': 0, 'failed': 0}
+
+    def _next_eligible(self):
+        """排隊中第一個「配額足夠」的請求 (讀取排在寫入前面)"""
+        for ticket in sorted(self._waiting):
+            if self.buckets[ticket[2]].available(): return ticket
+        return None
+
+    def _acquire(self, kind):
+        ticket = (self.PRIORITY[kind], next(self._seq), kind)
+        with self._cond:
+            self._waiting.append(ticket)
+            waited = False
+            try:
+                while self._next_eligible() != ticket:
+                    waited = True
+                    timeout = min(self.buckets[k].wait_time() for _, _, k in self._waiting) or 0.05
+                    self._cond.wait(timeout=timeout)
+                self.buckets[kind].take()
+            finally:
+                self._waiting.remove(ticket)
+                if waited: self._stats['throttled'] += 1
+                self._cond.notify_all()
+
+    def backoff(self, attempt):
+        """第 attempt 次重試前等待的秒數：min(base * 2^n, max) 再加上隨機抖動"""
+        return min(self.base_delay * (2 ** attempt), self.max_delay) + self.rng() * self.base_delay
+
+    def call(self, kind, fn, *args, **kwargs):
+        attempt = 0
+        while True:
+            self._acquire(kind)
+            with self._cond: self._stats[kind] += 1
+            try:
+                return fn(*args, **kwargs)
+            except Exception as e:
+                if not is_retryable(e) or attempt >= self.max_retries:
+                    with self._cond: self._stats['failed'] += 1
+                    raise
+                with self._cond: self._stats['retries'] += 1
+                self.sleep(self.backoff(attempt))
+                attempt += 1
+
+    def read(self, fn, *args, **kwargs):
+        return self.call('read', fn, *args, **kwargs)
+
+    def write(self, fn, *args, **kwargs):
+        return self.call('write', fn, *args, **kwargs)
+
+    def stats(self):
+        with self._cond: return dict(self._stats)
+
+
+# ==========================================
+# 離線測試用：會被限流的假後端
+# ==========================================
+class SimulatedAPIError(Exception):
+    """模擬 gspread APIError (帶 HTTP 狀態碼)"""
+
+    def __init__(self, code, message=""):
+        super().__init__(message or f"HTTP {code}")
+        self.code = code
+
+
+class ThrottlingStorage:
+    """
+    包裝任一 storage，依 fail_pattern 對呼叫注入錯誤，用來驗證排程器的重試行為。
+    fail_pattern: 狀態碼序列 (0 = 成功)，依呼叫順序循環使用，例如 [429, 429, 0]。
+    """
+
+    def __init__(self, inner, fail_pattern=(429, 0)):
+        self.inner = inner
+        self.name = f"throttled-{getattr(inner, 'name', 'storage')}"
+        self._pattern = itertools.cycle(fail_pattern)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.injected = 0
+
+    def __getattr__(self, attr):
+        target = getattr(self.inner, attr)
+        if not callable(target): return target
+
+        def wrapped(*args, **kwargs):
+            with self._lock:
+                self.calls += 1
+                code = next(self._pattern)
+                if code: self.injected += 1
+            if code: raise SimulatedAPIError(code)
+            return target(*args, **kwargs)
+        return wrapped
@@ -0,0 +1,100 @@
+# ==========================================
+# 每日彙總表 (前台 KPI / 趨勢 / 排行)
+# ==========================================
+# 每個訂單資料集維護一張 (日期, 商品名稱, 特殊) → Σ售價、Σ成本×數量、Σ總利潤、Σ數量、筆數 的彙總表，
+# 「特殊」= 特殊商品且尚未歸戶 (不計入毛利)。
+# 上傳與歸戶寫入時只把變動列的舊值扣掉、新值加上 (DailyRollup.apply)，不必重新掃過所有訂單。
+# RollupView 把查詢範圍內各分片的彙總表合併後建立每日累計陣列：
+#   KPI 卡片 = 兩個累計值相減 (與日期範圍長短無關)，每日趨勢與商品排行只走訪範圍內的 (日期, 商品) 列。
+import numpy as np
+import pandas as pd
+
+ROLLUP_KEYS = ['日期', '商品名稱', '特殊']
+ROLLUP_SUMS = ['售價', '成本額', '總利潤', '數量', '筆數']
+
+
+def _empty():
+    return pd.DataFrame({'日期': pd.Series(dtype='datetime64[ns]'), '商品名稱': pd.Series(dtype=object),
+                         '特殊': pd.Series(dtype=bool), **{c: pd.Series(dtype=float) for c in ROLLUP_SUMS}})
+
+
+def rollup_rows(df, classify):
+    """
+    有型別的訂單列 (to_typed 之後) → 依 (日期, 商品名稱, 特殊) 加總的 DataFrame。
+    classify(df) 回傳「特殊且未歸戶」的 bool Series；日期無法辨識的列不計 (前台同樣濾除)。
+    """
+    if df is None or df.empty or '訂單成立日期' not in df.columns: return _empty()
+    zero = pd.Series(0.0, index=df.index)
+    num = {c: pd.to_numeric(df[c], errors='coerce').fillna(0) if c in df.columns else zero for c in ['售價', '成本', '總利潤', '數量']}
+    out = pd.DataFrame({
+        '日期': pd.to_datetime(df['訂單成立日期'], errors='coerce').dt.normalize(),
+        '商品名稱': df['商品名稱'].astype(str) if '商品名稱' in df.columns else "",
+        '特殊': np.asarray(classify(df), dtype=bool),
+        '售價': num['售價'], '成本額': num['成本'] * num['數量'], '總利潤': num['總利潤'], '數量': num['數量'], '筆數': 1.0,
+    })
+    out = out.dropna(subset=['日期'])
+    if out.empty: return _empty()
+    return out.groupby(ROLLUP_KEYS, as_index=False, sort=False)[ROLLUP_SUMS].sum()
+
+
+class DailyRollup:
+    """單一訂單資料集的彙總表 (不可變：apply 回傳新的物件，快取中的舊物件不受影響)"""
+
+    def __init__(self, table):
+        self.table = table
+
+    @classmethod
+    def build(cls, df, classify):
+        return cls(rollup_rows(df, classify))
+
+    def apply(self, removed, added, classify):
+        """removed / added 為寫入前後的變動列 (有型別)，扣掉舊值、加上新值"""
+        old = rollup_rows(removed, classify)
+        old[ROLLUP_SUMS] = -old[ROLLUP_SUMS]
+        parts = [t for t in (self.table, old, rollup_rows(added, classify)) if not t.empty]
+        if not parts: return DailyRollup(_empty())
+        table = pd.concat(parts, ignore_index=True).groupby(ROLLUP_KEYS, as_index=False, sort=False)[ROLLUP_SUMS].sum()
+        return DailyRollup(table[table['筆數'] != 0].reset_index(drop=True))
+
+
+class RollupView:
+    """多個資料集的彙總表合併後的查詢介面 (日期參數為 date，含頭尾)"""
+
+    def __init__(self, tables):
+        tables = [t for t in tables if not t.empty]
+        table = pd.concat(tables, ignore_index=True).groupby(ROLLUP_KEYS, as_index=False)[ROLLUP_SUMS].sum() if tables else _empty()
+        self.table = table.sort_values('日期', kind='stable').reset_index(drop=True)
+        self.days = np.sort(self.table['日期'].unique())
+        # 每日加總 (特殊/一般分開)，第 0 列補 0 後累加：區間和 = cum[hi] - cum[lo]
+        self._daily = {}
+        self._cum = {}
+        for flag in (False, True):
+            daily = self.table[self.table['特殊'] == flag].groupby('日期')[ROLLUP_SUMS].sum().reindex(self.days, fill_value=0)
+            self._daily[flag] = daily.to_numpy(dtype=float)
+            self._cum[flag] = np.vstack([np.zeros((1, len(ROLLUP_SUMS))), np.cumsum(self._daily[flag], axis=0)])
+
+    def _span(self, start, end):
+        lo = np.searchsorted(self.days, np.datetime64(pd.Timestamp(start)), side='left')
+        hi = np.searchsorted(self.days, np.datetime64(pd.Timestamp(end)), side='right')
+        return lo, max(lo, hi)
+
+    def totals(self, start, end, special=False):
+        """區間加總 pd.Series (index 為 ROLLUP_SUMS)"""
+        lo, hi = self._span(start, end)
+        return pd.Series(self._cum[special][hi] - self._cum[special][lo], index=ROLLUP_SUMS)
+
+    def daily(self, start, end):
+        """每日 (特殊+一般) 的 DataFrame[日期 (YYYY-MM-DD), 售價, 總利潤, ...]，只列出有訂單的日期"""
+        lo, hi = self._span(start, end)
+        daily = pd.DataFrame(self._daily[False][lo:hi] + self._daily[True][lo:hi], columns=ROLLUP_SUMS)
+        daily.insert(0, '日期', pd.DatetimeIndex(self.days[lo:hi]).strftime('%Y-%m-%d'))
+        return daily[daily['筆數'] > 0].reset_index(drop=True)
+
+    def by_product(self, start, end, special=None):
+        """區間內各商品的加總 DataFrame[商品名稱, 售價, 總利潤, 數量, ...]；special=None 為特殊+一般"""
+        dates = self.table['日期'].to_numpy()
+        lo = np.searchsorted(dates, np.datetime64(pd.Timestamp(start)), side='left')
+        hi = np.searchsorted(dates, np.datetime64(pd.Timestamp(end)), side='right')
+        rows = self.table.iloc[lo:hi]
+        if special is not None: rows = rows[rows['特殊'] == special]
+        return rows.groupby('商品名稱', as_index=False)[ROLLUP_SUMS].sum()
@@ -0,0 +1,109 @@
+# ==========================================
+# 蝦皮訂單報表讀取 (Order.all.*.xlsx)
+# ==========================================
+# 以檔頭判斷格式，不再「先用 openpyxl 試讀、失敗才解密」：
+#   D0 CF 11 E0 ... : OLE 容器 (加了密碼的 xlsx，或舊版 xls) → 確認加密後只解密一次
+#   PK 03 04        : 一般 xlsx
+# 解析優先使用 calamine (Rust)，沒有安裝時才退回 openpyxl；
+# 去除重複列後只保留 process_orders 會用到的欄位。
+# 一次上傳多份報表時，各檔案在 process pool 中平行解密/解析，再合併成一份交給 process_orders。
+import io
+from concurrent.futures.process import BrokenProcessPool
+
+import msoffcrypto
+import pandas as pd
+
+OLE_MAGIC = b"\xD0\xCF\x11\xE0\xA1\xB1\x1A\xE1"
+
+# 報表欄名 → 訂單總表欄名 (其餘規則見 report_column_name)
+REPORT_COLUMN_ALIASES = {'蝦皮商品編碼 (商品ID_規格ID)': '蝦皮商品編碼', '商品總價': '售價', '訂單小計 (撥款金額)': '進蝦皮錢包', '買家支付運費': '運費'}
+
+# process_orders 需要的欄位 (對應後的名稱)；成本、總利潤、備註等由程式計算，不從報表讀取
+REPORT_COLUMNS = {'訂單編號', '訂單狀態', '訂單成立日期', '商品名稱', '商品選項名稱', '數量', '售價', '成交手續費', '金流與系統處理費',
+                  '其他服務費', '蝦皮付費總金額', '進蝦皮錢包', '蝦皮商品編碼', '買家備註', '運費'}
+
+
+def normalize_column(col):
+    return str(col).strip().replace('\n', '')
+
+
+def report_column_name(col):
+    """報表欄名 (已 normalize) → 訂單總表欄名"""
+    name = REPORT_COLUMN_ALIASES.get(col, col)
+    if "撥款金額" in col or "進蝦皮錢包" in col or "進帳" in col: name = "進蝦皮錢包"
+    if "商品編碼" in col and "規格" in col: name = "蝦皮商品編碼"
+    if "規格名稱" in col: name = "商品選項名稱"
+    if "買家" in col and "備註" in col: name = "買家備註"
+    return name
+
+
+def excel_engine():
+    try:
+        import python_calamine  # noqa: F401
+        return 'calamine'
+    except ImportError:
+        return 'openpyxl'
+
+
+def decrypt_report(data, password):
+    """回傳可直接解析的檔案內容；只有 OLE 容器且確實有加密時才解密"""
+    if not data.startswith(OLE_MAGIC): return data
+    office_file = msoffcrypto.OfficeFile(io.BytesIO(data))
+    if not office_file.is_encrypted(): return data   # 未加密的舊版 xls
+    decrypted = io.BytesIO()
+    office_file.load_key(password=password)
+    office_file.decrypt(decrypted)
+    return decrypted.getvalue()
+
+
+def read_report(data, password=None, columns=REPORT_COLUMNS):
+    """
+    讀取蝦皮訂單報表 (bytes)，回傳欄名已對應成訂單總表名稱、已去除重複列的 DataFrame。
+    columns = 要保留的欄位 (對應後名稱)，None = 全部。
+    重複列以報表的完整欄位判斷後才取出 columns：同一訂單的不同品項可能只在未保留的欄位 (例如商品貨號) 不同，
+    先取欄位再去重複會把它們併成一列，少算數量與售價。
+    """
+    data = decrypt_report(data, password)
+    df = pd.read_excel(io.BytesIO(data), engine=excel_engine())
+    df.columns = [report_column_name(normalize_column(c)) for c in df.columns]
+    df = df.drop_duplicates()
+    if columns is not None: df = df[[c for c in df.columns if c in columns]]
+    return df
+
+
+# ==========================================
+# 多份報表 (補上傳多天的 Order.all)
+# ==========================================
+def _read_one(args):
+    """給 process pool 用：回傳 (DataFrame, None) 或 (None, 錯誤訊息)"""
+    data, password = args
+    try: return read_report(data, password), None
+    except Exception as e: return None, str(e)
+
+
+def read_reports(contents, password=None, executor=None, on_warning=None):
+    """
+    contents = [bytes, ...]，回傳對應的 [(DataFrame 或 None, 錯誤訊息 或 None), ...]。
+    有 executor (ProcessPoolExecutor) 且不只一個檔案時平行解密/解析；pool 壞掉時改在目前的程序依序處理 (並以 on_warning 通知)。
+    """
+    jobs = [(data, password) for data in contents]
+    if executor is None or len(jobs) <= 1: return [_read_one(j) for j in jobs]
+    try: return list(executor.map(_read_one, jobs))
+    except BrokenProcessPool:
+        if on_warning: on_warning("⚠️ 平行解析報表的子程序異常，改為逐一解析 (速度較慢，結果不受影響)")
+        return [_read_one(j) for j in jobs]
+
+
+def merge_reports(frames):
+    """
+    依時間先後排列的多份報表合併成一份。
+    同一張訂單 (訂單編號) 出現在多份報表時，只保留最後一份裡的列 (較新的報表有最新的狀態與金額)。
+    """
+    if len(frames) == 1: return frames[0]
+    seen, kept = set(), []
+    for df in reversed(frames):
+        if '訂單編號' not in df.columns: kept.append(df); continue
+        ids = df['訂單編號'].astype(str).str.strip()
+        kept.append(df[~ids.isin(seen)])
+        seen.update(ids)
+    return pd.concat(kept[::-1], ignore_index=True)
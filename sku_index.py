@@ -0,0 +1,68 @@
+# ==========================================
+# 真實商品模糊搜尋 (字元 n-gram 索引)
+# ==========================================
+# 特殊訂單 (7777 / 客製化 / 補差價...) 的蝦皮商品名稱與成本表的真實商品名稱通常只有部分相同，
+# 標準化後的完全比對抓不到。這裡把成本表每個 商品名稱 (標準化後) 拆成字元 bigram 建倒排索引，
+# 查詢時以 IDF 加權的 cosine 相似度排序，回傳前 k 個候選與分數 (0~1)。
+# 查詢字串由 商品名稱、商品選項名稱、買家備註 組成 (買家備註權重較低)。
+import math
+from collections import defaultdict
+
+import numpy as np
+
+from matching import normalize_name
+
+QUERY_FIELD_WEIGHTS = (1.0, 1.0, 0.5)   # 商品名稱, 商品選項名稱, 買家備註
+
+
+def char_ngrams(text, n=2):
+    """標準化後字串的字元 n-gram 集合；比 n 短的字串整個當作一個 gram"""
+    if len(text) <= n: return {text} if text else set()
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+
+class SkuIndex:
+    """
+    names  : 成本表的 商品名稱
+    labels : 搜尋結果要回傳的值 (例如 Menu_Label)，預設同 names
+    """
+
+    def __init__(self, names, labels=None, n=2):
+        names = list(names)
+        self.labels = list(labels) if labels is not None else names
+        self.n = n
+        postings = defaultdict(list)
+        for i, name in enumerate(names):
+            for g in char_ngrams(normalize_name(name), n): postings[g].append(i)
+        size = max(len(names), 1)
+        self._postings = {g: np.asarray(ids, dtype=np.int32) for g, ids in postings.items()}
+        self._idf = {g: math.log(1 + size / len(ids)) for g, ids in postings.items()}
+        self._max_idf = math.log(1 + size)
+        norms = np.zeros(len(names))
+        for g, ids in self._postings.items(): norms[ids] += self._idf[g] ** 2
+        self._norms = np.sqrt(norms)
+        self._norms[self._norms == 0] = 1.0
+
+    def __len__(self):
+        return len(self.labels)
+
+    def search(self, name, option="", note="", k=5):
+        """回傳 [(label, 分數), ...]，分數高到低，最多 k 個 (分數為 0 的不列出)"""
+        weights = {}
+        for field, (text, w) in enumerate(zip((name, option, note), QUERY_FIELD_WEIGHTS)):
+            if text is None or (isinstance(text, float) and math.isnan(text)): continue
+            for g in char_ngrams(normalize_name(text), self.n):
+                idf = self._idf.get(g)
+                # 買家備註常有無關的字，索引中沒有的 gram 不列入；名稱/規格沒有的 gram 以最高 IDF 計 (降低分數)
+                if idf is None and field == 2: continue
+                weights[g] = max(weights.get(g, 0.0), w * (idf if idf is not None else self._max_idf))
+        known = [g for g in weights if g in self._postings]
+        if not known or not self.labels: return []
+        ids = np.concatenate([self._postings[g] for g in known])
+        vals = np.repeat([weights[g] * self._idf[g] for g in known], [len(self._postings[g]) for g in known])
+        q_norm = math.sqrt(sum(w * w for w in weights.values()))
+        scores = np.bincount(ids, weights=vals, minlength=len(self.labels)) / self._norms / q_norm
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind='stable')]
+        return [(self.labels[i], round(float(scores[i]), 3)) for i in top if scores[i] > 0]
@@ -0,0 +1,62 @@
+# ==========================================
+# 特殊商品判斷 (信用卡專區 / 補差價 / 客製化...)
+# ==========================================
+# 商品名稱包含任一關鍵字即為特殊商品 (大小寫有別，與 `sp in 名稱` 相同)。
+# 所有關鍵字編成一個 regex，以 str.contains 一次比對整欄；
+# 判斷結果依商品名稱記住，同一個名稱 (不論出現在哪個版本的訂單總表) 只比對一次。
+import hashlib
+import re
+import threading
+
+import pandas as pd
+
+PENDING_NOTE = "待人工確認"
+CONSOLIDATED_MARK = "已歸戶"
+
+
+class SpecialMatcher:
+    def __init__(self, keywords):
+        self.keywords = tuple(keywords)
+        self.fingerprint = hashlib.sha1("\n".join(self.keywords).encode('utf-8')).hexdigest()[:12]
+        # 長的關鍵字放前面，避免被較短的前綴搶先匹配 (結果相同，只是比較快結束)
+        ordered = sorted(set(self.keywords), key=len, reverse=True)
+        self.pattern = re.compile("|".join(re.escape(k) for k in ordered)) if ordered else None
+        self._memo = {}   # 商品名稱 → 是否為特殊商品
+        self._lock = threading.Lock()
+
+    def __contains__(self, name):
+        return bool(self.pattern and self.pattern.search(str(name)))
+
+    def mask(self, names):
+        """商品名稱 Series → bool Series (index 不變)"""
+        names = names.astype(str)
+        if self.pattern is None: return pd.Series(False, index=names.index)
+        with self._lock:
+            unseen = [n for n in pd.unique(names) if n not in self._memo]
+            if unseen:
+                self._memo.update(zip(unseen, pd.Series(unseen, dtype=object).str.contains(self.pattern, regex=True)))
+            memo = self._memo
+            return names.map(memo).astype(bool)
+
+
+def pending_special(df, matcher):
+    """特殊商品且尚未歸戶的列 (不計入毛利)；df 需有 商品名稱，備註 可有可無"""
+    special = matcher.mask(df['商品名稱'])
+    if '備註' not in df.columns: return special
+    return special & ~df['備註'].astype(str).str.contains(CONSOLIDATED_MARK, regex=False)
+
+
+def plan_reclassification(df, matcher):
+    """
+    df 為 order_db.frame() (index 為 "資料集#列號")。回傳 (要標記為待確認的 index, 要解除待確認的 index)：
+      - 名稱符合關鍵字、尚未歸戶、備註不是「待人工確認」的列 → 標記
+      - 名稱已不符合、備註仍是「待人工確認」的列 → 解除 (總利潤改回 進蝦皮錢包 - 成本)
+    """
+    if df.empty or '商品名稱' not in df.columns: return [], []
+    note = df['備註'].astype(str) if '備註' in df.columns else pd.Series("", index=df.index)
+    special = matcher.mask(df['商品名稱'])
+    consolidated = note.str.contains(CONSOLIDATED_MARK, regex=False)
+    pending = note == PENDING_NOTE
+    mark = df.index[special & ~consolidated & ~pending].tolist()
+    unmark = df.index[~special & pending].tolist()
+    return mark, unmark
@@ -0,0 +1,511 @@
+# ==========================================
+# 儲存層 (Storage Backend)
+# ==========================================
+# app.py 所有的表格讀寫都透過這裡的介面，資料一律以「試算表列」表示：
+#   values = [[表頭...], [第2列...], ...]   (字串, 列號從 1 開始，第 1 列為表頭)
+# 目前提供三種實作：
+#   SheetsStorage : Google Sheets (gspread)
+#   LocalStorage  : 本機 SQLite 檔案 (快速、可離線)
+#   MemoryStorage : 記憶體假資料庫 (離線測試用)
+import json
+import random
+import sqlite3
+import threading
+
+# === 資料集代號 ===
+DATASET_COST = "cost"            # 商品編碼表
+DATASET_ORDERS = "orders"        # 蝦皮訂單總表
+DATASET_MEMORY = "memory"        # 歸戶記憶庫
+DATASET_AD_COST = "ad_cost"      # 廣告費用紀錄
+DATASET_LEGACY = "legacy_cost"   # 蝦皮成本比對表2026 (舊表)
+DATASET_ORDER_SHARDS = "order_shards"   # 訂單月分片索引
+
+ALL_DATASETS = [DATASET_COST, DATASET_ORDERS, DATASET_MEMORY, DATASET_AD_COST, DATASET_LEGACY, DATASET_ORDER_SHARDS]
+
+# 不存在時會自動建立的資料集與其表頭
+DATASET_HEADERS = {
+    DATASET_MEMORY: ["蝦皮商品名稱", "蝦皮規格名稱", "真實SKU名稱", "真實成本"],
+    DATASET_AD_COST: ["日期", "廣告費用", "登錄時間"],
+    DATASET_ORDER_SHARDS: ["分片", "起始日期", "結束日期", "列數", "更新時間"],
+}
+
+
+# === 訂單月分片 ===
+# 每個月份是一個資料集 "orders@YYYY-MM"，在 Google Sheets 上是訂單總表中名為 YYYY-MM 的分頁
+def shard_dataset(month):
+    return f"{DATASET_ORDERS}@{month}"
+
+
+def shard_month(dataset):
+    """orders@YYYY-MM → YYYY-MM；不是分片則回傳 None"""
+    prefix = DATASET_ORDERS + "@"
+    return dataset[len(prefix):] if dataset.startswith(prefix) else None
+
+
+def dataset_location(locations, dataset):
+    """資料集 → (試算表名稱, 分頁名稱)；分片放在訂單總表同一個試算表中"""
+    month = shard_month(dataset)
+    if month is not None: return locations[DATASET_ORDERS][0], month
+    return locations[dataset]
+
+
+def to_cell(val):
+    """將 Python 值轉成與 Google Sheets 讀回時一致的字串"""
+    if val is None: return ""
+    if isinstance(val, float) and val.is_integer(): return str(int(val))
+    return str(val)
+
+
+def apply_range(values, row, col, block):
+    """將 block (二維) 寫入 values 的 (row, col) 位置 (皆從 1 開始)，必要時自動補列/補欄"""
+    for r_off, block_row in enumerate(block):
+        r = row - 1 + r_off
+        while len(values) <= r: values.append([])
+        target = values[r]
+        end = col - 1 + len(block_row)
+        if len(target) < end: target.extend([""] * (end - len(target)))
+        for c_off, v in enumerate(block_row):
+            target[col - 1 + c_off] = to_cell(v)
+    return values
+
+
+def _trim(row):
+    row = [to_cell(v) for v in row]
+    while row and row[-1] == "": row.pop()
+    return row
+
+
+def plan_row_delta(old_values, new_values):
+    """
+    比對寫入前 (old_values) 與寫入後 (new_values) 的整張表，只找出需要寫的部分。
+    new_values 的前 len(old_values) 列必須與舊表逐列對應 (只更新、不刪除、不重排)。
+    回傳:
+      changed   : [(列號, row), ...]  內容有變的既有列 (含表頭)
+      new       : [row, ...]          需附加在表尾的新列
+      unchanged : 未變動的列數
+    """
+    changed = []
+    unchanged = 0
+    for i, row in enumerate(new_values[:len(old_values)]):
+        if _trim(row) != _trim(old_values[i]): changed.append((i + 1, [to_cell(v) for v in row]))
+        else: unchanged += 1
+    new_rows = [[to_cell(v) for v in row] for row in new_values[len(old_values):]]
+    return {'changed': changed, 'new': new_rows, 'unchanged': unchanged}
+
+
+def slice_range(values, row, col, n_rows=None, n_cols=None):
+    """從 values 取出 (row, col) 起 n_rows × n_cols 的區塊 (None = 到底)，與 Sheets 讀回一樣去掉尾端空白"""
+    end_row = len(values) if n_rows is None else min(len(values), row - 1 + n_rows)
+    block = []
+    for r in values[row - 1:end_row]:
+        cells = r[col - 1:] if n_cols is None else r[col - 1:col - 1 + n_cols]
+        block.append(_trim(cells))
+    while block and not block[-1]: block.pop()
+    return block
+
+
+def group_row_ranges(changed):
+    """將 [(列號, row)] 中連續的列合併成 update_ranges 用的區塊"""
+    updates = []
+    for row_no, row in changed:
+        if updates and updates[-1][0] + len(updates[-1][2]) == row_no:
+            updates[-1][2].append(row)
+        else:
+            updates.append((row_no, 1, [row]))
+    return updates
+
+
+def group_cell_ranges(cells):
+    """將 [(列, 欄, 值)] 中同一列、左右相鄰的儲存格合併成 update_ranges 用的區塊"""
+    updates = []
+    for row, col, val in sorted(cells, key=lambda c: (c[0], c[1])):
+        if updates and updates[-1][0] == row and updates[-1][1] + len(updates[-1][2][0]) == col:
+            updates[-1][2][0].append(val)
+        else:
+            updates.append((row, col, [[val]]))
+    return updates
+
+
+def verify_ranges(storage, dataset, written, sample=None, rng=random):
+    """
+    寫入後抽查：written = write_delta 回傳的 [(起始列, 起始欄, 區塊), ...]，
+    隨機挑 sample 個區塊 (None = 全部) 以一次 get_ranges 讀回比對，讀取量只跟寫入量有關。
+    回傳 {'ranges': 抽查區塊數, 'rows': 抽查列數, 'mismatches': [(起始列, 列數, [不符的列號]), ...]}
+    """
+    picked = list(written)
+    if sample is not None and len(picked) > sample: picked = sorted(rng.sample(picked, sample), key=lambda r: r[0])
+    if not picked: return {'ranges': 0, 'rows': 0, 'mismatches': []}
+    blocks = storage.get_ranges(dataset, [(row, col, len(block), max(len(r) for r in block) or 1) for row, col, block in picked])
+    mismatches = []
+    for (row, col, block), got in zip(picked, blocks):
+        got = list(got) + [[]] * (len(block) - len(got))
+        bad = [row + i for i, r in enumerate(block) if _trim(r) != _trim(got[i])]
+        if bad: mismatches.append((row, len(block), bad))
+    return {'ranges': len(picked), 'rows': sum(len(b) for _, _, b in picked), 'mismatches': mismatches}
+
+
+class BaseStorage:
+    """
+    儲存介面。updates 格式為 [(起始列, 起始欄, [[值, ...], ...]), ...]，列/欄從 1 開始。
+    """
+    name = "base"
+
+    def write_delta(self, dataset, old_values, new_values):
+        """
+        差異寫入：變動的列用一次 update_ranges，新列用一次 append_rows，
+        寫入量只跟「這次有變的資料」有關，不再整張表 clear + 重寫。
+        回傳的 written 為實際寫入的區塊 [(起始列, 起始欄, 區塊), ...]，供 verify_ranges 讀回抽查。
+        """
+        if not old_values:
+            self.replace_values(dataset, new_values)
+            written = [(1, 1, [[to_cell(v) for v in row] for row in new_values])] if new_values else []
+            return {'changed': 0, 'new': len(new_values), 'unchanged': 0, 'written': written}
+        plan = plan_row_delta(old_values, new_values)
+        updates = group_row_ranges(plan['changed'])
+        self.update_ranges(dataset, updates)
+        self.append_rows(dataset, plan['new'])
+        # 附加的列接在舊表最後一列之後
+        written = updates + ([(len(old_values) + 1, 1, plan['new'])] if plan['new'] else [])
+        return {'changed': len(plan['changed']), 'new': len(plan['new']), 'unchanged': plan['unchanged'], 'written': written}
+
+    def get_values(self, dataset):
+        raise NotImplementedError
+
+    def get_ranges(self, dataset, ranges):
+        """
+        只讀取指定範圍：ranges = [(起始列, 起始欄, 列數 或 None=到底, 欄數 或 None=到底), ...]
+        回傳與 ranges 對應的二維區塊串列。預設實作讀整張表後切片，後端可覆寫成真正的部分讀取。
+        """
+        values = self.get_values(dataset)
+        return [slice_range(values, *r) for r in ranges]
+
+    def replace_values(self, dataset, values):
+        raise NotImplementedError
+
+    def append_rows(self, dataset, rows):
+        raise NotImplementedError
+
+    def update_ranges(self, dataset, updates):
+        raise NotImplementedError
+
+
+# ==========================================
+# Google Sheets
+# ==========================================
+class SheetRegistry:
+    """
+    Spreadsheet / Worksheet 物件快取：每個試算表名稱只 client.open() 一次 (每次 open 都是一次 Drive 搜尋)，
+    之後以資料集代號直接取用。缺少的分頁 (記憶庫、廣告費用) 也統一在這裡建立。
+    """
+
+    def __init__(self, client, locations):
+        self.client = client
+        self.locations = locations
+        self._lock = threading.Lock()
+        self._spreadsheets = {}
+        self._worksheets = {}
+        self.lookups = 0     # 被要求取得分頁/試算表的次數
+        self.opens = 0       # 實際呼叫 client.open() 的次數
+        self.created = 0     # 自動建立的分頁數
+
+    def spreadsheet(self, name):
+        with self._lock:
+            self.lookups += 1
+            if name not in self._spreadsheets:
+                self._spreadsheets[name] = self.client.open(name)
+                self.opens += 1
+            return self._spreadsheets[name]
+
+    def worksheet(self, dataset):
+        with self._lock:
+            ws = self._worksheets.get(dataset)
+            if ws is not None:
+                self.lookups += 1
+                return ws
+        spreadsheet_name, tab = dataset_location(self.locations, dataset)
+        ws = self._resolve(dataset, self.spreadsheet(spreadsheet_name), tab)
+        with self._lock: self._worksheets[dataset] = ws
+        return ws
+
+    def _resolve(self, dataset, sh, tab):
+        import gspread
+        if dataset == DATASET_LEGACY:
+            # 舊表的分頁不固定，找第一個含「編碼/ID/成本」表頭的分頁
+            for ws in sh.worksheets():
+                row1 = str(ws.row_values(1))
+                if "編碼" in row1 or "ID" in row1 or "成本" in row1: return ws
+            return sh.sheet1
+        if tab is None: return sh.sheet1
+        try: return sh.worksheet(tab)
+        except gspread.exceptions.WorksheetNotFound:
+            headers = DATASET_HEADERS.get(dataset, [])
+            # 分片的表頭由寫入端決定，欄數先預留
+            cols = 26 if shard_month(dataset) is not None else (len(headers) or 3)
+            ws = sh.add_worksheet(title=tab, rows=500, cols=cols)
+            if headers: ws.append_row(headers)
+            with self._lock: self.created += 1
+            return ws
+
+    def reset(self, dataset=None):
+        """丟棄快取的物件 (分頁被刪除或改名時使用)"""
+        with self._lock:
+            if dataset is None: self._spreadsheets.clear(); self._worksheets.clear()
+            else: self._worksheets.pop(dataset, None)
+
+    def stats(self):
+        with self._lock:
+            return {'lookups': self.lookups, 'opens': self.opens, 'saved': self.lookups - self.opens, 'created': self.created}
+
+
+class SheetsStorage(BaseStorage):
+    """
+    locations: {資料集: (試算表名稱, 分頁名稱 或 None=第一個分頁)}
+    舊表 (DATASET_LEGACY) 的分頁不固定，會自動搜尋第一個含「編碼/ID/成本」表頭的分頁。
+    """
+    name = "sheets"
+
+    def __init__(self, client, locations):
+        self.client = client
+        self.locations = locations
+        self.registry = SheetRegistry(client, locations)
+
+    def _worksheet(self, dataset):
+        return self.registry.worksheet(dataset)
+
+    def get_values(self, dataset):
+        data = self._worksheet(dataset).get_all_values()
+        if dataset == DATASET_LEGACY and len(data) <= 2: return []
+        return data
+
+    def get_ranges(self, dataset, ranges):
+        if not ranges: return []
+        from gspread.utils import rowcol_to_a1
+        ws = self._worksheet(dataset)
+        a1s = []
+        for row, col, n_rows, n_cols in ranges:
+            if n_cols is not None:
+                # 例如 P2:P (整欄到底) 或 A5:Q7
+                end_col = rowcol_to_a1(1, col + n_cols - 1).rstrip("0123456789")
+                a1s.append(f"{rowcol_to_a1(row, col)}:{end_col}{'' if n_rows is None else row + n_rows - 1}")
+            else:
+                # 整列 (例如 5:7)，欄一律從 A 開始
+                end_row = ws.row_count if n_rows is None else row + n_rows - 1
+                a1s.append(f"{row}:{end_row}")
+        blocks = ws.batch_get(a1s)
+        out = []
+        for (row, col, n_rows, n_cols), block in zip(ranges, blocks):
+            block = [list(r) for r in block]
+            out.append(block if n_cols is not None else slice_range(block, 1, col))
+        return out
+
+    def replace_values(self, dataset, values):
+        ws = self._worksheet(dataset)
+        ws.clear()
+        if not values: return
+        rows = [[to_cell(v) for v in row] for row in values]
+        # 超出分頁格數時先擴大，否則 update 會被拒絕
+        if len(rows) > ws.row_count: ws.resize(rows=len(rows))
+        try: ws.update(range_name='A1', values=rows)   # gspread v6
+        except TypeError: ws.update('A1', rows)          # 舊版 gspread
+
+    def append_rows(self, dataset, rows):
+        if not rows: return
+        self._worksheet(dataset).append_rows([[to_cell(v) for v in row] for row in rows])
+
+    def update_ranges(self, dataset, updates):
+        if not updates: return
+        from gspread.utils import rowcol_to_a1
+        data = []
+        for row, col, block in updates:
+            width = max(len(r) for r in block)
+            a1 = f"{rowcol_to_a1(row, col)}:{rowcol_to_a1(row + len(block) - 1, col + width - 1)}"
+            data.append({'range': a1, 'values': [[to_cell(v) for v in r] for r in block]})
+        self._worksheet(dataset).batch_update(data)
+
+
+# ==========================================
+# 本機 SQLite
+# ==========================================
+class LocalStorage(BaseStorage):
+    """
+    每個資料集的每一列存成一筆 (dataset, row_no, JSON 陣列)，row_no 與試算表列號相同。
+    """
+    name = "local"
+
+    def __init__(self, path="local_store.sqlite"):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS sheet_rows ("
+            "dataset TEXT NOT NULL, row_no INTEGER NOT NULL, data TEXT NOT NULL, "
+            "PRIMARY KEY (dataset, row_no))"
+        )
+        self._conn.commit()
+
+    def _read(self, dataset):
+        cur = self._conn.execute("SELECT data FROM sheet_rows WHERE dataset = ? ORDER BY row_no", (dataset,))
+        return [json.loads(r[0]) for r in cur.fetchall()]
+
+    def _write_rows(self, dataset, numbered_rows):
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO sheet_rows (dataset, row_no, data) VALUES (?, ?, ?)",
+            [(dataset, n, json.dumps(row, ensure_ascii=False)) for n, row in numbered_rows]
+        )
+
+    def get_values(self, dataset):
+        with self._lock:
+            values = self._read(dataset)
+            if not values and dataset in DATASET_HEADERS:
+                values = [list(DATASET_HEADERS[dataset])]
+                self._write_rows(dataset, [(1, values[0])])
+                self._conn.commit()
+            return values
+
+    def get_ranges(self, dataset, ranges):
+        out = []
+        with self._lock:
+            for row, col, n_rows, n_cols in ranges:
+                row, col = int(row), int(col)
+                end = row + int(n_rows) - 1 if n_rows is not None else None
+                sql = "SELECT row_no, data FROM sheet_rows WHERE dataset = ? AND row_no >= ?"
+                args = [dataset, row]
+                if end is not None: sql += " AND row_no <= ?"; args.append(end)
+                found = {n: json.loads(d) for n, d in self._conn.execute(sql + " ORDER BY row_no", args).fetchall()}
+                last = max(found) if found else row - 1
+                rows = [found.get(n, []) for n in range(row, (end if end is not None else last) + 1)]
+                out.append(slice_range(rows, 1, col, None, n_cols))
+        return out
+
+    def replace_values(self, dataset, values):
+        with self._lock:
+            self._conn.execute("DELETE FROM sheet_rows WHERE dataset = ?", (dataset,))
+            self._write_rows(dataset, [(i + 1, [to_cell(v) for v in row]) for i, row in enumerate(values)])
+            self._conn.commit()
+
+    def append_rows(self, dataset, rows):
+        if not rows: return
+        with self._lock:
+            cur = self._conn.execute("SELECT COALESCE(MAX(row_no), 0) FROM sheet_rows WHERE dataset = ?", (dataset,))
+            start = cur.fetchone()[0] + 1
+            self._write_rows(dataset, [(start + i, [to_cell(v) for v in row]) for i, row in enumerate(rows)])
+            self._conn.commit()
+
+    def update_ranges(self, dataset, updates):
+        if not updates: return
+        with self._lock:
+            touched = {}
+            for row, col, block in updates:
+                row, col = int(row), int(col)
+                for r_off in range(len(block)):
+                    n = row + r_off
+                    if n not in touched:
+                        cur = self._conn.execute("SELECT data FROM sheet_rows WHERE dataset = ? AND row_no = ?", (dataset, n))
+                        found = cur.fetchone()
+                        touched[n] = json.loads(found[0]) if found else []
+                for r_off, block_row in enumerate(block):
+                    holder = [touched[row + r_off]]
+                    apply_range(holder, 1, col, [block_row])
+            self._write_rows(dataset, sorted(touched.items()))
+            self._conn.commit()
+
+
+# ==========================================
+# 記憶體 (離線 / 測試)
+# ==========================================
+class MemoryStorage(BaseStorage):
+    name = "memory"
+
+    def __init__(self, seed=None):
+        self._lock = threading.Lock()
+        self._data = {k: [list(r) for r in v] for k, v in (seed or {}).items()}
+
+    def get_values(self, dataset):
+        with self._lock:
+            if dataset not in self._data and dataset in DATASET_HEADERS:
+                self._data[dataset] = [list(DATASET_HEADERS[dataset])]
+            return [list(r) for r in self._data.get(dataset, [])]
+
+    def replace_values(self, dataset, values):
+        with self._lock:
+            self._data[dataset] = [[to_cell(v) for v in row] for row in values]
+
+    def append_rows(self, dataset, rows):
+        with self._lock:
+            self._data.setdefault(dataset, []).extend([[to_cell(v) for v in row] for row in rows])
+
+    def update_ranges(self, dataset, updates):
+        with self._lock:
+            values = self._data.setdefault(dataset, [])
+            for row, col, block in updates: apply_range(values, row, col, block)
+
+
+# ==========================================
+# 配額排程 (見 quota.py)
+# ==========================================
+class ScheduledStorage(BaseStorage):
+    """
+    讓另一個 storage 的每個讀寫操作都經過 RequestScheduler (配額、重試、讀取優先)。
+    write_delta 沿用 BaseStorage 的實作，拆成的 update_ranges / append_rows 會各自排程。
+    """
+
+    def __init__(self, inner, scheduler):
+        self.inner = inner
+        self.scheduler = scheduler
+        self.name = inner.name
+
+    def __getattr__(self, attr):
+        # registry 等其他屬性直接取自內層
+        return getattr(self.inner, attr)
+
+    def get_values(self, dataset):
+        return self.scheduler.read(self.inner.get_values, dataset)
+
+    def get_ranges(self, dataset, ranges):
+        return self.scheduler.read(self.inner.get_ranges, dataset, ranges)
+
+    def replace_values(self, dataset, values):
+        return self.scheduler.write(self.inner.replace_values, dataset, values)
+
+    def append_rows(self, dataset, rows):
+        if not rows: return
+        return self.scheduler.write(self.inner.append_rows, dataset, rows)
+
+    def update_ranges(self, dataset, updates):
+        if not updates: return
+        return self.scheduler.write(self.inner.update_ranges, dataset, updates)
+
+
+# ==========================================
+# 建立 / 同步
+# ==========================================
+def create_storage(backend, client_factory=None, locations=None, path=None, scheduler=None):
+    """
+    backend: "sheets" (預設) / "local" / "memory"
+    client_factory: 回傳 gspread client 的函式 (只有 sheets 需要)
+    scheduler: RequestScheduler，給定時 sheets 的所有讀寫都經過它
+    """
+    backend = (backend or "sheets").lower()
+    if backend == "local": return LocalStorage(path or "local_store.sqlite")
+    if backend == "memory": return MemoryStorage()
+    if backend == "sheets":
+        storage = SheetsStorage(client_factory(), locations)
+        return ScheduledStorage(storage, scheduler) if scheduler is not None else storage
+    raise ValueError(f"未知的儲存後端：{backend}")
+
+
+def sync_storage(source, target, datasets=None):
+    """
+    將 source 的資料集整份覆寫到 target，回傳 {資料集: 列數}
+    包含訂單分片索引時，索引列出的每個月分片也一併同步。
+    """
+    datasets = list(datasets or ALL_DATASETS)
+    if DATASET_ORDER_SHARDS in datasets:
+        datasets += [shard_dataset(row[0]) for row in source.get_values(DATASET_ORDER_SHARDS)[1:] if row and row[0]]
+    result = {}
+    for ds in datasets:
+        values = source.get_values(ds)
+        if not values: continue
+        target.replace_values(ds, values)
+        result[ds] = len(values)
+    return result
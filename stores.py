@@ -0,0 +1,238 @@
+# ==========================================
+# 快取資料庫 (常駐於程序內，所有使用者共用)
+# ==========================================
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from storage import DATASET_AD_COST, DATASET_COST, DATASET_MEMORY, group_cell_ranges
+
+
+class MemoryRuleStore:
+    """
+    歸戶記憶庫快取。
+    規則以 (蝦皮商品名稱, 蝦皮規格名稱) 為 key，查詢與重複檢查都是 O(1)。
+    新規則先放進緩衝區，累積到 flush_size 筆或超過 flush_interval 秒後，
+    才用一次 append_rows 寫回；批次作業結束時也應呼叫 flush()。
+    """
+
+    def __init__(self, storage, cache, flush_size=50, flush_interval=30):
+        self.storage = storage
+        self.cache = cache
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self._lock = threading.RLock()
+        self._rules = None
+        self._pending = []
+        self._pending_since = None
+
+    def _load(self):
+        # 重新讀取前先寫回緩衝區，避免遺失尚未寫入的規則
+        self.flush()
+        data = self.storage.get_values(DATASET_MEMORY)
+        rules = {}
+        for row in data[1:]:
+            try:
+                # 支援舊版(3欄) 與 新版(4欄)
+                if len(row) >= 4:
+                    rules[(row[0].strip(), row[1].strip())] = {'sku': row[2], 'cost': float(row[3])}
+                elif len(row) == 3:
+                    # 舊版資料，規格視為空字串
+                    rules[(row[0].strip(), "")] = {'sku': row[1], 'cost': float(row[2])}
+            except ValueError: continue
+        return rules
+
+    def _ensure_loaded(self):
+        # 規則字典本身存放在資料集快取中，世代改變或逾時才會重新讀取
+        self._rules = self.cache.get(DATASET_MEMORY, self._load)
+
+    def rules(self):
+        """回傳目前所有規則 (含尚未寫回的)"""
+        with self._lock:
+            self._ensure_loaded()
+            self._maybe_flush()
+            return dict(self._rules)
+
+    def lookup(self, shopee_name, shopee_option=""):
+        with self._lock:
+            self._ensure_loaded()
+            return self._rules.get((str(shopee_name).strip(), str(shopee_option).strip()))
+
+    def add(self, shopee_name, shopee_option, real_sku, real_cost):
+        """新增規則 (已存在則略過)，回傳是否為新規則"""
+        key = (str(shopee_name).strip(), str(shopee_option).strip())
+        with self._lock:
+            self._ensure_loaded()
+            if key in self._rules: return False
+            self._rules[key] = {'sku': real_sku, 'cost': float(real_cost)}
+            # 寫入格式: 名稱, 規格, 真實SKU, 真實成本
+            self._pending.append([key[0], key[1], real_sku, real_cost])
+            if self._pending_since is None: self._pending_since = time.time()
+            self._maybe_flush()
+            return True
+
+    def _maybe_flush(self):
+        if not self._pending: return
+        if len(self._pending) >= self.flush_size or time.time() - self._pending_since >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        """將緩衝區一次寫回，回傳寫入筆數 (失敗時保留緩衝區並拋出例外)"""
+        with self._lock:
+            if not self._pending: return 0
+            rows = list(self._pending)
+            self.storage.append_rows(DATASET_MEMORY, rows)
+            self._pending = []
+            self._pending_since = None
+            return len(rows)
+
+    def pending_count(self):
+        with self._lock: return len(self._pending)
+
+    def invalidate(self):
+        """寫回緩衝區後丟棄快取，下次使用時重新讀取"""
+        with self._lock:
+            self.flush()
+            self.cache.invalidate(DATASET_MEMORY)
+
+
+def parse_sku_label(label):
+    """介面傳來的是 "商品名稱 | 成本$XXX" 或 "商品名稱"，取出商品名稱"""
+    label = str(label)
+    if " | 成本$" in label: return label.split(' | 成本$')[0].strip()
+    return label.strip()
+
+
+class MasterCostIndex:
+    """
+    商品編碼表的 商品名稱 → 列號 索引。
+    成本表版本即資料集快取中 DATASET_COST 的世代，每個版本只建立一次；
+    成本表有任何寫入時都會作廢該世代。
+    load_values 回傳成本表的原始 values (與成本查詢表共用資料集快取中的同一次讀取)；None = 直接讀取 storage。
+    同名商品以第一筆為準 (與舊版逐列搜尋的結果相同)。
+    """
+
+    def __init__(self, storage, cache, load_values=None):
+        self.storage = storage
+        self.cache = cache
+        self.load_values = load_values
+        self._lock = threading.Lock()
+        self._built_version = None
+        self._rows = {}
+        self._cost_col = None
+
+    def _ensure_built(self):
+        version = self.cache.generation(DATASET_COST)
+        if self._built_version == version: return
+        data = self.load_values() if self.load_values else self.storage.get_values(DATASET_COST)
+        rows, cost_col = {}, None
+        if data:
+            headers = [str(h).strip() for h in data[0]]
+            name_col = headers.index('商品名稱') if '商品名稱' in headers else (headers.index('商品') if '商品' in headers else None)
+            if name_col is not None and '成本' in headers:
+                cost_col = headers.index('成本') + 1
+                for i, row in enumerate(data[1:], start=2):
+                    if len(row) > name_col: rows.setdefault(str(row[name_col]).strip(), i)
+        self._rows, self._cost_col = rows, cost_col
+        self._built_version = version
+
+    def row_of(self, sku_name):
+        with self._lock:
+            self._ensure_built()
+            return self._rows.get(parse_sku_label(sku_name))
+
+    def update_costs(self, pairs):
+        """
+        pairs = [(商品名稱或選單標籤, 新成本), ...]，一次 update_ranges 寫回。
+        回傳 (已更新的商品名稱, 找不到的商品名稱)
+        """
+        with self._lock:
+            self._ensure_built()
+            if self._cost_col is None: return [], [parse_sku_label(n) for n, _ in pairs]
+            latest = {}
+            missing = []
+            for sku_name, new_cost in pairs:
+                name = parse_sku_label(sku_name)
+                if name in self._rows: latest[name] = new_cost   # 同一商品以最後一次為準
+                else: missing.append(name)
+            cells = [(self._rows[name], self._cost_col, cost) for name, cost in latest.items()]
+            if cells:
+                self.storage.update_ranges(DATASET_COST, group_cell_ranges(cells))
+                # 成本變了，成本表快取需重新載入 (列號沒變，索引可沿用)
+                self.cache.invalidate(DATASET_COST)
+                self._built_version = self.cache.generation(DATASET_COST)
+            return list(latest), missing
+
+
+class AdCostStore:
+    """
+    廣告費用紀錄快取 (存放於資料集快取，跨畫面共用)。
+    - 日期 → 列號索引：查詢與 upsert 定位都是 O(1)
+    - 依日期排序的累計陣列：任意日期區間加總只需兩次二分搜尋
+    upsert 一天只送一個範圍寫入；多天則合併成一次 update_ranges + 一次 append_rows。
+    """
+    COLUMNS = ["日期", "廣告費用", "登錄時間"]
+
+    def __init__(self, storage, cache, clock):
+        self.storage = storage
+        self.cache = cache
+        self.clock = clock   # 回傳目前時間 (寫入登錄時間用)
+
+    def _load(self):
+        data = self.storage.get_values(DATASET_AD_COST)
+        if len(data) <= 1: df = pd.DataFrame(columns=self.COLUMNS)
+        else: df = pd.DataFrame(data[1:], columns=data[0])
+        # Clean up
+        df['廣告費用'] = pd.to_numeric(df['廣告費用'].astype(str).str.replace(',', ''), errors='coerce').fillna(0)
+        df['日期'] = pd.to_datetime(df['日期'], format='%Y-%m-%d', errors='coerce').dt.date
+
+        # 同一天有多筆時，以第一筆為 upsert 目標 (與舊版逐列搜尋一致)
+        rows, first = {}, {}
+        for i, row in enumerate(data[1:], start=2):
+            if row and row[0] not in rows: rows[row[0]] = i
+        valid = df.dropna(subset=['日期'])
+        for d, cost in zip(valid['日期'], valid['廣告費用']): first.setdefault(d, float(cost))
+
+        daily = valid.groupby('日期')['廣告費用'].sum().sort_index()
+        ordinals = np.array([d.toordinal() for d in daily.index], dtype=np.int64)
+        cumsum = np.concatenate([[0.0], daily.to_numpy(dtype=float).cumsum()])
+        return {'df': df, 'rows': rows, 'first': first, 'ordinals': ordinals, 'cumsum': cumsum}
+
+    def _state(self):
+        return self.cache.get(DATASET_AD_COST, self._load)
+
+    def frame(self):
+        return self._state()['df']
+
+    def cost_on(self, day):
+        return self._state()['first'].get(day)
+
+    def range_sum(self, start, end):
+        """start ~ end (含) 的廣告費用總和"""
+        state = self._state()
+        lo = np.searchsorted(state['ordinals'], start.toordinal(), side='left')
+        hi = np.searchsorted(state['ordinals'], end.toordinal(), side='right')
+        if hi <= lo: return 0.0
+        return float(state['cumsum'][hi] - state['cumsum'][lo])
+
+    def upsert(self, day, cost):
+        return self.upsert_many({day: cost})
+
+    def upsert_many(self, costs):
+        """costs = {date: 金額}，已有的日期更新、沒有的新增，回傳 (更新天數, 新增天數)"""
+        if not costs: return 0, 0
+        rows = self._state()['rows']
+        now_str = self.clock().strftime("%Y-%m-%d %H:%M:%S")
+        updates, new_rows = [], []
+        for day in sorted(costs):
+            day_str = day.strftime("%Y-%m-%d")
+            if day_str in rows: updates.append((rows[day_str], 2, [[costs[day], now_str]]))
+            else: new_rows.append([day_str, costs[day], now_str])
+        try:
+            self.storage.update_ranges(DATASET_AD_COST, updates)
+            self.storage.append_rows(DATASET_AD_COST, new_rows)
+        finally:
+            self.cache.invalidate(DATASET_AD_COST)
+        return len(updates), len(new_rows)